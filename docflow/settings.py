@@ -91,11 +91,59 @@ WSGI_APPLICATION = 'docflow.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# База данных задается переменными окружения. По умолчанию используется SQLite (разработка,
+# небольшие установки); для одновременной загрузки документов многими пользователями - PostgreSQL:
+# DOCFLOW_DB_ENGINE=postgresql DOCFLOW_DB_NAME=... DOCFLOW_DB_USER=... DOCFLOW_DB_PASSWORD=... DOCFLOW_DB_HOST=...
+DB_ENGINE = os.environ.get('DOCFLOW_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DOCFLOW_DB_NAME', 'docflow'),
+            'USER': os.environ.get('DOCFLOW_DB_USER', 'docflow'),
+            'PASSWORD': os.environ.get('DOCFLOW_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DOCFLOW_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DOCFLOW_DB_PORT', '5432'),
+            # Постоянные соединения (секунды); перед повторным использованием соединение проверяется
+            'CONN_MAX_AGE': int(os.environ.get('DOCFLOW_DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    # Встроенный пул соединений psycopg 3 (pip install "psycopg[pool]"), заменяет CONN_MAX_AGE
+    if os.environ.get('DOCFLOW_DB_POOL', '').lower() in ('1', 'true', 'yes'):
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DOCFLOW_DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('DOCFLOW_DB_POOL_MAX_SIZE', '10')),
+            'timeout': 10,
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DOCFLOW_DB_NAME') or BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Сколько секунд ждать освобождения блокировки записи вместо ошибки "database is locked"
+                'timeout': 20,
+                # Блокировка записи берется в начале транзакции: иначе при одновременной записи
+                # SQLite возвращает ошибку сразу, не дожидаясь timeout
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
+
+# PRAGMA, выполняемые при открытии каждого соединения с SQLite (documents/signals.py).
+# WAL позволяет читать во время записи, synchronous=NORMAL в режиме WAL безопасен и
+# не вызывает fsync при каждой фиксации транзакции
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,  # ms
+    'cache_size': -32000,  # KiB (32MB)
+    'temp_store': 'MEMORY',
+    'mmap_size': 256 * 1024 * 1024,
 }
 
 
@@ -144,9 +192,158 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 # FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 
-# Maximum upload size (20MB)
-DATA_UPLOAD_MAX_MEMORY_SIZE = 20971520  # 20MB
-FILE_UPLOAD_MAX_MEMORY_SIZE = 20971520  # 20MB
+# Файлы больше FILE_UPLOAD_MAX_MEMORY_SIZE при загрузке сохраняются во временный файл,
+# а не держатся в памяти процесса. Большие файлы загружаются по частям (см. ниже)
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
+
+# Возобновляемая загрузка по частям (/api/uploads/): части записываются во временный
+# файл в UPLOAD_SESSION_DIR, незавершенные загрузки удаляются через UPLOAD_SESSION_TTL
+UPLOAD_SESSION_DIR = os.path.join(BASE_DIR, 'upload_sessions')
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB, рекомендуемый размер части для клиента
+UPLOAD_CHUNK_MAX_SIZE = 8 * 1024 * 1024  # 8MB
+UPLOAD_SESSION_TTL = 24 * 60 * 60  # seconds
+# Максимальный размер файла при загрузке по частям (обычная загрузка ограничена 10MB)
+UPLOAD_SESSION_MAX_SIZE = 1024 * 1024 * 1024  # 1GB
+
+# Пакетная загрузка (POST /api/documents/bulk/): максимум файлов в одном запросе,
+# включая файлы внутри ZIP-архивов
+BULK_UPLOAD_MAX_FILES = 500
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_UPLOAD_MAX_FILES
+
+# Размер блока при потоковой отдаче файлов документов
+FILE_STREAM_CHUNK_SIZE = 64 * 1024  # 64KB
+
+# Асинхронные представления для скачивания файлов и поиска (documents/async_views.py).
+# Включайте при запуске под ASGI (uvicorn docflow.asgi:application): одновременные
+# загрузки обслуживаются циклом событий, а файлы читаются пулом из FILE_STREAM_THREADS потоков
+ASYNC_VIEWS = os.environ.get('DOCFLOW_ASYNC_VIEWS', '0') == '1'
+FILE_STREAM_THREADS = 4
+
+# Передача файлов фронтенд-прокси после проверки прав доступа:
+# None - файлы отдает Django, 'nginx' - заголовок X-Accel-Redirect,
+# 'sendfile' - заголовок X-Sendfile (Apache mod_xsendfile, lighttpd)
+FILE_OFFLOAD_MODE = os.environ.get('DOCFLOW_FILE_OFFLOAD_MODE') or None
+# internal-location nginx, которая указывает на MEDIA_ROOT
+FILE_OFFLOAD_NGINX_PREFIX = '/protected-media/'
+
+# Фоновое извлечение текста (см. manage.py process_extraction_jobs)
+# При EXTRACTION_ASYNC = False текст извлекается сразу при загрузке
+EXTRACTION_ASYNC = True
+EXTRACTION_WORKER_CONCURRENCY = 2  # worker processes
+EXTRACTION_TIMEOUT = 300  # seconds per attempt
+EXTRACTION_MAX_ATTEMPTS = 3
+EXTRACTION_RETRY_DELAY = 60  # seconds, multiplied by the attempt number
+EXTRACTION_POLL_INTERVAL = 2  # seconds
+# Каждое извлечение выполняется в отдельном процессе с ограничением памяти
+# (адресного пространства); экстракторы могут задать собственные лимиты.
+# Текст длиннее EXTRACTION_MAX_CHARS обрезается, документ помечается text_truncated
+EXTRACTION_MEMORY_LIMIT = 1024 * 1024 * 1024
+EXTRACTION_MAX_CHARS = 20_000_000
+
+# Извлеченный текст хранится в отдельной таблице (DocumentContent). Тексты от
+# TEXT_COMPRESSION_MIN_CHARS символов сжимаются zlib (None - не сжимать)
+TEXT_COMPRESSION_MIN_CHARS = 64 * 1024
+TEXT_COMPRESSION_LEVEL = 6
+
+# Нечеткий поиск (?fuzzy=1), устойчивый к ошибкам OCR: слово запроса совпадает со словами
+# документов, у которых доля общих триграмм (как similarity в pg_trgm) не ниже
+# SEARCH_FUZZY_THRESHOLD. В SQLite слово запроса заменяется не более чем
+# SEARCH_FUZZY_MAX_EXPANSIONS похожими словами из словаря индекса
+SEARCH_FUZZY_THRESHOLD = 0.4
+SEARCH_FUZZY_MAX_EXPANSIONS = 20
+
+# Кэш результатов поиска: ключ - пользователь, нормализованный запрос и страница.
+# При изменении документов пользователя его записи становятся недоступны (счетчик поколений).
+# По умолчанию кэш в памяти процесса, DOCFLOW_SEARCH_CACHE=file - в файлах, общий для всех процессов
+SEARCH_CACHE_ENABLED = True
+SEARCH_CACHE_TIMEOUT = 300  # seconds
+SEARCH_CACHE_BACKEND = os.environ.get('DOCFLOW_SEARCH_CACHE', 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if SEARCH_CACHE_BACKEND == 'file':
+    CACHES['search'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DOCFLOW_SEARCH_CACHE_DIR', str(BASE_DIR / 'cache' / 'search')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+else:
+    CACHES['search'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'docflow-search',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+
+# Параллельное извлечение текста из PDF: страницы делятся на части по
+# PDF_PAGES_PER_SHARD и обрабатываются в пуле из PDF_EXTRACTION_WORKERS процессов.
+# Страницы, где PyPDF2 нашел меньше PDF_PAGE_MIN_CHARS символов, повторно читаются pdfminer
+PDF_EXTRACTION_WORKERS = min(4, os.cpu_count() or 1)
+PDF_PAGES_PER_SHARD = 25
+PDF_PAGE_MIN_CHARS = 20
+
+# OCR страниц PDF без текстового слоя (сканов). Страницы растеризуются
+# (pdftoppm, если установлен, иначе берутся встроенные изображения) и распознаются
+# tesseract в пуле из PDF_OCR_WORKERS процессов с таймаутом на страницу.
+# PDF_OCR_TOTAL_TIMEOUT ограничивает OCR всего документа и должен быть меньше
+# EXTRACTION_TIMEOUT: по его истечении сохраняются уже распознанные страницы
+# (текст помечается неполным), а не прерывается вся задача
+PDF_OCR_ENABLED = True
+PDF_OCR_WORKERS = 2
+PDF_OCR_PAGE_TIMEOUT = 60  # seconds
+PDF_OCR_TOTAL_TIMEOUT = int(EXTRACTION_TIMEOUT * 0.8)  # seconds
+PDF_OCR_DPI = 200
+PDF_OCR_MAX_PAGES = 200
+
+# Извлечение текста из TXT/MD: кодировка определяется по первым
+# TEXT_ENCODING_SAMPLE_BYTES байтам, файл читается потоково частями.
+# TEXT_EXTRACTION_MAX_CHARS ограничивает длину сохраняемого текста (None - без ограничения)
+TEXT_ENCODING_SAMPLE_BYTES = 64 * 1024
+TEXT_EXTRACTION_CHUNK_CHARS = 256 * 1024
+TEXT_EXTRACTION_MAX_CHARS = 10_000_000
+
+# Извлечение текста из XLSX: строки читаются пачками по XLSX_ROW_BATCH,
+# для каждого листа ограничено число строк, непустых ячеек и символов
+XLSX_ROW_BATCH = 500
+XLSX_MAX_ROWS_PER_SHEET = 100_000
+XLSX_MAX_CELLS_PER_SHEET = 1_000_000
+XLSX_MAX_CHARS_PER_SHEET = 5_000_000
+
+# Дисковый кэш результатов извлечения текста (ключ - SHA-256 файла и версия экстрактора)
+EXTRACTION_CACHE_ENABLED = True
+EXTRACTION_CACHE_DIR = BASE_DIR / 'cache' / 'extraction'
+EXTRACTION_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# При превышении лимита удаляются давно не использованные записи, пока кэш
+# не станет меньше EXTRACTION_CACHE_LOW_WATER от лимита
+EXTRACTION_CACHE_LOW_WATER = 0.9
+# Как часто (в секундах) процесс перечитывает каталог кэша, чтобы учесть записи других процессов
+EXTRACTION_CACHE_RESCAN_INTERVAL = 3600
+
+# Миниатюры и превью первой страницы (изображения и PDF). Создаются фоновым воркером
+# вместе с извлечением текста (или отдельной задачей при первом запросе) в дочернем процессе
+# с ограничениями PREVIEW_TIMEOUT и PREVIEW_MEMORY_LIMIT и хранятся в MEDIA_ROOT/PREVIEW_DIR
+# по хешу содержимого файла. PREVIEW_SIZES - наибольшая сторона в пикселях для каждого размера
+PREVIEW_ENABLED = True
+PREVIEW_DIR = 'previews'
+PREVIEW_SIZES = {
+    'thumb': 240,
+    'page': 1200,
+}
+PREVIEW_FORMAT = 'webp'  # 'webp' или 'jpeg'
+PREVIEW_QUALITY = 80
+PREVIEW_PDF_DPI = 150
+PREVIEW_TIMEOUT = 60  # seconds
+PREVIEW_MEMORY_LIMIT = 512 * 1024 * 1024
+
+# Обработчики загрузки считают SHA-256 файла во время приема
+# (файлы хранятся по хешу содержимого, одинаковые файлы не дублируются)
+FILE_UPLOAD_HANDLERS = [
+    'documents.storage.HashingMemoryFileUploadHandler',
+    'documents.storage.HashingTemporaryFileUploadHandler',
+]
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -162,4 +359,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
+    # Курсорная (keyset) пагинация списка документов и результатов поиска
+    'DEFAULT_PAGINATION_CLASS': 'documents.pagination.DocumentCursorPagination',
+    'PAGE_SIZE': 25,
 }
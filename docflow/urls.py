@@ -22,7 +22,8 @@ from django.views.generic import RedirectView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', include('documents.urls')),
+    # Под ASGI скачивание файлов и поиск обслуживают асинхронные представления
+    path('', include('documents.async_urls' if settings.ASYNC_VIEWS else 'documents.urls')),
     path('api-auth/', include('rest_framework.urls')),
 ]
 
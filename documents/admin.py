@@ -1,20 +1,40 @@
 from django.contrib import admin
-from .models import Document
+from .models import Blob, Document, ExtractionJob, UploadSession
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('title', 'file_format', 'upload_date', 'size')
-    list_filter = ('file_format', 'upload_date')
-    search_fields = ('title', 'text_content')
-    readonly_fields = ('upload_date', 'size', 'text_content')
+    list_display = ('title', 'file_format', 'upload_date', 'size', 'extraction_status')
+    list_filter = ('file_format', 'upload_date', 'extraction_status')
+    search_fields = ('title', 'content__text')
+    readonly_fields = ('upload_date', 'size', 'text_content', 'text_truncated', 'extraction_status')
     fieldsets = (
         (None, {
-            'fields': ('title', 'file', 'file_format')
+            'fields': ('title', 'file', 'original_filename', 'file_format')
         }),
         ('Metadata', {
             'fields': ('upload_date', 'size')
         }),
         ('Content', {
-            'fields': ('text_content',)
+            'fields': ('extraction_status', 'text_truncated', 'text_content')
         }),
     )
+
+@admin.register(ExtractionJob)
+class ExtractionJobAdmin(admin.ModelAdmin):
+    list_display = ('document', 'kind', 'status', 'attempts', 'max_attempts', 'available_at', 'updated_at')
+    list_filter = ('kind', 'status')
+    # Название документа выводится в каждой строке
+    list_select_related = ('document',)
+    readonly_fields = ('created_at', 'updated_at', 'locked_at', 'last_error')
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'ref_count', 'created_at')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'file', 'size', 'ref_count', 'created_at')
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'owner', 'status', 'offset', 'size', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('id', 'offset', 'document', 'created_at', 'updated_at')
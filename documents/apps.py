@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DocumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'documents'
+
+    def ready(self):
+        # Регистрируем обработчики сигналов (поисковый индекс, освобождение файлов)
+        from . import signals  # noqa: F401
@@ -0,0 +1,10 @@
+from django.urls import path
+from . import async_views, urls
+
+# Асинхронные представления (ASYNC_VIEWS) перекрывают синхронные с теми же адресами,
+# остальные адреса приложения остаются прежними
+urlpatterns = [
+    path('api/documents/search/', async_views.document_search),
+    path('api/documents/<int:pk>/download/', async_views.document_download),
+    path('documents/<int:pk>/file/', async_views.document_file_view, name='document-file'),
+] + urls.urlpatterns
@@ -0,0 +1,136 @@
+"""
+Async versions of the hot read paths (file download and search) for ASGI.
+
+Under an ASGI server the sync views run in a thread each, so the number of
+simultaneous downloads is bounded by the thread pool. The download views run in
+the event loop: the document is looked up with the async ORM and file chunks are
+read by a small executor (see file_serving.aserve_document_file), so a slow
+client only holds an open socket. Search is not I/O-bound on the client side:
+it runs the code of the sync view (views.search_response_data) in a thread, like
+the sync view does under ASGI, and differs from it only in the entry point.
+Enabled by ASYNC_VIEWS (documents/async_urls.py).
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.shortcuts import redirect
+from django.urls import reverse
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .file_serving import aserve_document_file
+from .models import Document
+from .pagination import DocumentCursorPagination
+from .serializers import DocumentListSerializer, DocumentSerializer
+from .views import search_response_data
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Те же ответы, что у DRF для синхронного API
+NOT_FOUND = {'detail': 'No Document matches the given query.'}
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def _authenticate(drf_request):
+    # Аутентификаторы DRF обращаются к сессии и базе синхронно
+    return drf_request.user
+
+
+async def get_api_request(request):
+    """
+    DRF request of an API call authenticated by the API's authentication classes
+    (DEFAULT_AUTHENTICATION_CLASSES) and an error response if it is not authenticated
+    """
+    drf_request = Request(request, authenticators=[cls() for cls in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = await sync_to_async(_authenticate)(drf_request)
+    except APIException as e:
+        return drf_request, json_response({'detail': str(e.detail)}, status=403)
+    if not user.is_authenticated:
+        return drf_request, json_response({'detail': str(NotAuthenticated.default_detail)}, status=403)
+    return drf_request, None
+
+
+def get_requested_fields(request):
+    value = request.GET.get('fields')
+    if not value:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+@require_safe
+async def document_file_view(request, pk):
+    """
+    Async version of views.document_file_view
+    """
+    user = await request.auser()
+    try:
+        document = await Document.objects.aget(pk=pk)
+    except Document.DoesNotExist:
+        raise Http404("No Document matches the given query.")
+
+    # Check if the user is the owner of the document
+    if not user.is_authenticated or document.owner_id != user.id:
+        return redirect(f"{reverse('document-list')}?show_login_modal=1")
+
+    try:
+        return await aserve_document_file(request, document)
+    except IOError:
+        logger.error(f"Error opening document file: {document.file.name}")
+        return HttpResponse("Ошибка при чтении файла", status=404)
+
+
+@require_safe
+async def document_download(request, pk):
+    """
+    Async version of DocumentViewSet.download
+    """
+    drf_request, error = await get_api_request(request)
+    if error is not None:
+        return error
+    try:
+        document = await Document.objects.aget(pk=pk, owner=drf_request.user)
+    except Document.DoesNotExist:
+        return json_response(NOT_FOUND, status=404)
+
+    try:
+        return await aserve_document_file(request, document)
+    except FileNotFoundError:
+        return json_response({"error": "Файл не найден"}, status=404)
+
+
+@require_safe
+async def document_search(request):
+    """
+    Async version of DocumentViewSet.search (same parameters and response)
+    """
+    drf_request, error = await get_api_request(request)
+    if error is not None:
+        return error
+    query = request.GET.get('q', '')
+    if not query:
+        return json_response({"error": "Search query is required"}, status=400)
+
+    fields = get_requested_fields(request)
+    serializer_class = DocumentListSerializer
+    documents = Document.objects.filter(owner=drf_request.user).select_related('owner').order_by('-upload_date', '-id')
+    if fields and 'text_content' in fields:
+        serializer_class = DocumentSerializer
+        documents = documents.select_related('content')
+
+    context = {'request': drf_request, 'format': None, 'view': None}
+    try:
+        data = await sync_to_async(search_response_data)(
+            drf_request, documents, query, serializer_class, fields, context, DocumentCursorPagination(),
+        )
+    except NotFound as e:
+        return json_response({'detail': str(e.detail)}, status=404)
+    return json_response(data)
@@ -0,0 +1,304 @@
+"""
+Micro-benchmark of the text extraction functions in documents/utils.py.
+
+A synthetic corpus (multi-page PDF, DOCX, XLSX, SVG, TXT in several encodings and
+PNG images with text) is generated from a seed, so the same seed and scale give
+the same documents on every machine. Every extract_text_from_* function is timed
+on its files and the results can be compared with a previous run.
+"""
+import json
+import os
+import platform
+import random
+import re
+import resource
+import time
+import zlib
+
+import docx
+import openpyxl
+from PIL import Image, ImageDraw, ImageFont
+
+from . import utils
+
+# Слова для синтетических документов (PDF со стандартным шрифтом - только латиница)
+LATIN_WORDS = (
+    'contract', 'supply', 'invoice', 'payment', 'delivery', 'equipment', 'agreement', 'party',
+    'amount', 'total', 'service', 'period', 'schedule', 'warehouse', 'order', 'account', 'terms',
+    'signature', 'director', 'quantity', 'price', 'report', 'quarter', 'budget', 'approval',
+)
+CYRILLIC_WORDS = (
+    'договор', 'поставка', 'счёт', 'оплата', 'доставка', 'оборудование', 'соглашение', 'сторона',
+    'сумма', 'итого', 'услуга', 'период', 'график', 'склад', 'заказ', 'акт', 'условия',
+    'подпись', 'директор', 'количество', 'цена', 'отчёт', 'квартал', 'бюджет', 'утверждение',
+)
+TEXT_ENCODINGS = ('utf-8', 'cp1251', 'koi8-r', 'utf-16')
+
+# Ключевые метрики, по которым сравниваются запуски: время (больше - хуже) и скорость (меньше - хуже)
+LATENCY_METRICS = ('p50_ms', 'p95_ms')
+THROUGHPUT_METRICS = ('mb_per_s',)
+
+
+def _sentence(rng, words, count):
+    text = ' '.join(rng.choice(words) for _ in range(count))
+    return f'{text.capitalize()} {rng.randint(1, 99999)}.'
+
+
+def _pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path, rng, scale):
+    """
+    Multi-page PDF with a text layer (written directly, Helvetica, 40 lines a page)
+    """
+    page_count = rng.randint(5, 20) * scale
+    objects = {1: b'<< /Type /Catalog /Pages 2 0 R >>',
+               3: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'}
+    kids = []
+    for page in range(page_count):
+        page_id, content_id = 4 + page * 2, 5 + page * 2
+        lines = [f'Page {page + 1}'] + [_sentence(rng, LATIN_WORDS, 9) for _ in range(40)]
+        stream = 'BT /F1 10 Tf 14 TL 50 800 Td ' + ' '.join(f'({_pdf_escape(line)}) Tj T*' for line in lines) + ' ET'
+        data = zlib.compress(stream.encode('latin-1'))
+        objects[content_id] = (
+            f'<< /Length {len(data)} /Filter /FlateDecode >>\nstream\n'.encode('ascii') + data + b'\nendstream'
+        )
+        objects[page_id] = (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>'
+        ).encode('ascii')
+        kids.append(f'{page_id} 0 R')
+    objects[2] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {page_count} >>'.encode('ascii')
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(output)
+        output += f'{number} 0 obj\n'.encode('ascii') + objects[number] + b'\nendobj\n'
+    xref = len(output)
+    size = max(objects) + 1
+    output += f'xref\n0 {size}\n0000000000 65535 f \n'.encode('ascii')
+    for number in range(1, size):
+        output += f'{offsets[number]:010d} 00000 n \n'.encode('ascii')
+    output += f'trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('ascii')
+    with open(path, 'wb') as f:
+        f.write(output)
+    return page_count
+
+
+def write_docx(path, rng, scale):
+    document = docx.Document()
+    for _ in range(rng.randint(5, 15) * scale):
+        document.add_heading(_sentence(rng, CYRILLIC_WORDS, 3), level=2)
+        for _ in range(rng.randint(5, 10)):
+            document.add_paragraph(' '.join(_sentence(rng, CYRILLIC_WORDS, 12) for _ in range(4)))
+    document.save(path)
+    return 1
+
+
+def write_xlsx(path, rng, scale):
+    """
+    Workbook with several sheets of mixed text and numeric cells (a page is a sheet)
+    """
+    workbook = openpyxl.Workbook()
+    sheet_count = rng.randint(2, 5)
+    for index in range(sheet_count):
+        sheet = workbook.active if index == 0 else workbook.create_sheet()
+        sheet.title = f'Лист {index + 1}'
+        for _ in range(rng.randint(200, 500) * scale):
+            sheet.append([
+                rng.choice(CYRILLIC_WORDS), _sentence(rng, CYRILLIC_WORDS, 4),
+                rng.randint(1, 10000), round(rng.uniform(0, 1e6), 2), rng.choice(CYRILLIC_WORDS),
+            ])
+    workbook.save(path)
+    return sheet_count
+
+
+def write_svg(path, rng, scale):
+    elements = [
+        f'<text x="10" y="{20 + index * 16}">{_sentence(rng, CYRILLIC_WORDS, 8)}</text>'
+        for index in range(rng.randint(100, 300) * scale)
+    ]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<svg xmlns="http://www.w3.org/2000/svg" width="800" height="600">\n')
+        f.write('\n'.join(elements))
+        f.write('\n</svg>\n')
+    return 1
+
+
+def text_writer(encoding):
+    def write_text(path, rng, scale):
+        lines = [_sentence(rng, CYRILLIC_WORDS, 12) for _ in range(rng.randint(2000, 6000) * scale)]
+        with open(path, 'w', encoding=encoding) as f:
+            f.write('\n'.join(lines))
+        return 1
+    return write_text
+
+
+def write_png(path, rng, scale):
+    """
+    Scan-like image: black text lines on a white page
+    """
+    image = Image.new('L', (1240, 1754), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=28)
+    for index in range(30):
+        draw.text((60, 60 + index * 50), _sentence(rng, LATIN_WORDS, 6), fill=0, font=font)
+    image.save(path)
+    return 1
+
+
+# Случаи бенчмарка: имя, расширение файлов, генератор, функция извлечения
+BENCHMARK_CASES = [
+    ('pdf', 'pdf', write_pdf, utils.extract_text_from_pdf),
+    ('docx', 'docx', write_docx, utils.extract_text_from_docx),
+    ('xlsx', 'xlsx', write_xlsx, utils.extract_text_from_xlsx),
+    ('svg', 'svg', write_svg, utils.extract_text_from_svg),
+] + [
+    (f'txt-{encoding}', 'txt', text_writer(encoding), utils.extract_text_from_text_file)
+    for encoding in TEXT_ENCODINGS
+] + [
+    ('png', 'png', write_png, utils.extract_text_from_image),
+]
+
+
+def skip_reason(name):
+    """
+    Why a case cannot run in this environment, or None
+    """
+    if name == 'png' and not utils.tesseract_available():
+        return 'tesseract is not installed'
+    return None
+
+
+def build_corpus(directory, seed=0, files=5, scale=1, cases=None):
+    """
+    Generate the corpus into directory: {case name: [(path, pages), ...]}
+    """
+    corpus = {}
+    for name, extension, write, func in BENCHMARK_CASES:
+        if cases and name not in cases:
+            continue
+        # Свой генератор на каждый случай: выбор случаев не меняет их содержимое
+        rng = random.Random(f'{seed}:{name}')
+        case_dir = os.path.join(directory, name)
+        os.makedirs(case_dir, exist_ok=True)
+        corpus[name] = []
+        for index in range(files):
+            path = os.path.join(case_dir, f'{name}-{index:03d}.{extension}')
+            corpus[name].append((path, write(path, rng, scale)))
+    return corpus
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of a list of numbers
+    """
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def _reset_peak_rss():
+    # Linux: запись "5" в clear_refs сбрасывает пиковое RSS процесса (VmHWM)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB (since the last reset on Linux)
+    """
+    try:
+        with open('/proc/self/status') as f:
+            match = re.search(r'VmHWM:\s+(\d+) kB', f.read())
+        if match:
+            return int(match.group(1)) / 1024
+    except OSError:
+        pass
+    # ru_maxrss - в килобайтах на Linux и в байтах на macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if platform.system() == 'Darwin' else maxrss / 1024
+
+
+def run_case(func, files, repeat=3):
+    """
+    Time func on every file repeat times (after one warm-up call per file)
+    """
+    total_bytes = sum(os.path.getsize(path) for path, pages in files)
+    total_pages = sum(pages for path, pages in files)
+    chars = sum(len(func(path) or '') for path, pages in files)
+
+    _reset_peak_rss()
+    latencies = []
+    for _ in range(repeat):
+        for path, pages in files:
+            start = time.perf_counter()
+            func(path)
+            latencies.append(time.perf_counter() - start)
+    elapsed = sum(latencies)
+    return {
+        'function': func.__name__,
+        'files': len(files),
+        'pages': total_pages,
+        'bytes': total_bytes,
+        'chars': chars,
+        'runs': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'pages_per_s': round(total_pages * repeat / elapsed, 2) if elapsed else None,
+        'mb_per_s': round(total_bytes * repeat / elapsed / (1024 * 1024), 3) if elapsed else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def run_benchmark(corpus, repeat=3):
+    """
+    Benchmark every case of the corpus: {case name: metrics or {"skipped": reason}}
+    """
+    functions = {name: func for name, extension, write, func in BENCHMARK_CASES}
+    results = {}
+    for name, files in corpus.items():
+        reason = skip_reason(name)
+        results[name] = {'skipped': reason} if reason else run_case(functions[name], files, repeat)
+    return results
+
+
+def benchmark_report(results, seed, files, scale, repeat):
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': {'seed': seed, 'files': files, 'scale': scale},
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Metrics that got worse than the baseline report by more than threshold
+    (a fraction, 0.2 - 20%). Returns a list of (case, metric, baseline, current)
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or 'skipped' in previous or 'skipped' in current:
+            continue
+        for metric in LATENCY_METRICS:
+            if previous.get(metric) and current[metric] > previous[metric] * (1 + threshold):
+                regressions.append((name, metric, previous[metric], current[metric]))
+        for metric in THROUGHPUT_METRICS:
+            if previous.get(metric) and current[metric] < previous[metric] * (1 - threshold):
+                regressions.append((name, metric, previous[metric], current[metric]))
+    return regressions
+
+
+def load_report(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,243 @@
+import hashlib
+import logging
+import os
+import zipfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from rest_framework import serializers
+
+from .models import Blob, Document, DocumentContent, DocumentPage, blob_atomic
+from .search import update_index_bulk
+from .search_cache import bump_generation
+from .serializers import validate_upload
+from .storage import HASH_CHUNK_SIZE
+from .tasks import enqueue_extraction_bulk, extracted_texts_by_blob
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class TooManyFiles(Exception):
+    """
+    Raised when a bulk upload contains more files than BULK_UPLOAD_MAX_FILES
+    """
+
+
+class UploadItem:
+    """
+    One file of a bulk upload and the outcome of its processing
+    """
+    def __init__(self, index, filename):
+        self.index = index
+        self.filename = filename
+        self.file = None
+        self.file_format = None
+        self.error = None
+        self.document = None
+
+    def as_dict(self):
+        if self.document is not None:
+            return {
+                'index': self.index,
+                'filename': self.filename,
+                'status': 'created',
+                'id': self.document.pk,
+                'extraction_status': self.document.extraction_status,
+            }
+        return {
+            'index': self.index,
+            'filename': self.filename,
+            'status': 'error',
+            'error': self.error,
+        }
+
+
+def _error_message(error):
+    if isinstance(error.detail, list) and error.detail:
+        return str(error.detail[0])
+    return str(error.detail)
+
+
+def _zip_entry_name(info):
+    """
+    File name of a zip entry. Archives created on Windows store names in the
+    OEM code page (cp866 for Russian) without the UTF-8 flag
+    """
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        try:
+            name = name.encode('cp437').decode('cp866')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return name
+
+
+def _is_skipped_entry(name):
+    # Каталоги и служебные файлы macOS/Windows не являются документами
+    base = os.path.basename(name)
+    return not base or base.startswith('.') or '__MACOSX/' in name or base.lower() == 'thumbs.db'
+
+
+def _spool_zip_entry(archive, info, name):
+    """
+    Decompress a zip entry to a temporary file on disk, hashing it on the way
+    """
+    spooled = TemporaryUploadedFile(os.path.basename(name), 'application/octet-stream', info.file_size, None)
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with archive.open(info) as entry:
+            for chunk in iter(lambda: entry.read(HASH_CHUNK_SIZE), b''):
+                size += len(chunk)
+                # Размер в заголовке архива может не соответствовать действительности
+                validate_upload(name, size)
+                hasher.update(chunk)
+                spooled.write(chunk)
+    except Exception:
+        spooled.close()
+        raise
+    spooled.size = size
+    spooled.sha256 = hasher.hexdigest()
+    spooled.seek(0)
+    return spooled
+
+
+def collect_upload_items(files, archives):
+    """
+    Build the list of upload items from multipart files and ZIP archives.
+    Every item is validated; invalid items carry an error instead of a file
+    """
+    entries = []
+    opened = []
+    try:
+        for file in files:
+            entries.append((file.name, file, None))
+        for archive_file in archives:
+            try:
+                archive = zipfile.ZipFile(archive_file)
+            except zipfile.BadZipFile:
+                entries.append((archive_file.name, None, "Архив поврежден или не является ZIP-файлом"))
+                continue
+            opened.append(archive)
+            for info in archive.infolist():
+                name = _zip_entry_name(info)
+                if not info.is_dir() and not _is_skipped_entry(name):
+                    entries.append((name, (archive, info), None))
+
+        if len(entries) > settings.BULK_UPLOAD_MAX_FILES:
+            raise TooManyFiles(f"Слишком много файлов: {len(entries)} (максимум {settings.BULK_UPLOAD_MAX_FILES})")
+
+        items = []
+        for index, (name, source, error) in enumerate(entries):
+            item = UploadItem(index, name)
+            items.append(item)
+            if error:
+                item.error = error
+                continue
+            try:
+                if isinstance(source, tuple):
+                    archive, info = source
+                    item.file_format = validate_upload(name, info.file_size)
+                    item.file = _spool_zip_entry(archive, info, name)
+                else:
+                    item.file_format = validate_upload(name, source.size)
+                    item.file = source
+            except serializers.ValidationError as e:
+                item.error = _error_message(e)
+            except (zipfile.BadZipFile, OSError, RuntimeError) as e:
+                # RuntimeError - зашифрованный элемент архива
+                item.error = f"Не удалось прочитать файл из архива: {e}"
+        return items
+    finally:
+        for archive in opened:
+            archive.close()
+
+
+def _copy_pages(copies):
+    """
+    Copy the pages of already extracted files to new documents with one SELECT
+    and one bulk INSERT. ``copies`` is a list of (document, source document pk)
+    """
+    if not copies:
+        return
+    pages = {}
+    for page in DocumentPage.objects.filter(document_id__in={pk for _, pk in copies}).order_by('number'):
+        pages.setdefault(page.document_id, []).append(page)
+    DocumentPage.objects.bulk_create([
+        DocumentPage(document=document, number=page.number, label=page.label, text=page.text)
+        for document, source_pk in copies
+        for page in pages.get(source_pk, [])
+    ], batch_size=500)
+
+
+def create_documents(items, owner):
+    """
+    Store the files of valid items and create their documents in one transaction:
+    one bulk INSERT for the documents, one for the extraction jobs and a batched
+    search index update. Files whose content was already extracted reuse the text
+    """
+    valid = [item for item in items if item.error is None]
+    if not valid:
+        return []
+
+    files = [item.file for item in valid]
+    try:
+        with blob_atomic():
+            stored = []
+            for item in valid:
+                # Ошибка сохранения одного файла (например, нет места на диске)
+                # отражается в его результате и не отменяет остальные
+                try:
+                    with blob_atomic():
+                        blob = Blob.objects.acquire(item.file)
+                except Exception as e:
+                    logger.error(f"Failed to store bulk upload file {item.filename}: {e}")
+                    item.error = f"Не удалось сохранить файл: {e}"
+                    continue
+                stored.append(item)
+                base_name = os.path.basename(item.filename)
+                item.document = Document(
+                    title=(os.path.splitext(base_name)[0] or base_name)[:255],
+                    file=blob.file.name,
+                    blob=blob,
+                    original_filename=base_name[:255],
+                    file_format=item.file_format,
+                    size=blob.size,
+                    owner=owner,
+                )
+
+            if not stored:
+                return []
+            valid = stored
+            texts = extracted_texts_by_blob({item.document.blob_id for item in valid})
+            copies = []
+            for item in valid:
+                item.document.text_content = ''
+                if item.document.blob_id in texts:
+                    text, truncated, source_pk = texts[item.document.blob_id]
+                    item.document.text_content, item.document.text_truncated = text, truncated
+                    item.document.extraction_status = Document.EXTRACTION_DONE
+                    copies.append((item.document, source_pk))
+
+            documents = Document.objects.bulk_create([item.document for item in valid])
+            DocumentContent.objects.bulk_create([
+                DocumentContent.from_text(document, document.text_content)
+                for document in documents
+                if document.extraction_status == Document.EXTRACTION_DONE
+            ])
+            _copy_pages(copies)
+            # bulk_create не отправляет сигнал post_save, поэтому индекс и кэш поиска обновляются явно
+            update_index_bulk(documents)
+            bump_generation(owner.pk)
+
+            pending = [document for document in documents if document.extraction_status == Document.EXTRACTION_PENDING]
+            if pending:
+                enqueue_extraction_bulk(pending)
+    finally:
+        for file in files:
+            if isinstance(file, TemporaryUploadedFile):
+                file.close()
+
+    logger.info(f"Bulk upload created {len(documents)} documents, {len(pending)} queued for extraction")
+    return documents
@@ -0,0 +1,328 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .storage import compute_sha256
+from .extractors import EXTRACTORS, ExtractionResult, get_extractor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+STATS_FILE = 'stats.json'
+# Через сколько обращений к кэшу счетчики сбрасываются в stats.json
+STATS_FLUSH_INTERVAL = 50
+
+
+class ExtractionCache:
+    """
+    Disk cache of extracted text keyed by file hash and extractor name/version.
+
+    Entries are stored as ``<root>/<extractor>/v<version>/<ab>/<sha256>.txt``.
+    Bumping an extractor's version makes only that extractor's entries
+    unreachable; they are purged on the next eviction.
+
+    The process keeps an LRU index of the entries (built by walking the cache
+    directory once and rebuilt every ``rescan_interval`` seconds to pick up
+    entries of other processes). Hits move an entry to the end of the index and
+    refresh its modification time; when the cache grows beyond ``max_bytes`` the
+    least recently used entries are removed until it is below
+    ``max_bytes * low_water``, so eviction does not run on every write.
+    """
+    def __init__(self, root, max_bytes, low_water=0.9, rescan_interval=3600):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.rescan_interval = rescan_interval
+        self.hits = 0
+        self.misses = 0
+        self._unflushed = 0
+        # path -> (size, mtime) от давно использованных к недавним
+        self._index = None
+        self._indexed_at = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def entry_path(self, sha256, extractor, version):
+        return os.path.join(self.root, extractor, f'v{version}', sha256[:2], f'{sha256}.txt')
+
+    def get(self, sha256, extractor, version):
+        """
+        Cached text or None on a miss
+        """
+        path = self.entry_path(sha256, extractor, version)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            os.utime(path)
+            stat_result = os.stat(path)
+        except OSError:
+            self._count(hit=False)
+            return None
+
+        with self._lock:
+            if self._index is not None:
+                self._add(path, stat_result.st_size, stat_result.st_mtime)
+        self._count(hit=True)
+        return text
+
+    def set(self, sha256, extractor, version, text):
+        path = self.entry_path(sha256, extractor, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Пишем во временный файл и атомарно переименовываем, чтобы читатели
+        # никогда не видели частично записанную запись
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+            stat_result = os.stat(path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._load_index()
+            self._add(path, stat_result.st_size, stat_result.st_mtime)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _add(self, path, size, mtime):
+        # Вызывается под self._lock
+        previous = self._index.pop(path, None)
+        if previous is not None:
+            self._total_bytes -= previous[0]
+        self._index[path] = (size, mtime)
+        self._total_bytes += size
+
+    def _entries(self):
+        """
+        All entries as (path, size, mtime, is_current_version)
+        """
+        entries = []
+        for extractor in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            extractor_dir = os.path.join(self.root, extractor)
+            if not os.path.isdir(extractor_dir):
+                continue
+            current = f'v{EXTRACTORS[extractor].version}' if extractor in EXTRACTORS else None
+            for dirpath, dirnames, filenames in os.walk(extractor_dir):
+                version = os.path.relpath(dirpath, extractor_dir).split(os.sep)[0]
+                for filename in filenames:
+                    if not filename.endswith('.txt'):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat_result = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((path, stat_result.st_size, stat_result.st_mtime, version == current))
+        return entries
+
+    def _load_index(self, rescan=False):
+        """
+        Build the LRU index from the cache directory (the first time, when it is
+        older than rescan_interval or on request); entries of outdated extractor
+        versions are removed on the way. Called under self._lock
+        """
+        now = time.monotonic()
+        if not rescan and self._index is not None and now - self._indexed_at < self.rescan_interval:
+            return
+
+        live = []
+        for path, size, mtime, is_current in self._entries():
+            if is_current:
+                live.append((mtime, path, size))
+            else:
+                self._remove(path)
+        live.sort()
+        self._index = OrderedDict((path, (size, mtime)) for mtime, path, size in live)
+        self._total_bytes = sum(size for mtime, path, size in live)
+        self._indexed_at = now
+
+    def evict(self, rescan=False):
+        """
+        Remove entries of outdated extractor versions, then the least recently
+        used entries if the cache does not fit into max_bytes.
+        ``rescan`` re-reads the cache directory instead of trusting the index
+        """
+        with self._lock:
+            self._load_index(rescan=rescan)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Вызывается под self._lock: удаляем самые старые записи до нижней границы
+        target = self.max_bytes * self.low_water
+        removed = 0
+        checked = 0
+        count = len(self._index)
+        while self._index and self._total_bytes > target and checked < count:
+            checked += 1
+            path, (size, mtime) = self._index.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                continue
+            if stat_result.st_mtime > mtime:
+                # Запись прочитал или перезаписал другой процесс - она не самая старая
+                self._add(path, stat_result.st_size, stat_result.st_mtime)
+                continue
+            self._remove(path)
+            removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} extraction cache entries")
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            for path, size, mtime, is_current in self._entries():
+                self._remove(path)
+            self._index = OrderedDict()
+            self._indexed_at = time.monotonic()
+            self._total_bytes = 0
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._unflushed += 1
+            flush = self._unflushed >= STATS_FLUSH_INTERVAL
+        if flush:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """
+        Add the counters of this process to the persistent stats file
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = self._unflushed = 0
+        if not hits and not misses:
+            return
+
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, STATS_FILE)
+        # Файл статистики общий для всех процессов, поэтому блокируем его
+        # (без fcntl счетчики одновременно работающих процессов могут теряться)
+        with open(path, 'a+', encoding='utf-8') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                stats = json.loads(f.read() or '{}')
+            except ValueError:
+                stats = {}
+            stats['hits'] = stats.get('hits', 0) + hits
+            stats['misses'] = stats.get('misses', 0) + misses
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(stats))
+
+    def stats(self):
+        """
+        Hit/miss counters (persisted plus not yet flushed) and the current cache size
+        """
+        path = os.path.join(self.root, STATS_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                stats = json.loads(f.read() or '{}')
+        except (OSError, ValueError):
+            stats = {}
+        with self._lock:
+            hits = stats.get('hits', 0) + self.hits
+            misses = stats.get('misses', 0) + self.misses
+            self._load_index(rescan=True)
+            entries = len(self._index)
+            total_bytes = self._total_bytes
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': total_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache():
+    """
+    Process-wide cache instance configured from settings
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.root != str(settings.EXTRACTION_CACHE_DIR):
+            _cache = ExtractionCache(
+                settings.EXTRACTION_CACHE_DIR, settings.EXTRACTION_CACHE_MAX_BYTES,
+                low_water=settings.EXTRACTION_CACHE_LOW_WATER,
+                rescan_interval=settings.EXTRACTION_CACHE_RESCAN_INTERVAL,
+            )
+        return _cache
+
+
+def _encode_result(extractor, result):
+    # Для постраничных форматов храним страницы, текст документа собирается из них
+    if extractor.paged:
+        pages = result.pages if result.pages is not None else [('', result.text)]
+        return json.dumps(pages, ensure_ascii=False)
+    return result.text
+
+
+def _decode_result(extractor, data):
+    if extractor.paged:
+        pages = [tuple(page) for page in json.loads(data)]
+        return ExtractionResult(extractor.join_pages(pages), pages=pages)
+    return ExtractionResult(data)
+
+
+def cached_extract_text(file_path, extract, sha256=None):
+    """
+    Return the ExtractionResult of a file from the cache or compute it with
+    ``extract(file_path)``. Only complete, non-empty results are cached: empty
+    text usually means the extraction failed and truncated text depends on limits
+    """
+    extractor = get_extractor(file_path)
+    if not settings.EXTRACTION_CACHE_ENABLED or extractor is None:
+        return extract(file_path)
+
+    if sha256 is None:
+        with open(file_path, 'rb') as f:
+            sha256 = compute_sha256(f)
+
+    cache = get_extraction_cache()
+    data = cache.get(sha256, extractor.name, extractor.version)
+    if data is not None:
+        logger.info(f"Extraction cache hit for {file_path} ({extractor.name} v{extractor.version})")
+        return _decode_result(extractor, data)
+
+    result = extract(file_path)
+    if result.text and result.complete:
+        try:
+            cache.set(sha256, extractor.name, extractor.version, _encode_result(extractor, result))
+        except OSError as e:
+            logger.error(f"Failed to write extraction cache entry: {e}")
+    return result
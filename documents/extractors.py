@@ -0,0 +1,404 @@
+import io
+import logging
+import multiprocessing
+import os
+import signal
+
+from django.conf import settings
+
+from . import utils
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class ExtractionError(Exception):
+    """
+    Raised when the extraction subprocess fails or exceeds its limits
+    """
+
+
+class ExtractionTimeout(ExtractionError):
+    """
+    Raised when text extraction does not finish within the configured timeout
+    """
+
+
+class ExtractionResult:
+    """
+    Extracted text and whether it covers the whole document.
+    ``pages`` is a list of (label, text) pairs for formats split into pages
+    (PDF pages, spreadsheet sheets) and None for the others
+    """
+    def __init__(self, text, truncated=False, pages=None):
+        self.text = text
+        self.truncated = truncated
+        self.pages = pages
+
+    @property
+    def complete(self):
+        return not self.truncated
+
+    def __repr__(self):
+        return f"<ExtractionResult {len(self.text)} chars{' truncated' if self.truncated else ''}>"
+
+
+class Extractor:
+    """
+    Base class of format extractors.
+
+    Subclasses declare the extensions they handle, the content formats detected
+    by ``utils.sniff_format`` (empty for formats without a signature, such as
+    text) and their costs: a wall-clock ``timeout`` (None - the job timeout)
+    and an address-space ``memory_limit`` (None - EXTRACTION_MEMORY_LIMIT).
+    Bump ``version`` after changing the algorithm so cached results of this
+    extractor are recomputed. Extractors of ``paged`` formats return the text
+    of every page, the document text is built from them with ``join_pages``.
+    """
+    name = None
+    version = 1
+    extensions = ()
+    formats = ()
+    timeout = None
+    memory_limit = None
+    paged = False
+    page_separator = "\n"
+
+    def extract(self, file_path):
+        """
+        Return the text of the file or an ExtractionResult
+        """
+        raise NotImplementedError
+
+    def join_pages(self, pages):
+        return self.page_separator.join(text for _, text in pages)
+
+    def run(self, file_path):
+        result = self.extract(file_path)
+        if not isinstance(result, ExtractionResult):
+            result = ExtractionResult(result or "")
+        if self.paged and result.pages is None:
+            result.pages = [('', result.text)] if result.text else []
+
+        max_chars = settings.EXTRACTION_MAX_CHARS
+        if max_chars is not None and len(result.text) > max_chars:
+            logger.warning(f"Extracted text of {file_path} truncated to {max_chars} characters")
+            result = ExtractionResult(
+                result.text[:max_chars],
+                truncated=True,
+                pages=self._truncate_pages(result.pages, max_chars),
+            )
+        return result
+
+    def _truncate_pages(self, pages, max_chars):
+        if pages is None:
+            return None
+        kept = []
+        remaining = max_chars
+        for label, text in pages:
+            if remaining <= 0:
+                break
+            kept.append((label, text[:remaining]))
+            remaining -= len(text) + len(self.page_separator)
+        return kept
+
+    def get_timeout(self, timeout=None):
+        if self.timeout is None:
+            return timeout
+        if timeout is None:
+            return self.timeout
+        return min(self.timeout, timeout)
+
+    def get_memory_limit(self):
+        if self.memory_limit is None:
+            return settings.EXTRACTION_MEMORY_LIMIT
+        return self.memory_limit
+
+
+EXTRACTORS = {}
+EXTENSION_EXTRACTORS = {}
+FORMAT_EXTRACTORS = {}
+
+
+def register(extractor_class):
+    """
+    Class decorator that adds an extractor to the registry
+    """
+    extractor = extractor_class()
+    EXTRACTORS[extractor.name] = extractor
+    for extension in extractor.extensions:
+        EXTENSION_EXTRACTORS[extension] = extractor.name
+    for file_format in extractor.formats:
+        FORMAT_EXTRACTORS[file_format] = extractor.name
+    return extractor_class
+
+
+def get_extractor(file_path):
+    """
+    Extractor for a file, or None if the format is not supported.
+
+    The format is detected from the magic bytes first, so a DOCX saved as .doc is
+    read by the DOCX extractor. A binary format whose signature does not match
+    gets no extractor at all instead of a parse attempt that is bound to fail
+    """
+    try:
+        file_format = utils.sniff_format(file_path)
+    except OSError:
+        file_format = None
+    if file_format is not None:
+        return EXTRACTORS.get(FORMAT_EXTRACTORS.get(file_format))
+
+    _, file_extension = os.path.splitext(file_path)
+    extractor = EXTRACTORS.get(EXTENSION_EXTRACTORS.get(file_extension.lower().replace('.', '')))
+    if extractor is not None and extractor.formats and os.path.exists(file_path):
+        logger.warning(f"File {file_path} does not look like {extractor.name}, skipping text extraction")
+        return None
+    return extractor
+
+
+@register
+class PdfExtractor(Extractor):
+    name = 'pdf'
+    version = 4
+    extensions = ('pdf',)
+    formats = ('pdf',)
+    # Страницы обрабатываются пулом процессов, ограничение действует на каждый из них
+    memory_limit = 2 * 1024 ** 3
+    paged = True
+
+    def extract(self, file_path):
+        # Страницы, не распознанные из-за ограничений OCR, делают текст неполным
+        skipped_pages = []
+        pages = [('', text) for text in utils.extract_pdf_pages(file_path, skipped_pages)]
+        return ExtractionResult(self.join_pages(pages), truncated=bool(skipped_pages), pages=pages)
+
+
+@register
+class ImageExtractor(Extractor):
+    name = 'image'
+    version = 2
+    extensions = ('jpg', 'jpeg', 'png', 'gif', 'heic')
+    formats = ('jpeg', 'png', 'gif', 'heic')
+    timeout = 120
+    memory_limit = 2 * 1024 ** 3
+
+    def extract(self, file_path):
+        return utils.extract_text_from_image(file_path)
+
+
+@register
+class DocxExtractor(Extractor):
+    name = 'docx'
+    extensions = ('docx',)
+    formats = ('docx',)
+    timeout = 60
+
+    def extract(self, file_path):
+        return utils.extract_text_from_docx(file_path)
+
+
+@register
+class DocExtractor(Extractor):
+    name = 'doc'
+    extensions = ('doc',)
+    formats = ('doc',)
+    timeout = 60
+
+    def extract(self, file_path):
+        return utils.extract_text_from_doc(file_path)
+
+
+def _group_sheets(chunks):
+    """
+    Collect (sheet, text) chunks into one page per sheet. Chunks of a sheet come
+    one after another and are written into the page buffer as they arrive
+    """
+    pages = []
+    sheet = page = None
+    for chunk_sheet, text in chunks:
+        if page is None or chunk_sheet != sheet:
+            if page is not None:
+                pages.append((sheet, page.getvalue()))
+            sheet, page = chunk_sheet, io.StringIO()
+        page.write(text)
+    if page is not None:
+        pages.append((sheet, page.getvalue()))
+    return pages
+
+
+@register
+class XlsxExtractor(Extractor):
+    name = 'xlsx'
+    version = 4
+    extensions = ('xlsx',)
+    formats = ('xlsx',)
+    timeout = 120
+    paged = True
+    page_separator = ""
+
+    def extract(self, file_path):
+        truncated_sheets = []
+        pages = _group_sheets(utils.iter_xlsx_sheet_text(file_path, truncated_sheets))
+        return ExtractionResult(self.join_pages(pages), truncated=bool(truncated_sheets), pages=pages)
+
+
+@register
+class XlsExtractor(Extractor):
+    name = 'xls'
+    version = 3
+    extensions = ('xls',)
+    formats = ('xls',)
+    timeout = 120
+    paged = True
+    page_separator = ""
+
+    def extract(self, file_path):
+        truncated_sheets = []
+        pages = _group_sheets(utils.iter_xls_sheet_text(file_path, truncated_sheets))
+        return ExtractionResult(self.join_pages(pages), truncated=bool(truncated_sheets), pages=pages)
+
+
+@register
+class PptxExtractor(Extractor):
+    name = 'pptx'
+    extensions = ('pptx',)
+    formats = ('pptx',)
+    timeout = 60
+
+    def extract(self, file_path):
+        return "".join(utils.iter_pptx_text(file_path))
+
+
+@register
+class PptExtractor(Extractor):
+    name = 'ppt'
+    extensions = ('ppt',)
+    formats = ('ppt',)
+    timeout = 60
+
+    def extract(self, file_path):
+        return utils.extract_text_from_ppt(file_path)
+
+
+@register
+class TextExtractor(Extractor):
+    name = 'text'
+    version = 2
+    extensions = ('txt', 'md')
+    timeout = 60
+
+    def extract(self, file_path):
+        text, truncated = utils.read_text_file(file_path, settings.TEXT_EXTRACTION_MAX_CHARS)
+        return ExtractionResult(text, truncated)
+
+
+@register
+class SvgExtractor(Extractor):
+    name = 'svg'
+    extensions = ('svg',)
+    timeout = 30
+    memory_limit = 512 * 1024 ** 2
+
+    def extract(self, file_path):
+        return utils.extract_text_from_svg(file_path)
+
+
+def extract_text_from_file(file_path):
+    """
+    Extract text from a file based on its content and extension (in the current process)
+    """
+    if not file_path or not os.path.exists(file_path):
+        logger.error(f"File not found or invalid path: {file_path}")
+        return ExtractionResult("")
+
+    extractor = get_extractor(file_path)
+    if extractor is None:
+        logger.warning(f"Unsupported file format for text extraction: {file_path}")
+        return ExtractionResult("")
+
+    logger.info(f"Extracting text from file: {file_path} with extractor: {extractor.name}")
+    return extractor.run(file_path)
+
+
+def _sandbox_child(conn, func, args, memory_limit):
+    # Своя группа процессов: пулы, запущенные экстрактором (страницы PDF, OCR),
+    # попадают в нее и завершаются вместе с дочерним процессом
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    try:
+        if resource is not None and memory_limit:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        conn.send(('ok', func(*args)))
+    except MemoryError:
+        conn.send(('error', f"Memory limit of {memory_limit} bytes exceeded"))
+    except Exception as e:
+        conn.send(('error', str(e)))
+    finally:
+        conn.close()
+
+
+def _kill_sandbox(process):
+    """
+    Kill the sandbox child and every process it started
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        # Группа еще не создана (или нет killpg) - завершаем хотя бы сам процесс
+        if process.is_alive():
+            process.kill()
+
+
+def run_in_sandbox(func, args, timeout, memory_limit=None):
+    """
+    Call ``func(*args)`` in a child process with a wall-clock timeout and an
+    address-space limit and return its (picklable) result. The child and the
+    processes it started are killed if it exceeds the timeout, so a pathological
+    file fails only its own job. Pass plain values in ``args``, not model instances
+    """
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    # Процесс не демонический: PDF-экстрактор запускает собственный пул процессов
+    process = multiprocessing.Process(target=_sandbox_child, args=(child_conn, func, args, memory_limit))
+    process.start()
+    child_conn.close()
+
+    try:
+        # Результат нужно забрать до join(), иначе большой текст заблокирует канал
+        if not parent_conn.poll(timeout):
+            _kill_sandbox(process)
+            raise ExtractionTimeout(f"{func.__name__} exceeded {timeout} seconds")
+        try:
+            status, payload = parent_conn.recv()
+        except EOFError:
+            # Процесс упал (например, убит по памяти), его пулы могли остаться
+            _kill_sandbox(process)
+            process.join()
+            raise ExtractionError(f"Sandbox process exited unexpectedly (exit code {process.exitcode})")
+    finally:
+        parent_conn.close()
+        process.join()
+
+    if status != 'ok':
+        raise ExtractionError(payload)
+    return payload
+
+
+def extract_in_sandbox(file_path, timeout=None):
+    """
+    Run the extractor for a file in a sandbox child process (see run_in_sandbox)
+    with the extractor's wall-clock and memory limits
+    """
+    extractor = get_extractor(file_path)
+    if extractor is None:
+        logger.warning(f"Unsupported file format for text extraction: {file_path}")
+        return ExtractionResult("")
+
+    return run_in_sandbox(
+        extract_text_from_file, (file_path,),
+        extractor.get_timeout(timeout), extractor.get_memory_limit(),
+    )
@@ -0,0 +1,353 @@
+import asyncio
+import logging
+import mimetypes
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Явное определение MIME-типов для известных форматов
+CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'svg': 'image/svg+xml',
+    'heic': 'image/heic',
+    'doc': 'application/msword',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xls': 'application/vnd.ms-excel',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'ppt': 'application/vnd.ms-powerpoint',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'txt': 'text/plain',
+    'md': 'text/markdown',
+}
+
+# Больше диапазонов в одном запросе не обрабатываем и отдаем файл целиком
+MAX_RANGES = 16
+
+# Превью не меняются при неизменном содержимом файла (1 год)
+PREVIEW_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class RangeNotSatisfiable(Exception):
+    """
+    Raised when none of the requested byte ranges overlaps the file
+    """
+
+
+def get_content_type(document, file_path):
+    """
+    Determine the MIME type of a document file
+    """
+    content_type, encoding = mimetypes.guess_type(file_path)
+    if content_type is None:
+        content_type = CONTENT_TYPES.get(document.file_format, 'application/octet-stream')
+    return content_type
+
+
+def get_download_filename(document):
+    """
+    File name shown to the user (stored files are named by content hash)
+    """
+    return document.original_filename or os.path.basename(document.file.name)
+
+
+def make_etag(stat_result):
+    """
+    Strong validator built from the file modification time and size
+    """
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def parse_range_header(header, size):
+    """
+    Parse a ``Range: bytes=...`` header into a sorted list of (start, end) pairs
+    (end inclusive) with overlapping ranges merged.
+
+    Returns None if the header should be ignored (malformed, other unit or too many
+    ranges) and raises RangeNotSatisfiable if no range overlaps the file.
+    """
+    if not header:
+        return None
+    unit, _, range_set = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not range_set:
+        return None
+
+    specs = [spec.strip() for spec in range_set.split(',') if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        start, sep, end = spec.partition('-')
+        if not sep:
+            return None
+        try:
+            if start.strip() == '':
+                # Суффиксный диапазон: последние N байт
+                length = int(end)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(start)
+            end = int(end) if end.strip() else None
+        except ValueError:
+            return None
+        if end is not None and start > end:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_matches(request, etag, last_modified):
+    """
+    Check the If-Range precondition: the range applies only if the file has not changed
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _read_range(file_path, start, end, chunk_size):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _multipart_ranges(file_path, ranges, parts, boundary, chunk_size):
+    for (start, end), part_header in zip(ranges, parts):
+        yield part_header
+        yield from _read_range(file_path, start, end, chunk_size)
+    yield f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+
+# Файлы для асинхронных представлений читаются в отдельном небольшом пуле потоков:
+# ожидание диска не занимает ни цикл событий, ни общий пул sync_to_async
+_reader_executor = None
+_reader_executor_lock = threading.Lock()
+
+
+def get_reader_executor():
+    global _reader_executor
+    with _reader_executor_lock:
+        if _reader_executor is None:
+            _reader_executor = ThreadPoolExecutor(
+                max_workers=settings.FILE_STREAM_THREADS,
+                thread_name_prefix='docflow-file-reader',
+            )
+        return _reader_executor
+
+
+async def _run_in_reader(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_reader_executor(), func, *args)
+
+
+async def _aread_range(file_path, start, end, chunk_size):
+    f = await _run_in_reader(open, file_path, 'rb')
+    try:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await _run_in_reader(f.read, min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+async def _amultipart_ranges(file_path, ranges, parts, boundary, chunk_size):
+    for (start, end), part_header in zip(ranges, parts):
+        yield part_header
+        async for chunk in _aread_range(file_path, start, end, chunk_size):
+            yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+
+def serve_document_file(request, document, as_attachment=False):
+    """
+    Build a response that streams a document file.
+
+    The whole file is sent with FileResponse (which lets the WSGI server use
+    sendfile), byte ranges are answered with 206 Partial Content (single range or
+    multipart/byteranges) and ETag/Last-Modified validators allow 304 responses.
+    Raises FileNotFoundError if the file is missing.
+    """
+    file_path = document.file.path
+    stat_result = os.stat(file_path)
+    return _file_response(request, document, file_path, stat_result, as_attachment, asynchronous=False)
+
+
+async def aserve_document_file(request, document, as_attachment=False):
+    """
+    Async version of serve_document_file for ASGI: the file is read in chunks
+    by the reader thread pool and streamed through an async iterator, so a slow
+    download holds neither a request thread nor the event loop
+    """
+    file_path = document.file.path
+    stat_result = await _run_in_reader(os.stat, file_path)
+    return _file_response(request, document, file_path, stat_result, as_attachment, asynchronous=True)
+
+
+def _file_response(request, document, file_path, stat_result, as_attachment, asynchronous):
+    if settings.FILE_OFFLOAD_MODE:
+        return offload_document_file(document, file_path, as_attachment)
+
+    size = stat_result.st_size
+    etag = make_etag(stat_result)
+    last_modified = int(stat_result.st_mtime)
+    content_type = get_content_type(document, file_path)
+    filename = get_download_filename(document)
+    chunk_size = settings.FILE_STREAM_CHUNK_SIZE
+
+    # Условные запросы (If-None-Match / If-Modified-Since): 304 без тела
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        return _finalize(conditional, etag, last_modified)
+
+    ranges = None
+    if request.method in ('GET', 'HEAD') and _if_range_matches(request, etag, last_modified):
+        try:
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return _finalize(response, etag, last_modified)
+
+    read_range = _aread_range if asynchronous else _read_range
+    if not ranges and asynchronous:
+        response = StreamingHttpResponse(read_range(file_path, 0, size - 1, chunk_size), content_type=content_type)
+        response['Content-Length'] = str(size)
+    elif not ranges:
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+        response.block_size = chunk_size
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(
+            read_range(file_path, start, end, chunk_size),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode('ascii')
+            for start, end in ranges
+        ]
+        length = sum(len(part) for part in parts)
+        length += sum(end - start + 1 for start, end in ranges)
+        length += len(f'\r\n--{boundary}--\r\n')
+        multipart_ranges = _amultipart_ranges if asynchronous else _multipart_ranges
+        response = StreamingHttpResponse(
+            multipart_ranges(file_path, ranges, parts, boundary, chunk_size),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+        )
+        response['Content-Length'] = str(length)
+
+    response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    response['X-Content-Type-Options'] = 'nosniff'
+    return _finalize(response, etag, last_modified)
+
+
+def offload_document_file(document, file_path, as_attachment=False):
+    """
+    Hand the transfer over to the front proxy.
+
+    The view has already checked permissions; the response carries no body, only
+    an X-Accel-Redirect (nginx, internal location mapped to MEDIA_ROOT) or
+    X-Sendfile (Apache mod_xsendfile, lighttpd) header. The proxy then streams the
+    file itself, including Range and conditional requests, and the worker is freed
+    immediately.
+    """
+    mode = settings.FILE_OFFLOAD_MODE
+    response = HttpResponse(content_type=get_content_type(document, file_path))
+
+    if mode == 'nginx':
+        prefix = settings.FILE_OFFLOAD_NGINX_PREFIX.rstrip('/')
+        relative_path = document.file.name.replace(os.sep, '/').lstrip('/')
+        response['X-Accel-Redirect'] = f'{prefix}/{quote(relative_path)}'
+    elif mode == 'sendfile':
+        response['X-Sendfile'] = file_path
+    else:
+        raise ImproperlyConfigured(f"Unknown FILE_OFFLOAD_MODE: {mode!r}")
+
+    filename = get_download_filename(document)
+    response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    response['X-Content-Type-Options'] = 'nosniff'
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _finalize(response, etag, last_modified):
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Документы личные: кэшировать можно только в браузере и с проверкой актуальности
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def serve_preview(request, file_path, content_type):
+    """
+    Send a preview image. The preview URL carries the version of the file
+    content, so the browser may keep the response for a year without revalidation
+    """
+    stat_result = os.stat(file_path)
+    etag = make_etag(stat_result)
+    last_modified = int(stat_result.st_mtime)
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is None:
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+    else:
+        response = conditional
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = f'private, max-age={PREVIEW_CACHE_MAX_AGE}, immutable'
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
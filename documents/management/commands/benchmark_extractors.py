@@ -0,0 +1,76 @@
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.benchmark import (
+    BENCHMARK_CASES, benchmark_report, build_corpus, find_regressions, load_report, run_benchmark,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the text extraction functions on a generated synthetic corpus: "
+        "p50/p95 latency, pages/s, MB/s and peak RSS, written as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the corpus generator")
+        parser.add_argument('--files', type=int, default=5, help="Files per case")
+        parser.add_argument('--scale', type=int, default=1, help="Size multiplier of the generated files")
+        parser.add_argument('--repeat', type=int, default=3, help="Timed runs per file")
+        parser.add_argument(
+            '--case', action='append', dest='cases', choices=[case[0] for case in BENCHMARK_CASES],
+            help="Run only the given case (can be repeated)",
+        )
+        parser.add_argument('--corpus-dir', help="Generate the corpus here and keep it (default: a temporary directory)")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+        parser.add_argument('--baseline', help="JSON report of a previous run to compare with")
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help="Allowed slowdown against the baseline as a fraction (default 0.2 - 20%%)",
+        )
+
+    def handle(self, *args, **options):
+        if options['files'] < 1 or options['scale'] < 1 or options['repeat'] < 1:
+            raise CommandError("--files, --scale and --repeat must be positive")
+        baseline = load_report(options['baseline']) if options['baseline'] else None
+
+        corpus_dir = options['corpus_dir'] or tempfile.mkdtemp(prefix='docflow-benchmark-')
+        try:
+            corpus = build_corpus(
+                corpus_dir, seed=options['seed'], files=options['files'],
+                scale=options['scale'], cases=options['cases'],
+            )
+            results = run_benchmark(corpus, repeat=options['repeat'])
+        finally:
+            if not options['corpus_dir']:
+                shutil.rmtree(corpus_dir, ignore_errors=True)
+
+        report = benchmark_report(results, options['seed'], options['files'], options['scale'], options['repeat'])
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(data + '\n')
+        else:
+            self.stdout.write(data)
+
+        for name, metrics in results.items():
+            if 'skipped' in metrics:
+                self.stderr.write(f"{name}: skipped ({metrics['skipped']})")
+            else:
+                self.stderr.write(
+                    f"{name}: p50 {metrics['p50_ms']} ms, p95 {metrics['p95_ms']} ms, "
+                    f"{metrics['pages_per_s']} pages/s, {metrics['mb_per_s']} MB/s, "
+                    f"peak RSS {metrics['peak_rss_mb']} MB"
+                )
+
+        if baseline is not None:
+            regressions = find_regressions(results, baseline, options['threshold'])
+            if regressions:
+                details = '; '.join(
+                    f"{name} {metric}: {previous} -> {current}" for name, metric, previous, current in regressions
+                )
+                raise CommandError(f"Performance regression over {options['threshold']:.0%}: {details}")
+            self.stderr.write(f"No regressions over {options['threshold']:.0%} against {options['baseline']}")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from documents.uploads import purge_stale_uploads
+
+
+class Command(BaseCommand):
+    help = "Remove abandoned chunked upload sessions and their temporary files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=None,
+            help="Age in seconds after the last received chunk (default: UPLOAD_SESSION_TTL)",
+        )
+
+    def handle(self, *args, **options):
+        count = purge_stale_uploads(options['older_than'])
+        self.stdout.write(f"Removed {count} upload sessions")
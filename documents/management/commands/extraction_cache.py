@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from documents.extraction_cache import get_extraction_cache
+
+
+class Command(BaseCommand):
+    help = "Show statistics of the extraction result cache or clean it up"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--evict', action='store_true',
+            help="Remove outdated extractor versions and trim the cache to its size limit",
+        )
+        parser.add_argument(
+            '--clear', action='store_true',
+            help="Remove all cached extraction results",
+        )
+
+    def handle(self, *args, **options):
+        cache = get_extraction_cache()
+        if options['clear']:
+            cache.clear()
+            self.stdout.write("Extraction cache cleared")
+        elif options['evict']:
+            cache.evict(rescan=True)
+
+        stats = cache.stats()
+        self.stdout.write(
+            f"Entries: {stats['entries']}, size: {stats['bytes']} of {stats['max_bytes']} bytes\n"
+            f"Hits: {stats['hits']}, misses: {stats['misses']}, hit ratio: {stats['hit_ratio']:.1%}"
+        )
@@ -0,0 +1,146 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from documents.extraction_cache import get_extraction_cache
+from documents.tasks import claim_next_job, requeue_stale_jobs, run_job
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """
+    Poll loop of one worker process: claims jobs one at a time until stopped
+    """
+    def __init__(self, timeout, poll_interval, once):
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.once = once
+        self.stop_event = threading.Event()
+
+    def install_signal_handlers(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.request_stop)
+            signal.signal(signal.SIGTERM, self.request_stop)
+
+    def request_stop(self, signum, frame):
+        logger.info(f"Stop requested, worker {os.getpid()} finishes its current job")
+        self.stop_event.set()
+
+    def run(self):
+        processed = 0
+        # Задачи, которые «зависли» дольше двойного таймаута (воркер упал или был убит),
+        # возвращаются в очередь при запуске и затем периодически
+        next_requeue = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                if time.monotonic() >= next_requeue:
+                    requeue_stale_jobs(older_than=self.timeout * 2)
+                    next_requeue = time.monotonic() + self.timeout
+
+                job = claim_next_job()
+                if job is None:
+                    if self.once:
+                        break
+                    self.stop_event.wait(self.poll_interval)
+                    continue
+
+                run_job(job, timeout=self.timeout)
+                processed += 1
+        finally:
+            get_extraction_cache().flush_stats()
+            connections.close_all()
+        return processed
+
+
+def _worker_process(timeout, poll_interval, once, results):
+    # Процесс может быть запущен методом spawn/forkserver, где Django еще не настроен
+    django.setup()
+    worker = Worker(timeout, poll_interval, once)
+    worker.install_signal_handlers()
+    results.put(worker.run())
+
+
+class Command(BaseCommand):
+    help = "Run the background worker that extracts text from queued documents"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.EXTRACTION_WORKER_CONCURRENCY,
+            help="Number of worker processes, each processing one job at a time",
+        )
+        parser.add_argument(
+            '--timeout', type=int, default=settings.EXTRACTION_TIMEOUT,
+            help="Seconds a single extraction may run before it is killed",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.EXTRACTION_POLL_INTERVAL,
+            help="Seconds to wait before polling an empty queue again",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Process the jobs that are currently available and exit",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        timeout = options['timeout']
+        poll_interval = options['poll_interval']
+        once = options['once']
+
+        self.stdout.write(f"Extraction worker started (concurrency={concurrency}, timeout={timeout}s)")
+        if concurrency == 1:
+            worker = Worker(timeout, poll_interval, once)
+            worker.install_signal_handlers()
+            processed = worker.run()
+        else:
+            processed = self._run_processes(concurrency, timeout, poll_interval, once)
+        self.stdout.write(f"Extraction worker stopped, {processed} jobs processed")
+
+    def _run_processes(self, concurrency, timeout, poll_interval, once):
+        """
+        Run ``concurrency`` single-threaded worker processes: extraction and OCR are
+        CPU-bound, and threads of one process would share a single core
+        """
+        # Дочерние процессы не должны унаследовать открытые соединения с БД
+        connections.close_all()
+        results = multiprocessing.Queue()
+        # Процессы не демонические: экстрактор запускает собственные дочерние процессы
+        processes = [
+            multiprocessing.Process(
+                target=_worker_process, args=(timeout, poll_interval, once, results),
+                name=f'extraction-worker-{index}',
+            )
+            for index in range(concurrency)
+        ]
+        for process in processes:
+            process.start()
+
+        def forward_stop(signum, frame):
+            logger.info("Stop requested, finishing current jobs")
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGTERM)
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, forward_stop)
+            signal.signal(signal.SIGTERM, forward_stop)
+
+        processed = 0
+        for process in processes:
+            process.join()
+            if process.exitcode == 0:
+                processed += results.get()
+            else:
+                logger.error(f"Worker process {process.name} exited with code {process.exitcode}")
+        return processed
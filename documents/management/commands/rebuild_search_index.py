@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from documents.models import Document
+from documents.search import clear_fuzzy_vocabulary, rebuild_page_index, update_index_bulk
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for all documents and their pages"
+
+    def handle(self, *args, **options):
+        # Словарь нечеткого поиска собирается заново, без слов удаленных документов
+        clear_fuzzy_vocabulary()
+        count = 0
+        batch = []
+        for document in (
+            Document.objects.select_related('content')
+            .only('id', 'title', 'content__text', 'content__compressed_text')
+            .iterator(chunk_size=BATCH_SIZE)
+        ):
+            batch.append(document)
+            if len(batch) >= BATCH_SIZE:
+                update_index_bulk(batch)
+                count += len(batch)
+                batch = []
+        update_index_bulk(batch)
+        count += len(batch)
+        rebuild_page_index()
+        self.stdout.write(f"Indexed {count} documents")
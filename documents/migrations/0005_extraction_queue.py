@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-17 20:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def mark_existing_documents_extracted(apps, schema_editor):
+    # Documents uploaded before the queue existed were extracted inline
+    Document = apps.get_model('documents', 'Document')
+    Document.objects.update(extraction_status='done')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_document_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='extraction_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Text extraction status'),
+        ),
+        migrations.RunPython(mark_existing_documents_extracted, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ExtractionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10, verbose_name='Job status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts made')),
+                ('max_attempts', models.PositiveIntegerField(default=3, verbose_name='Maximum attempts')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Available from')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='Claimed at')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='extraction_jobs', to='documents.document', verbose_name='Document')),
+            ],
+            options={
+                'ordering': ['available_at', 'id'],
+                'indexes': [models.Index(fields=['status', 'available_at'], name='extraction_job_queue_idx')],
+            },
+        ),
+    ]
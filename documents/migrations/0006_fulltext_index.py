@@ -0,0 +1,47 @@
+from django.db import migrations
+
+
+def create_fulltext_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        # porter: стемминг английских слов; unicode61: регистр и юникод (в т.ч. кириллица)
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE documents_document_fts USING fts5("
+            "title, body, tokenize = 'porter unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            "INSERT INTO documents_document_fts (rowid, title, body) "
+            "SELECT id, REPLACE(REPLACE(title, 'ё', 'е'), 'Ё', 'Е'), "
+            "REPLACE(REPLACE(text_content, 'ё', 'е'), 'Ё', 'Е') FROM documents_document"
+        )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE documents_document ADD COLUMN search_vector tsvector")
+        schema_editor.execute(
+            "UPDATE documents_document SET search_vector = "
+            "setweight(to_tsvector('russian', translate(title, 'ёЁ', 'еЕ')), 'A') || "
+            "setweight(to_tsvector('russian', translate(text_content, 'ёЁ', 'еЕ')), 'B')"
+        )
+        schema_editor.execute(
+            "CREATE INDEX documents_document_search_vector_idx "
+            "ON documents_document USING GIN (search_vector)"
+        )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS documents_document_fts")
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS documents_document_search_vector_idx")
+        schema_editor.execute("ALTER TABLE documents_document DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_extraction_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:05
+
+import django.db.models.deletion
+import documents.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('file', models.FileField(max_length=255, upload_to=documents.models.blob_upload_path, verbose_name='Stored file')),
+                ('size', models.PositiveBigIntegerField(verbose_name='File size (bytes)')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Reference count')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='original_filename',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Original file name'),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='file',
+            field=models.FileField(max_length=255, upload_to=documents.models.document_upload_path, verbose_name='Document file'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='documents', to='documents.blob', verbose_name='Stored file'),
+        ),
+    ]
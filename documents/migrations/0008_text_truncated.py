@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='text_truncated',
+            field=models.BooleanField(default=False, verbose_name='Extracted text is truncated'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:26
+
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_text_to_content(apps, schema_editor):
+    # Одним запросом на стороне БД: тексты не проходят через Python
+    schema_editor.execute(
+        "INSERT INTO documents_documentcontent (document_id, text, compressed_text) "
+        "SELECT id, text_content, NULL FROM documents_document WHERE text_content <> ''"
+    )
+
+
+def move_text_back(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    DocumentContent = apps.get_model('documents', 'DocumentContent')
+    for content in DocumentContent.objects.iterator(chunk_size=200):
+        text = content.text
+        if content.compressed_text is not None:
+            text = zlib.decompress(bytes(content.compressed_text)).decode('utf-8')
+        Document.objects.filter(pk=content.document_id).update(text_content=text)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_document_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentContent',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='content', serialize=False, to='documents.document', verbose_name='Document')),
+                ('text', models.TextField(blank=True, verbose_name='Extracted text')),
+                ('compressed_text', models.BinaryField(blank=True, null=True, verbose_name='Compressed extracted text')),
+            ],
+        ),
+        migrations.RunPython(move_text_to_content, move_text_back),
+        migrations.RemoveField(
+            model_name='document',
+            name='text_content',
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_page_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        # Индекс с внешним содержимым: текст страниц хранится только в documents_documentpage,
+        # а триггеры поддерживают индекс при любых изменениях таблицы (в т.ч. каскадном удалении)
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE documents_page_fts USING fts5("
+            "text, content = 'documents_documentpage', content_rowid = 'id', "
+            "tokenize = 'porter unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            "CREATE TRIGGER documents_page_fts_insert AFTER INSERT ON documents_documentpage BEGIN "
+            "INSERT INTO documents_page_fts (rowid, text) "
+            "VALUES (new.id, REPLACE(REPLACE(new.text, 'ё', 'е'), 'Ё', 'Е')); END"
+        )
+        schema_editor.execute(
+            "CREATE TRIGGER documents_page_fts_delete AFTER DELETE ON documents_documentpage BEGIN "
+            "INSERT INTO documents_page_fts (documents_page_fts, rowid, text) "
+            "VALUES ('delete', old.id, REPLACE(REPLACE(old.text, 'ё', 'е'), 'Ё', 'Е')); END"
+        )
+        schema_editor.execute(
+            "CREATE TRIGGER documents_page_fts_update AFTER UPDATE ON documents_documentpage BEGIN "
+            "INSERT INTO documents_page_fts (documents_page_fts, rowid, text) "
+            "VALUES ('delete', old.id, REPLACE(REPLACE(old.text, 'ё', 'е'), 'Ё', 'Е')); "
+            "INSERT INTO documents_page_fts (rowid, text) "
+            "VALUES (new.id, REPLACE(REPLACE(new.text, 'ё', 'е'), 'Ё', 'Е')); END"
+        )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "ALTER TABLE documents_documentpage ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('russian', translate(text, 'ёЁ', 'еЕ'))) STORED"
+        )
+        schema_editor.execute(
+            "CREATE INDEX documents_documentpage_search_vector_idx "
+            "ON documents_documentpage USING GIN (search_vector)"
+        )
+
+
+def drop_page_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS documents_page_fts_{trigger}")
+        schema_editor.execute("DROP TABLE IF EXISTS documents_page_fts")
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS documents_documentpage_search_vector_idx")
+        schema_editor.execute("ALTER TABLE documents_documentpage DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0011_document_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='Page number')),
+                ('label', models.CharField(blank=True, max_length=255, verbose_name='Page label')),
+                ('text', models.TextField(blank=True, verbose_name='Page text')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='documents.document', verbose_name='Document')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('document', 'number'), name='document_page_number_uniq')],
+            },
+        ),
+        migrations.RunPython(create_page_index, drop_page_index),
+    ]
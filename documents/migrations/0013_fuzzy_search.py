@@ -0,0 +1,111 @@
+import re
+import zlib
+
+from django.db import migrations
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _words(text):
+    text = (text or '').replace('ё', 'е').replace('Ё', 'Е').lower()
+    return {word for word in WORD_RE.findall(text) if 3 <= len(word) <= 40 and not word.isdigit()}
+
+
+def fill_vocabulary(apps, schema_editor):
+    # Словарь для уже загруженных документов (дальше он пополняется при индексации)
+    Document = apps.get_model('documents', 'Document')
+    DocumentContent = apps.get_model('documents', 'DocumentContent')
+
+    words = set()
+    for title in Document.objects.values_list('title', flat=True).iterator(chunk_size=500):
+        words |= _words(title)
+    for content in DocumentContent.objects.iterator(chunk_size=200):
+        text = content.text
+        if content.compressed_text is not None:
+            text = zlib.decompress(bytes(content.compressed_text)).decode('utf-8')
+        words |= _words(text)
+
+    words = sorted(words)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO documents_fuzzy_word (id, word, trigram_count) VALUES (%s, %s, %s)",
+            [[word_id, word, len(_trigrams(word))] for word_id, word in enumerate(words, start=1)],
+        )
+        cursor.executemany(
+            "INSERT INTO documents_fuzzy_trigram (trigram, word_id) VALUES (%s, %s)",
+            [[trigram, word_id] for word_id, word in enumerate(words, start=1) for trigram in _trigrams(word)],
+        )
+
+
+def fill_fuzzy_words(apps, schema_editor):
+    # Слова уже загруженных текстов, в том числе сжатых (дальше колонку заполняет индексация)
+    DocumentContent = apps.get_model('documents', 'DocumentContent')
+
+    rows = []
+    with schema_editor.connection.cursor() as cursor:
+        for content in DocumentContent.objects.iterator(chunk_size=200):
+            text = content.text
+            if content.compressed_text is not None:
+                text = zlib.decompress(bytes(content.compressed_text)).decode('utf-8')
+            rows.append([' '.join(sorted(_words(text))), content.document_id])
+            if len(rows) >= 200:
+                cursor.executemany("UPDATE documents_document SET fuzzy_words = %s WHERE id = %s", rows)
+                rows = []
+        if rows:
+            cursor.executemany("UPDATE documents_document SET fuzzy_words = %s WHERE id = %s", rows)
+
+
+def create_fuzzy_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE TABLE documents_fuzzy_word ("
+            "id INTEGER PRIMARY KEY, word TEXT NOT NULL UNIQUE, trigram_count INTEGER NOT NULL)"
+        )
+        # Списки слов по триграмме хранятся рядом (WITHOUT ROWID - таблица упорядочена по ключу)
+        schema_editor.execute(
+            "CREATE TABLE documents_fuzzy_trigram ("
+            "trigram TEXT NOT NULL, word_id INTEGER NOT NULL, PRIMARY KEY (trigram, word_id)) WITHOUT ROWID"
+        )
+        fill_vocabulary(apps, schema_editor)
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX documents_document_title_trgm_idx ON documents_document "
+            "USING GIN (translate(title, 'ёЁ', 'еЕ') gin_trgm_ops)"
+        )
+        # Нечеткий поиск по тексту идет по словам текста в строке документа:
+        # поле text пусто у сжатых текстов, а индекс по целому тексту очень велик
+        schema_editor.execute("ALTER TABLE documents_document ADD COLUMN fuzzy_words text NOT NULL DEFAULT ''")
+        fill_fuzzy_words(apps, schema_editor)
+        schema_editor.execute(
+            "CREATE INDEX documents_document_fuzzy_words_trgm_idx ON documents_document "
+            "USING GIN (fuzzy_words gin_trgm_ops)"
+        )
+
+
+def drop_fuzzy_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS documents_fuzzy_trigram")
+        schema_editor.execute("DROP TABLE IF EXISTS documents_fuzzy_word")
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS documents_document_fuzzy_words_trgm_idx")
+        schema_editor.execute("ALTER TABLE documents_document DROP COLUMN IF EXISTS fuzzy_words")
+        schema_editor.execute("DROP INDEX IF EXISTS documents_document_title_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_document_pages'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fuzzy_index, drop_fuzzy_index),
+    ]
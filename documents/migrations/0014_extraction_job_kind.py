@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0013_fuzzy_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extractionjob',
+            name='kind',
+            field=models.CharField(choices=[('extract', 'Text extraction'), ('preview', 'Preview generation')], default='extract', max_length=10, verbose_name='Job kind'),
+        ),
+    ]
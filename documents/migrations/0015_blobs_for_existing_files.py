@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import posixpath
+
+from django.db import migrations, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+# Каталог превью на момент миграции (значение PREVIEW_DIR по умолчанию): миграция
+# не зависит от настроек, с которыми запускается
+PREVIEW_DIR = 'previews'
+
+
+def _sha256(storage, name):
+    hasher = hashlib.sha256()
+    with storage.open(name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def create_blobs(apps, schema_editor):
+    # Документы, загруженные до хранения по хешу, получают Blob: файл остается на месте
+    # и становится файлом Blob, копии одинакового содержимого заменяются ссылкой на него
+    Document = apps.get_model('documents', 'Document')
+    Blob = apps.get_model('documents', 'Blob')
+    storage = Document._meta.get_field('file').storage
+
+    duplicates = set()
+    documents = Document.objects.filter(blob__isnull=True).exclude(file='').only('pk', 'file')
+    for document in documents.iterator(chunk_size=200):
+        name = document.file.name
+        try:
+            sha256 = _sha256(storage, name)
+            size = storage.size(name)
+        except OSError:
+            logger.warning(f"File of document {document.pk} is missing: {name}")
+            continue
+
+        blob = Blob.objects.filter(sha256=sha256).first()
+        if blob is None:
+            blob = Blob.objects.create(sha256=sha256, file=name, size=size)
+        elif blob.file.name != name:
+            duplicates.add(name)
+            document.file = blob.file.name
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        document.blob = blob
+        document.save(update_fields=['blob', 'file'])
+
+        # Превью таких документов хранились по номеру документа, теперь - по хешу файла
+        key = f'doc{document.pk:08d}'
+        preview_dir = posixpath.join(PREVIEW_DIR, key[:2], key[2:4])
+        try:
+            _, files = storage.listdir(preview_dir)
+        except OSError:
+            files = []
+        for file_name in files:
+            if file_name.startswith(f'{key}-'):
+                preview = posixpath.join(preview_dir, file_name)
+                transaction.on_commit(lambda preview=preview: storage.delete(preview))
+
+    for name in duplicates:
+        if not Document.objects.filter(file=name).exists():
+            transaction.on_commit(lambda name=name: storage.delete(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0014_extraction_job_kind'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_blobs, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,123 @@
-from django.db import models
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
+import logging
 import os
+import threading
+import uuid
+import zlib
 from django.utils import timezone
 from django.contrib.auth.models import User
+from .storage import compute_sha256
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
 
 def document_upload_path(instance, filename):
     # Generate path like: documents/YYYY/MM/DD/filename
     today = timezone.now()
     return f'documents/{today.year}/{today.month}/{today.day}/{filename}'
 
+def blob_upload_path(instance, filename):
+    # Generate path like: blobs/ab/cd/abcd...ef.pdf (sharded by content hash)
+    ext = os.path.splitext(filename)[1].lower()
+    return f'blobs/{instance.sha256[:2]}/{instance.sha256[2:4]}/{instance.sha256}{ext}'
+
+class BlobManager(models.Manager):
+    def acquire(self, uploaded_file):
+        """
+        Store an uploaded file by its SHA-256 hash and take a reference to it.
+        If a blob with the same content already exists, the file is not written again
+        """
+        sha256 = getattr(uploaded_file, 'sha256', None) or compute_sha256(uploaded_file)
+        
+        with transaction.atomic():
+            blob, created = self.select_for_update().get_or_create(
+                sha256=sha256,
+                defaults={'size': uploaded_file.size},
+            )
+            if created or not blob.file or not blob.file.storage.exists(blob.file.name):
+                blob.file.save(uploaded_file.name, uploaded_file, save=False)
+                _track_written_file(blob.file.storage, blob.file.name)
+            
+            blob.ref_count = F('ref_count') + 1
+            blob.save(update_fields=['file', 'ref_count'])
+            blob.refresh_from_db(fields=['ref_count'])
+        return blob
+
+# Файлы, записанные acquire() внутри blob_atomic() текущего потока
+_written_files = threading.local()
+
+def _track_written_file(storage, name):
+    files = getattr(_written_files, 'files', None)
+    if files is not None:
+        files.append((storage, name))
+
+@contextmanager
+def blob_atomic():
+    """
+    transaction.atomic() for code that stores files with Blob.objects.acquire:
+    if the block is rolled back, the files written inside it are removed unless
+    a committed blob (stored by a concurrent request) refers to them
+    """
+    files = getattr(_written_files, 'files', None)
+    outermost = files is None
+    if outermost:
+        files = _written_files.files = []
+    start = len(files)
+    try:
+        with transaction.atomic():
+            yield
+    except BaseException:
+        written = files[start:]
+        del files[start:]
+        for storage, name in written:
+            try:
+                if not Blob.objects.filter(file=name).exists():
+                    storage.delete(name)
+            except Exception as e:
+                logger.error(f"Failed to remove file {name} of a rolled back upload: {e}")
+        raise
+    finally:
+        if outermost:
+            _written_files.files = None
+
+class Blob(models.Model):
+    """
+    Content-addressed file storage.
+    Documents with identical content share one blob; the file is removed when
+    the last document referencing it is deleted.
+    """
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name="SHA-256")
+    file = models.FileField(upload_to=blob_upload_path, max_length=255, verbose_name="Stored file")
+    size = models.PositiveBigIntegerField(verbose_name="File size (bytes)")
+    ref_count = models.PositiveIntegerField(default=0, verbose_name="Reference count")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created at")
+    
+    objects = BlobManager()
+    
+    def __str__(self):
+        return self.sha256
+    
+    def release(self):
+        """
+        Drop one reference; delete the blob and its file when no references remain
+        """
+        with transaction.atomic():
+            Blob.objects.filter(pk=self.pk).update(ref_count=F('ref_count') - 1)
+            blob = Blob.objects.select_for_update().filter(pk=self.pk).first()
+            if blob is None or blob.ref_count > 0:
+                return
+            
+            from .previews import remove_previews
+            file_name = blob.file.name
+            storage = blob.file.storage
+            super(Blob, blob).delete()
+            # Файл и его превью удаляем только после фиксации транзакции
+            transaction.on_commit(lambda: storage.delete(file_name))
+            transaction.on_commit(lambda: remove_previews(blob.sha256))
+
 class Document(models.Model):
     """
     Model to store document information and files.
@@ -47,23 +157,92 @@ class Document(models.Model):
         (MD, 'MD'),
     ]
     
+    # Text extraction states (extraction runs in the background worker)
+    EXTRACTION_PENDING = 'pending'
+    EXTRACTION_RUNNING = 'running'
+    EXTRACTION_DONE = 'done'
+    EXTRACTION_FAILED = 'failed'
+    
+    EXTRACTION_STATUS_CHOICES = [
+        (EXTRACTION_PENDING, 'Pending'),
+        (EXTRACTION_RUNNING, 'Running'),
+        (EXTRACTION_DONE, 'Done'),
+        (EXTRACTION_FAILED, 'Failed'),
+    ]
+    
     title = models.CharField(max_length=255, verbose_name="Document title")
-    file = models.FileField(upload_to=document_upload_path, verbose_name="Document file")
+    file = models.FileField(upload_to=document_upload_path, max_length=255, verbose_name="Document file")
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='documents', verbose_name="Stored file", null=True, blank=True)
+    original_filename = models.CharField(max_length=255, blank=True, verbose_name="Original file name")
     file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES, verbose_name="File format", blank=True, null=True)
-    text_content = models.TextField(blank=True, verbose_name="Extracted text content")
+    text_truncated = models.BooleanField(default=False, verbose_name="Extracted text is truncated")
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documents', verbose_name="Document owner", null=True)
+    extraction_status = models.CharField(max_length=10, choices=EXTRACTION_STATUS_CHOICES, default=EXTRACTION_PENDING, verbose_name="Text extraction status")
     
     # Metadata
     upload_date = models.DateTimeField(auto_now_add=True, verbose_name="Upload date")
     size = models.PositiveIntegerField(verbose_name="File size (bytes)")
     
+    class Meta:
+        indexes = [
+            # Списки и поиск всегда фильтруют по владельцу и сортируют по дате загрузки
+            models.Index(fields=['owner', '-upload_date', '-id'], name='document_owner_date_idx'),
+            models.Index(fields=['file_format'], name='document_format_idx'),
+        ]
+    
     def __str__(self):
         return self.title
     
+    @property
+    def text_content(self):
+        """
+        Extracted text. It is stored in DocumentContent and loaded on first access;
+        use select_related('content') when the text of many documents is needed
+        """
+        if not hasattr(self, '_text_content'):
+            try:
+                self._text_content = self.content.get_text() if self.pk else ''
+            except DocumentContent.DoesNotExist:
+                self._text_content = ''
+        return self._text_content
+    
+    @text_content.setter
+    def text_content(self, value):
+        self._text_content = value or ''
+    
+    def save_text(self):
+        """
+        Store text_content in DocumentContent (the search index is updated by a signal)
+        """
+        content = DocumentContent.from_text(self, self.text_content)
+        content.save()
+        self.content = content
+    
+    def save_pages(self, pages):
+        """
+        Replace the stored pages with ``pages`` - (label, text) pairs in page order.
+        None or an empty list leaves the document without pages
+        """
+        self.pages.all().delete()
+        if pages:
+            DocumentPage.objects.bulk_create([
+                DocumentPage(document=self, number=number, label=(label or '')[:255], text=text)
+                for number, (label, text) in enumerate(pages, start=1)
+            ], batch_size=500)
+    
+    def copy_pages(self, source):
+        """
+        Copy the stored pages of another document with the same file
+        """
+        self.save_pages([(page.label, page.text) for page in source.pages.order_by('number')])
+    
     def save(self, *args, **kwargs):
         # If this is a new document, calculate its size
         if not self.pk:
             self.size = self.file.size
+            # У нового документа еще нет извлеченного текста
+            if not hasattr(self, '_text_content'):
+                self._text_content = ''
             
             # Determine file format from extension if not set
             if not self.file_format and self.file:
@@ -75,10 +254,141 @@ class Document(models.Model):
                     self.file_format = ext
                     
         super().save(*args, **kwargs)
+
+
+class DocumentContent(models.Model):
+    """
+    Extracted text of a document.
+    
+    Kept out of the Document row so that lists, permission checks and other
+    metadata queries do not read large texts. Texts of TEXT_COMPRESSION_MIN_CHARS
+    characters or more are stored zlib-compressed in ``compressed_text``.
+    """
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, primary_key=True, related_name='content', verbose_name="Document")
+    text = models.TextField(blank=True, verbose_name="Extracted text")
+    compressed_text = models.BinaryField(null=True, blank=True, verbose_name="Compressed extracted text")
+    
+    def __str__(self):
+        return f"Text of document {self.document_id}"
+    
+    @classmethod
+    def from_text(cls, document, text):
+        content = cls(document=document)
+        min_chars = settings.TEXT_COMPRESSION_MIN_CHARS
+        if min_chars is not None and len(text) >= min_chars:
+            content.compressed_text = zlib.compress(text.encode('utf-8'), settings.TEXT_COMPRESSION_LEVEL)
+        else:
+            content.text = text
+        return content
+    
+    @property
+    def is_compressed(self):
+        return self.compressed_text is not None
+    
+    def get_text(self):
+        if self.is_compressed:
+            return zlib.decompress(bytes(self.compressed_text)).decode('utf-8')
+        return self.text
+
+class DocumentPage(models.Model):
+    """
+    Text of one page of a paged document: a PDF page or a spreadsheet sheet.
+    
+    Pages have their own full-text index, so a search hit can point at the page
+    that matched. ``number`` starts at 1, ``label`` holds the sheet name.
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='pages', verbose_name="Document")
+    number = models.PositiveIntegerField(verbose_name="Page number")
+    label = models.CharField(max_length=255, blank=True, verbose_name="Page label")
+    text = models.TextField(blank=True, verbose_name="Page text")
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'number'], name='document_page_number_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"Page {self.number} of document {self.document_id}"
+
+class ExtractionJob(models.Model):
+    """
+    Queue entry for background text extraction (or for rendering the previews
+    of a document that were requested before they existed).
+    
+    The queue lives in the database, so no external broker is needed: workers
+    (see the ``process_extraction_jobs`` management command) claim jobs with a
+    conditional UPDATE, which is atomic on every supported backend.
+    """
+    EXTRACT = 'extract'
+    PREVIEW = 'preview'
+    
+    KIND_CHOICES = [
+        (EXTRACT, 'Text extraction'),
+        (PREVIEW, 'Preview generation'),
+    ]
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='extraction_jobs', verbose_name="Document")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=EXTRACT, verbose_name="Job kind")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, verbose_name="Job status")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Attempts made")
+    max_attempts = models.PositiveIntegerField(default=3, verbose_name="Maximum attempts")
+    available_at = models.DateTimeField(default=timezone.now, verbose_name="Available from")
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="Claimed at")
+    last_error = models.TextField(blank=True, verbose_name="Last error")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created at")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated at")
+    
+    class Meta:
+        ordering = ['available_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='extraction_job_queue_idx'),
+        ]
+    
+    def __str__(self):
+        if self.kind == self.PREVIEW:
+            return f"Previews of document {self.document_id} ({self.status})"
+        return f"Extraction of document {self.document_id} ({self.status})"
+
+class UploadSession(models.Model):
+    """
+    Resumable chunked upload.
+    Chunks are written at their offset into a temporary file on disk; finalizing
+    the session turns the file into a Document.
+    """
+    ACTIVE = 'active'
+    COMPLETE = 'complete'
+    
+    STATUS_CHOICES = [
+        (ACTIVE, 'Active'),
+        (COMPLETE, 'Complete'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions', verbose_name="Upload owner")
+    title = models.CharField(max_length=255, verbose_name="Document title")
+    filename = models.CharField(max_length=255, verbose_name="Original file name")
+    size = models.PositiveBigIntegerField(verbose_name="File size (bytes)")
+    offset = models.PositiveBigIntegerField(default=0, verbose_name="Bytes received")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE, verbose_name="Upload status")
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Created document")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created at")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated at")
+    
+    def __str__(self):
+        return f"Upload of {self.filename} ({self.offset}/{self.size})"
     
-    def delete(self, *args, **kwargs):
-        # Delete the file when deleting the document
-        if self.file:
-            if os.path.isfile(self.file.path):
-                os.remove(self.file.path)
-        super().delete(*args, **kwargs)
+    @property
+    def temp_path(self):
+        return os.path.join(settings.UPLOAD_SESSION_DIR, f'{self.pk}.part')
@@ -0,0 +1,429 @@
+"""
+Minimal readers for legacy Microsoft Office binary formats.
+
+``OleFile`` reads streams from an OLE2 Compound File (the container of .doc,
+.xls and .ppt), the ``*_text`` functions extract plain text from the Word 97
+piece table, BIFF8 workbooks and PowerPoint 97 text atoms. Only what is needed
+for search indexing is implemented: formatting, embedded objects and encrypted
+files are ignored.
+"""
+import logging
+import re
+import struct
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+FREESECT = 0xFFFFFFFF
+ENDOFCHAIN = 0xFFFFFFFE
+MAXREGSECT = 0xFFFFFFFA
+
+STREAM_TYPE = 2
+ROOT_TYPE = 5
+
+
+class OleError(Exception):
+    """
+    Raised when a file is not a valid compound file or uses unsupported features
+    """
+
+
+class OleFile:
+    """
+    Read-only access to the streams of an OLE2 Compound File
+    """
+    def __init__(self, file):
+        self.file = file
+        header = self._read_at(0, 512)
+        if len(header) < 512 or header[:8] != OLE_SIGNATURE:
+            raise OleError("Not an OLE2 compound file")
+
+        self.sector_size = 1 << struct.unpack_from('<H', header, 0x1E)[0]
+        self.mini_sector_size = 1 << struct.unpack_from('<H', header, 0x20)[0]
+        fat_sectors = struct.unpack_from('<I', header, 0x2C)[0]
+        first_dir_sector = struct.unpack_from('<I', header, 0x30)[0]
+        self.mini_cutoff = struct.unpack_from('<I', header, 0x38)[0]
+        first_minifat_sector = struct.unpack_from('<I', header, 0x3C)[0]
+        first_difat_sector = struct.unpack_from('<I', header, 0x44)[0]
+
+        file.seek(0, 2)
+        self.sector_count = max(0, file.tell() // self.sector_size - 1)
+
+        # DIFAT: первые 109 записей в заголовке, остальные - в цепочке секторов
+        difat = list(struct.unpack_from('<109I', header, 0x4C))
+        sector = first_difat_sector
+        per_sector = self.sector_size // 4 - 1
+        seen = 0
+        while sector <= MAXREGSECT and seen < self.sector_count:
+            entries = struct.unpack(f'<{per_sector + 1}I', self._read_sector(sector))
+            difat.extend(entries[:per_sector])
+            sector = entries[per_sector]
+            seen += 1
+        fat_sector_ids = [sector for sector in difat if sector <= MAXREGSECT][:fat_sectors]
+
+        fat = bytearray()
+        for sector in fat_sector_ids:
+            fat += self._read_sector(sector)
+        self.fat = struct.unpack(f'<{len(fat) // 4}I', bytes(fat))
+
+        self.entries = {}
+        directory = self._read_chain(first_dir_sector, self.fat, self._read_sector)
+        root = None
+        for offset in range(0, len(directory) - 127, 128):
+            name_length = struct.unpack_from('<H', directory, offset + 0x40)[0]
+            entry_type = directory[offset + 0x42]
+            start = struct.unpack_from('<I', directory, offset + 0x74)[0]
+            size = struct.unpack_from('<I', directory, offset + 0x78)[0]
+            name = directory[offset:offset + max(0, name_length - 2)].decode('utf-16-le', 'replace')
+            if entry_type == ROOT_TYPE:
+                root = (start, size)
+            elif entry_type == STREAM_TYPE:
+                # Иерархия хранилищ не нужна: потоки документа лежат в корне
+                self.entries.setdefault(name, (start, size))
+
+        self.minifat = ()
+        self.mini_stream = b''
+        if root is not None and first_minifat_sector <= MAXREGSECT:
+            minifat = self._read_chain(first_minifat_sector, self.fat, self._read_sector)
+            self.minifat = struct.unpack(f'<{len(minifat) // 4}I', minifat)
+            self.mini_stream = self._read_chain(root[0], self.fat, self._read_sector)[:root[1]]
+
+    def _read_at(self, offset, size):
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def _read_sector(self, sector):
+        return self._read_at((sector + 1) * self.sector_size, self.sector_size)
+
+    def _read_mini_sector(self, sector):
+        offset = sector * self.mini_sector_size
+        return self.mini_stream[offset:offset + self.mini_sector_size]
+
+    def _read_chain(self, start, table, read_sector):
+        chunks = []
+        sector = start
+        # Защита от зацикленных цепочек в поврежденных файлах
+        for _ in range(len(table) + 1):
+            if sector > MAXREGSECT or sector >= len(table):
+                break
+            chunks.append(read_sector(sector))
+            sector = table[sector]
+        return b''.join(chunks)
+
+    def exists(self, name):
+        return name in self.entries
+
+    def read_stream(self, name):
+        """
+        Contents of a stream by name. Raises KeyError if there is no such stream
+        """
+        start, size = self.entries[name]
+        if size < self.mini_cutoff:
+            data = self._read_chain(start, self.minifat, self._read_mini_sector)
+        else:
+            data = self._read_chain(start, self.fat, self._read_sector)
+        return data[:size]
+
+
+def detect_ole_format(file):
+    """
+    Office format of a compound file by its streams: 'doc', 'xls', 'ppt' or None
+    """
+    try:
+        ole = OleFile(file)
+    except (OleError, struct.error):
+        return None
+    if ole.exists('WordDocument'):
+        return 'doc'
+    if ole.exists('Workbook') or ole.exists('Book'):
+        return 'xls'
+    if ole.exists('PowerPoint Document'):
+        return 'ppt'
+    return None
+
+
+# Управляющие символы Word: коды полей, метки ячеек, разрывы
+FIELD_INSTRUCTION_RE = re.compile('\x13[^\x13\x14\x15]*\x14')
+FIELD_WITHOUT_RESULT_RE = re.compile('\x13[^\x13\x14\x15]*\x15')
+CONTROL_CHARS_RE = re.compile('[\x00-\x08\x0e-\x1f]')
+
+
+def doc_text(file):
+    """
+    Text of a Word 97-2003 document, assembled from the pieces of its piece table
+    """
+    ole = OleFile(file)
+    word = ole.read_stream('WordDocument')
+    if len(word) < 0x1A6 or struct.unpack_from('<H', word, 0)[0] != 0xA5EC:
+        raise OleError("Invalid WordDocument stream")
+
+    flags = struct.unpack_from('<H', word, 0x0A)[0]
+    if flags & 0x0100:
+        raise OleError("Encrypted documents are not supported")
+    table = ole.read_stream('1Table' if flags & 0x0200 else '0Table')
+
+    # Смещение fcClx вычисляется по размерам массивов FIB, а не берется константой
+    csw = struct.unpack_from('<H', word, 32)[0]
+    cslw_offset = 34 + csw * 2
+    cslw = struct.unpack_from('<H', word, cslw_offset)[0]
+    fclcb_offset = cslw_offset + 2 + cslw * 4 + 2
+    fc_clx, lcb_clx = struct.unpack_from('<II', word, fclcb_offset + 33 * 8)
+    clx = table[fc_clx:fc_clx + lcb_clx]
+
+    pos = 0
+    while pos < len(clx) and clx[pos] == 0x01:
+        # Prc: свойства, к тексту не относятся
+        pos += 3 + struct.unpack_from('<h', clx, pos + 1)[0]
+    if pos >= len(clx) or clx[pos] != 0x02:
+        raise OleError("Piece table not found")
+    lcb = struct.unpack_from('<I', clx, pos + 1)[0]
+    plc = clx[pos + 5:pos + 5 + lcb]
+    count = (len(plc) - 4) // 12
+    cps = struct.unpack_from(f'<{count + 1}I', plc, 0)
+
+    pieces = []
+    for i in range(count):
+        fc = struct.unpack_from('<I', plc, (count + 1) * 4 + i * 8 + 2)[0]
+        length = cps[i + 1] - cps[i]
+        if fc & 0x40000000:
+            offset = (fc & ~0x40000000) // 2
+            pieces.append(word[offset:offset + length].decode('cp1252', 'replace'))
+        else:
+            pieces.append(word[fc:fc + length * 2].decode('utf-16-le', 'replace'))
+    return _clean_word_text(''.join(pieces))
+
+
+def _clean_word_text(text):
+    text = FIELD_INSTRUCTION_RE.sub('', text)
+    text = FIELD_WITHOUT_RESULT_RE.sub('', text)
+    text = text.replace('\x15', '').replace('\x07', '\t')
+    text = text.replace('\r', '\n').replace('\x0b', '\n').replace('\x0c', '\n')
+    return CONTROL_CHARS_RE.sub('', text)
+
+
+# Записи BIFF8
+BIFF_BOF = 0x0809
+BIFF_EOF = 0x000A
+BIFF_FILEPASS = 0x002F
+BIFF_BOUNDSHEET = 0x0085
+BIFF_SST = 0x00FC
+BIFF_CONTINUE = 0x003C
+BIFF_LABELSST = 0x00FD
+BIFF_LABEL = 0x0204
+BIFF_NUMBER = 0x0203
+BIFF_RK = 0x027E
+BIFF_MULRK = 0x00BD
+BIFF_FORMULA = 0x0006
+BIFF_STRING = 0x0207
+
+
+def _biff_records(data):
+    pos = 0
+    while pos + 4 <= len(data):
+        record_type, length = struct.unpack_from('<HH', data, pos)
+        yield record_type, data[pos + 4:pos + 4 + length]
+        pos += 4 + length
+
+
+def _read_unicode_string(data, pos, length_size=2):
+    """
+    XLUnicodeString at pos. Returns (text, end position)
+    """
+    if length_size == 2:
+        cch = struct.unpack_from('<H', data, pos)[0]
+    else:
+        cch = data[pos]
+    flags = data[pos + length_size]
+    pos += length_size + 1
+    if flags & 0x01:
+        return data[pos:pos + cch * 2].decode('utf-16-le', 'replace'), pos + cch * 2
+    return data[pos:pos + cch].decode('latin-1'), pos + cch
+
+
+def _read_sst(fragments):
+    """
+    Shared string table spread over an SST record and its CONTINUE records
+    """
+    strings = []
+    fragment_index = 0
+    data = fragments[0]
+    if len(data) < 8:
+        return strings
+    unique = struct.unpack_from('<I', data, 4)[0]
+    pos = 8
+
+    def next_fragment():
+        nonlocal fragment_index, data, pos
+        fragment_index += 1
+        if fragment_index >= len(fragments):
+            return False
+        data = fragments[fragment_index]
+        pos = 0
+        return True
+
+    for _ in range(unique):
+        if pos + 3 > len(data) and not next_fragment():
+            break
+        cch = struct.unpack_from('<H', data, pos)[0]
+        flags = data[pos + 2]
+        pos += 3
+        runs = ext = 0
+        if flags & 0x08:
+            runs = struct.unpack_from('<H', data, pos)[0]
+            pos += 2
+        if flags & 0x04:
+            ext = struct.unpack_from('<I', data, pos)[0]
+            pos += 4
+
+        wide = flags & 0x01
+        chars = []
+        remaining = cch
+        while remaining > 0:
+            if pos >= len(data):
+                if not next_fragment():
+                    break
+                # Продолжение строки начинается с собственного байта флагов
+                wide = data[0] & 0x01
+                pos = 1
+            char_size = 2 if wide else 1
+            count = min(remaining, (len(data) - pos) // char_size)
+            if count == 0:
+                pos = len(data)
+                continue
+            raw = data[pos:pos + count * char_size]
+            chars.append(raw.decode('utf-16-le' if wide else 'latin-1', 'replace'))
+            pos += len(raw)
+            remaining -= count
+        strings.append(''.join(chars))
+
+        skip = runs * 4 + ext
+        while skip > 0:
+            if pos >= len(data) and not next_fragment():
+                break
+            step = min(skip, len(data) - pos)
+            pos += step
+            skip -= step
+    return strings
+
+
+def _decode_rk(rk):
+    if rk & 0x02:
+        value = struct.unpack('<i', struct.pack('<I', rk))[0] >> 2
+    else:
+        value = struct.unpack('<d', struct.pack('<Q', (rk & 0xFFFFFFFC) << 32))[0]
+    if rk & 0x01:
+        value /= 100
+    return value
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def iter_xls_sheets(file):
+    """
+    Yield (sheet name, cells) for each worksheet of a BIFF8 workbook, where cells
+    is a list of (row, column, text) in file order
+    """
+    ole = OleFile(file)
+    name = 'Workbook' if ole.exists('Workbook') else 'Book'
+    data = ole.read_stream(name)
+
+    records = list(_biff_records(data))
+    sheet_names = []
+    strings = []
+    for index, (record_type, body) in enumerate(records):
+        if record_type == BIFF_FILEPASS:
+            raise OleError("Encrypted workbooks are not supported")
+        if record_type == BIFF_BOUNDSHEET and len(body) > 8:
+            sheet_names.append(_read_unicode_string(body, 6, length_size=1)[0])
+        elif record_type == BIFF_SST:
+            fragments = [body]
+            for next_type, next_body in records[index + 1:]:
+                if next_type != BIFF_CONTINUE:
+                    break
+                fragments.append(next_body)
+            strings = _read_sst(fragments)
+        elif record_type == BIFF_EOF:
+            # Конец глобальной части книги
+            break
+
+    sheet_index = -1
+    cells = None
+    pending_formula = None
+    for record_type, body in records:
+        if record_type == BIFF_BOF:
+            if len(body) >= 4 and struct.unpack_from('<H', body, 2)[0] == 0x0010:
+                sheet_index += 1
+                cells = []
+            continue
+        if cells is None:
+            continue
+        if record_type == BIFF_EOF:
+            name = sheet_names[sheet_index] if sheet_index < len(sheet_names) else str(sheet_index + 1)
+            yield name, cells
+            cells = None
+            continue
+
+        if record_type == BIFF_LABELSST and len(body) >= 10:
+            row, col, _, isst = struct.unpack_from('<HHHI', body, 0)
+            if isst < len(strings):
+                cells.append((row, col, strings[isst]))
+        elif record_type == BIFF_LABEL and len(body) >= 9:
+            row, col = struct.unpack_from('<HH', body, 0)
+            cells.append((row, col, _read_unicode_string(body, 6)[0]))
+        elif record_type == BIFF_NUMBER and len(body) >= 14:
+            row, col = struct.unpack_from('<HH', body, 0)
+            cells.append((row, col, _format_number(struct.unpack_from('<d', body, 6)[0])))
+        elif record_type == BIFF_RK and len(body) >= 10:
+            row, col, _, rk = struct.unpack_from('<HHHI', body, 0)
+            cells.append((row, col, _format_number(_decode_rk(rk))))
+        elif record_type == BIFF_MULRK and len(body) >= 6:
+            row, first_col = struct.unpack_from('<HH', body, 0)
+            for i in range((len(body) - 6) // 6):
+                rk = struct.unpack_from('<I', body, 4 + i * 6 + 2)[0]
+                cells.append((row, first_col + i, _format_number(_decode_rk(rk))))
+        elif record_type == BIFF_FORMULA and len(body) >= 14:
+            row, col = struct.unpack_from('<HH', body, 0)
+            if body[12:14] == b'\xff\xff':
+                # Строковый результат формулы хранится в следующей записи STRING
+                if body[6] == 0x00:
+                    pending_formula = (row, col)
+            else:
+                cells.append((row, col, _format_number(struct.unpack_from('<d', body, 6)[0])))
+        elif record_type == BIFF_STRING and pending_formula is not None and len(body) >= 3:
+            cells.append(pending_formula + (_read_unicode_string(body, 0)[0],))
+            pending_formula = None
+
+
+# Типы записей PowerPoint 97
+PPT_TEXT_CHARS_ATOM = 0x0FA0
+PPT_TEXT_BYTES_ATOM = 0x0FA8
+
+
+def ppt_text(file):
+    """
+    Text of a PowerPoint 97-2003 presentation from its text atoms
+    """
+    ole = OleFile(file)
+    data = ole.read_stream('PowerPoint Document')
+
+    texts = []
+    pos = 0
+    while pos + 8 <= len(data):
+        version_instance, record_type, length = struct.unpack_from('<HHI', data, pos)
+        if version_instance & 0x000F == 0x000F:
+            # Контейнер: просматриваем вложенные записи
+            pos += 8
+            continue
+        body = data[pos + 8:pos + 8 + length]
+        if record_type == PPT_TEXT_CHARS_ATOM:
+            texts.append(body.decode('utf-16-le', 'replace'))
+        elif record_type == PPT_TEXT_BYTES_ATOM:
+            texts.append(body.decode('latin-1'))
+        pos += 8 + length
+    return '\n'.join(text.replace('\r', '\n').replace('\x0b', '\n') for text in texts)
@@ -0,0 +1,158 @@
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from PIL import Image, ImageOps, features
+
+from . import utils
+from .extractors import run_in_sandbox
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Форматы документов, для которых строится превью
+PREVIEW_FORMATS = {'pdf', 'jpg', 'jpeg', 'png', 'gif', 'heic'}
+
+CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+
+def preview_format():
+    """
+    Image format of previews: WebP when Pillow is built with it, JPEG otherwise
+    """
+    if settings.PREVIEW_FORMAT == 'webp' and features.check('webp'):
+        return 'webp'
+    return 'jpeg'
+
+
+def supports_preview(document):
+    if document.file_format == 'heic' and not utils.HEIF_SUPPORTED:
+        return False
+    return document.file_format in PREVIEW_FORMATS
+
+
+def preview_path(sha256, size_name):
+    """
+    Location of a preview file: <MEDIA_ROOT>/previews/ab/cd/abcd...-thumb.webp.
+    Previews are keyed by file content, so documents with the same file share them
+    """
+    file_name = f'{sha256}-{size_name}.{preview_format()}'
+    return os.path.join(settings.MEDIA_ROOT, settings.PREVIEW_DIR, sha256[:2], sha256[2:4], file_name)
+
+
+def _document_key(document):
+    if document.blob_id:
+        return document.blob.sha256
+    # Документы, загруженные до хранения по хешу
+    return f'doc{document.pk:08d}'
+
+
+def _open_source_image(file_path, file_format, max_side):
+    if file_format == 'pdf':
+        images = utils.rasterize_pdf_page(file_path, 0, settings.PDF_OCR_PAGE_TIMEOUT, dpi=settings.PREVIEW_PDF_DPI)
+        if not images:
+            return None
+        # Без pdftoppm берем самое большое изображение на странице (скан страницы)
+        return max(images, key=lambda image: image.width * image.height)
+
+    image = Image.open(file_path)
+    # JPEG декодируется сразу в уменьшенном масштабе - в разы быстрее и экономнее по памяти
+    image.draft('RGB', (max_side, max_side))
+    return image
+
+
+def _save_preview(image, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image_format = preview_format()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            image.save(tmp_file, format=image_format.upper(), quality=settings.PREVIEW_QUALITY)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def render_previews(file_path, file_format, targets):
+    """
+    Render a file into previews: targets is a list of (longest side, path) from
+    the largest size down. The source image is decoded once and scaled down
+    step by step. Returns False if there is nothing to render on the first page.
+    Runs in the sandbox process, so it takes plain values only
+    """
+    image = _open_source_image(file_path, file_format, targets[0][0])
+    if image is None:
+        return False
+
+    with image:
+        # Анимированный GIF - берем первый кадр
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA'))
+            image = background
+
+        for side, path in targets:
+            image.thumbnail((side, side), Image.Resampling.LANCZOS)
+            _save_preview(image, path)
+    return True
+
+
+def generate_previews(document):
+    """
+    Render previews of every size in PREVIEW_SIZES that does not exist yet in a
+    sandbox process limited by PREVIEW_TIMEOUT and PREVIEW_MEMORY_LIMIT (a
+    malformed image must not take down the worker).
+    Returns a dict size name -> path (empty if the format has no preview)
+    """
+    if not supports_preview(document):
+        return {}
+
+    key = _document_key(document)
+    sizes = sorted(settings.PREVIEW_SIZES.items(), key=lambda item: item[1], reverse=True)
+    paths = {name: preview_path(key, name) for name, _ in sizes}
+    missing = [(side, paths[name]) for name, side in sizes if not os.path.exists(paths[name])]
+    if not missing:
+        return paths
+
+    rendered = run_in_sandbox(
+        render_previews, (document.file.path, document.file_format, missing),
+        settings.PREVIEW_TIMEOUT, settings.PREVIEW_MEMORY_LIMIT,
+    )
+    if not rendered:
+        logger.info(f"No preview for document {document.pk}: nothing to render on the first page")
+        return {}
+
+    logger.info(f"Generated {len(missing)} previews for document {document.pk}")
+    return paths
+
+
+def get_preview(document, size_name):
+    """
+    Path of an existing document preview or None. Previews are never rendered
+    in the request: a missing one is queued with tasks.enqueue_preview
+    """
+    if not settings.PREVIEW_ENABLED or not supports_preview(document):
+        return None
+
+    path = preview_path(_document_key(document), size_name)
+    if os.path.exists(path):
+        return path
+    return None
+
+
+def remove_previews(sha256):
+    """
+    Delete the previews of a stored file (when its last document is deleted)
+    """
+    for size_name in settings.PREVIEW_SIZES:
+        path = preview_path(sha256, size_name)
+        if os.path.exists(path):
+            os.remove(path)
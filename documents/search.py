@@ -0,0 +1,596 @@
+import logging
+import math
+import re
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'documents_document_fts'
+# Индекс текста страниц (PDF, листы таблиц), поддерживается триггерами на documents_documentpage
+PAGE_FTS_TABLE = 'documents_page_fts'
+# Словарь слов индекса и триграммы этих слов для нечеткого поиска в SQLite
+FUZZY_WORD_TABLE = 'documents_fuzzy_word'
+FUZZY_TRIGRAM_TABLE = 'documents_fuzzy_trigram'
+# Слова короче и длиннее этих границ, а также числа в словарь не попадают
+FUZZY_MIN_WORD = 3
+FUZZY_MAX_WORD = 40
+
+# Weight of a title match relative to a body match
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+QUERY_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+# Окончания русских слов для упрощенного стемминга запроса (от длинных к коротким).
+# FTS5 не умеет склонять русские слова, поэтому основа слова ищется как префикс.
+RUSSIAN_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ией', 'иях', 'ием', 'ого', 'его', 'ому', 'ему',
+    'ыми', 'ими', 'ешь', 'ете', 'ите', 'ать', 'ять', 'ить', 'еть', 'ова', 'ева',
+    'ов', 'ев', 'ей', 'ой', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+    'ую', 'юю', 'ою', 'ею', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'их', 'ых',
+    'ию', 'ью', 'ия', 'ья', 'ии', 'ть', 'ет', 'ют', 'ат', 'ят', 'ла', 'ли', 'ло',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+MIN_RUSSIAN_STEM = 3
+
+
+class SearchTerm:
+    """
+    One element of a parsed search query: a word, a prefix or a phrase.
+    In fuzzy mode ``variants`` holds indexed words similar to the word
+    """
+    def __init__(self, words, prefix=False):
+        self.words = words
+        self.prefix = prefix
+        self.variants = []
+
+    @property
+    def is_phrase(self):
+        return len(self.words) > 1
+
+    def __repr__(self):
+        return f"SearchTerm({self.words!r}, prefix={self.prefix})"
+
+
+def normalize_text(text):
+    """
+    Normalize text before indexing or querying (ё and е are treated as the same letter)
+    """
+    if not text:
+        return ''
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def tokenize(text):
+    """
+    Split text into lowercase words (Unicode-aware, works for Russian and English)
+    """
+    return WORD_RE.findall(normalize_text(text).lower())
+
+
+def parse_query(query):
+    """
+    Parse a user query into search terms.
+    Supports "quoted phrases" and prefix queries with a trailing asterisk (докум*)
+    """
+    terms = []
+    for match in QUERY_TOKEN_RE.finditer(query or ''):
+        phrase, word = match.groups()
+        if phrase is not None:
+            words = tokenize(phrase)
+            if words:
+                terms.append(SearchTerm(words))
+            continue
+
+        prefix = word.endswith('*')
+        for token in tokenize(word):
+            terms.append(SearchTerm([token]))
+        if prefix and terms and not terms[-1].is_phrase:
+            terms[-1].prefix = True
+    return terms
+
+
+def stem_russian(word):
+    """
+    Strip a common Russian inflectional ending so that the stem can be searched as a prefix.
+    Returns None for non-Russian words and words too short to be stemmed safely
+    """
+    if not CYRILLIC_RE.search(word) or len(word) <= MIN_RUSSIAN_STEM:
+        return None
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_RUSSIAN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def build_fts5_query(terms):
+    """
+    Build an FTS5 MATCH expression from parsed terms (all terms must match)
+    """
+    parts = []
+    for term in terms:
+        if term.is_phrase:
+            parts.append('"' + ' '.join(term.words) + '"')
+            continue
+
+        word = term.words[0]
+        if term.prefix:
+            part = f'"{word}"*'
+        else:
+            stem = stem_russian(word)
+            part = f'"{stem}"*' if stem else f'"{word}"'
+        if term.variants:
+            part = '(' + ' OR '.join([part] + [f'"{variant}"' for variant in term.variants]) + ')'
+        parts.append(part)
+    return ' AND '.join(parts)
+
+
+def build_tsquery(terms):
+    """
+    Build a PostgreSQL to_tsquery expression from parsed terms
+    """
+    parts = []
+    for term in terms:
+        if term.is_phrase:
+            parts.append('(' + ' <-> '.join(term.words) + ')')
+        elif term.prefix:
+            parts.append(f'{term.words[0]}:*')
+        else:
+            parts.append(term.words[0])
+    return ' & '.join(parts)
+
+
+def fulltext_backend():
+    """
+    Name of the full-text backend for the current database, or None if unsupported
+    """
+    if connection.vendor in ('sqlite', 'postgresql'):
+        return connection.vendor
+    return None
+
+
+def word_trigrams(word):
+    """
+    Trigrams of a word, padded like pg_trgm does: '  w', ' wo', 'wor', 'ord', 'rd '
+    """
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def fuzzy_words(text):
+    """
+    Words of a text that are added to the fuzzy search vocabulary
+    """
+    return {
+        word for word in tokenize(text)
+        if FUZZY_MIN_WORD <= len(word) <= FUZZY_MAX_WORD and not word.isdigit()
+    }
+
+
+def expand_fuzzy_terms(terms):
+    """
+    Fill ``variants`` of single-word terms with indexed words whose trigram
+    similarity to the word is at least SEARCH_FUZZY_THRESHOLD (SQLite).
+    Candidates are found through the trigram posting table, so only words that
+    share trigrams with the query word are looked at
+    """
+    if fulltext_backend() != 'sqlite':
+        return terms
+
+    threshold = settings.SEARCH_FUZZY_THRESHOLD
+    with connection.cursor() as cursor:
+        for term in terms:
+            if term.is_phrase or term.prefix or len(term.words[0]) < FUZZY_MIN_WORD:
+                continue
+            word = term.words[0]
+            trigrams = sorted(word_trigrams(word))
+            count = len(trigrams)
+            placeholders = ', '.join(['%s'] * count)
+            # Сходство |A ∩ B| / |A ∪ B| не может достичь порога, если число триграмм
+            # слова вне диапазона [count * threshold, count / threshold]
+            cursor.execute(
+                "SELECT w.word, COUNT(*) * 1.0 / (%s + w.trigram_count - COUNT(*)) AS similarity "
+                f"FROM {FUZZY_TRIGRAM_TABLE} t JOIN {FUZZY_WORD_TABLE} w ON w.id = t.word_id "
+                f"WHERE t.trigram IN ({placeholders}) AND w.trigram_count BETWEEN %s AND %s "
+                "GROUP BY w.id HAVING similarity >= %s ORDER BY similarity DESC, w.word LIMIT %s",
+                [count] + trigrams + [
+                    math.floor(count * threshold),
+                    math.ceil(count / threshold),
+                    threshold,
+                    settings.SEARCH_FUZZY_MAX_EXPANSIONS,
+                ],
+            )
+            term.variants = [variant for variant, _ in cursor.fetchall() if variant != word]
+    return terms
+
+
+def update_fuzzy_vocabulary(words):
+    """
+    Add words that are not in the fuzzy search vocabulary yet, with their trigrams (SQLite)
+    """
+    if fulltext_backend() != 'sqlite':
+        return
+    new_words = set(words)
+    if not new_words:
+        return
+
+    with connection.cursor() as cursor:
+        words = sorted(new_words)
+        for start in range(0, len(words), 500):
+            chunk = words[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'SELECT word FROM {FUZZY_WORD_TABLE} WHERE word IN ({placeholders})', chunk)
+            new_words.difference_update(row[0] for row in cursor.fetchall())
+        if not new_words:
+            return
+
+        # INSERT OR IGNORE: слово мог одновременно добавить другой процесс
+        cursor.executemany(
+            f'INSERT OR IGNORE INTO {FUZZY_WORD_TABLE} (word, trigram_count) VALUES (%s, %s)',
+            [[word, len(word_trigrams(word))] for word in new_words],
+        )
+        words = sorted(new_words)
+        postings = []
+        for start in range(0, len(words), 500):
+            chunk = words[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'SELECT id, word FROM {FUZZY_WORD_TABLE} WHERE word IN ({placeholders})', chunk)
+            for word_id, word in cursor.fetchall():
+                postings.extend([trigram, word_id] for trigram in word_trigrams(word))
+        cursor.executemany(
+            f'INSERT OR IGNORE INTO {FUZZY_TRIGRAM_TABLE} (trigram, word_id) VALUES (%s, %s)',
+            postings,
+        )
+
+
+def clear_fuzzy_vocabulary():
+    """
+    Empty the fuzzy search vocabulary (before a full reindex drops words of deleted documents)
+    """
+    if fulltext_backend() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FUZZY_TRIGRAM_TABLE}')
+        cursor.execute(f'DELETE FROM {FUZZY_WORD_TABLE}')
+
+
+@contextmanager
+def search_transaction(fuzzy=False):
+    """
+    Context for running a search query and reading its results.
+    Fuzzy search in PostgreSQL needs the similarity threshold of pg_trgm: it is set
+    for the current transaction only, so it never leaks to other requests served by
+    the same (pooled) connection
+    """
+    if not fuzzy or fulltext_backend() != 'postgresql':
+        yield
+        return
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('pg_trgm.strict_word_similarity_threshold', %s, true)",
+                [str(settings.SEARCH_FUZZY_THRESHOLD)],
+            )
+        yield
+
+
+def _fuzzy_postgresql(queryset, terms):
+    # strict_word_similarity сравнивает слово запроса с целыми словами названия и текста,
+    # условие %>> использует GIN-индексы pg_trgm по названию и по словам текста (fuzzy_words).
+    # Порог сходства задает search_transaction
+    phrase = ' '.join(' '.join(term.words) for term in terms)
+    for term in terms:
+        words = ' '.join(term.words)
+        queryset = queryset.extra(
+            where=[
+                "(translate(documents_document.title, 'ёЁ', 'еЕ') %%>> %s "
+                "OR documents_document.fuzzy_words %%>> %s)"
+            ],
+            params=[words, words],
+        )
+    return queryset.annotate(
+        search_rank=RawSQL(
+            "GREATEST(strict_word_similarity(%s, translate(documents_document.title, 'ёЁ', 'еЕ')), "
+            "strict_word_similarity(%s, documents_document.fuzzy_words))",
+            [phrase, phrase],
+            output_field=FloatField(),
+        ),
+    )
+
+
+def search_documents(queryset, query, fuzzy=False):
+    """
+    Filter a Document queryset by a full-text query.
+    The result is annotated with search_rank (higher is better) and ordered by it.
+    With ``fuzzy`` words also match similar words (misrecognized by OCR);
+    such a queryset must be evaluated inside search_transaction(fuzzy=True)
+    """
+    terms = parse_query(query)
+    if not terms:
+        return queryset.none()
+
+    backend = fulltext_backend()
+    if fuzzy and backend == 'postgresql':
+        return _fuzzy_postgresql(queryset, terms).order_by('-search_rank', '-id')
+    if fuzzy:
+        expand_fuzzy_terms(terms)
+
+    if backend == 'sqlite':
+        expression = build_fts5_query(terms)
+        queryset = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = documents_document.id', f'{FTS_TABLE} MATCH %s'],
+            params=[expression],
+        ).annotate(
+            # bm25() возвращает отрицательные значения: чем меньше, тем релевантнее
+            search_rank=RawSQL(f'-bm25({FTS_TABLE}, {TITLE_WEIGHT}, {BODY_WEIGHT})', [], output_field=FloatField()),
+        )
+    elif backend == 'postgresql':
+        expression = build_tsquery(terms)
+        queryset = queryset.extra(
+            where=["documents_document.search_vector @@ to_tsquery('russian', %s)"],
+            params=[expression],
+        ).annotate(
+            search_rank=RawSQL(
+                "ts_rank_cd(documents_document.search_vector, to_tsquery('russian', %s))",
+                [expression],
+                output_field=FloatField(),
+            ),
+        )
+    else:
+        # Полнотекстовый индекс недоступен - простой поиск по подстроке
+        # (сжатые тексты в таком режиме ищутся только по названию)
+        condition = Q()
+        for term in terms:
+            phrase = ' '.join(term.words)
+            condition &= Q(title__icontains=phrase) | Q(content__text__icontains=phrase)
+        queryset = queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    return queryset.order_by('-search_rank', '-id')
+
+
+def update_index(document):
+    """
+    Add or refresh a document in the full-text index
+    """
+    update_index_bulk([document])
+
+
+def update_index_bulk(documents):
+    """
+    Add or refresh several documents in the full-text index with batched statements
+    """
+    backend = fulltext_backend()
+    rows = [
+        (document.pk, normalize_text(document.title), normalize_text(document.text_content))
+        for document in documents
+    ]
+    if not rows:
+        return
+
+    if backend == 'sqlite':
+        words = set()
+        for _, title, body in rows:
+            words |= fuzzy_words(title)
+            words |= fuzzy_words(body)
+        update_fuzzy_vocabulary(words)
+
+    with connection.cursor() as cursor:
+        if backend == 'sqlite':
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [[pk] for pk, _, _ in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, body) VALUES (%s, %s, %s)',
+                [[pk, title, body] for pk, title, body in rows],
+            )
+        elif backend == 'postgresql':
+            # fuzzy_words - слова текста для нечеткого поиска (индекс pg_trgm)
+            cursor.executemany(
+                "UPDATE documents_document SET search_vector = "
+                "setweight(to_tsvector('russian', %s), 'A') || setweight(to_tsvector('russian', %s), 'B'), "
+                "fuzzy_words = %s WHERE id = %s",
+                [[title, body, ' '.join(sorted(fuzzy_words(body))), pk] for pk, title, body in rows],
+            )
+
+
+def remove_from_index(document_pk):
+    """
+    Remove a deleted document from the full-text index
+    """
+    if fulltext_backend() == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [document_pk])
+    # В PostgreSQL вектор хранится в строке документа и удаляется вместе с ней
+
+
+def rebuild_page_index():
+    """
+    Re-create the page index from documents_documentpage (SQLite only: in
+    PostgreSQL the page vector is a generated column)
+    """
+    if fulltext_backend() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {PAGE_FTS_TABLE} ({PAGE_FTS_TABLE}) VALUES ('delete-all')")
+        cursor.execute(
+            f"INSERT INTO {PAGE_FTS_TABLE} (rowid, text) "
+            "SELECT id, REPLACE(REPLACE(text, 'ё', 'е'), 'Ё', 'Е') FROM documents_documentpage"
+        )
+
+
+# Маркеры начала и конца подсвеченного фрагмента (заменяются на <mark> после экранирования HTML)
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+SNIPPET_TOKENS = 24
+SNIPPET_CHARS = 200
+# Сколько совпавших страниц показывать для одного документа
+PAGE_HITS_PER_DOCUMENT = 5
+
+
+def _highlight_to_html(fragment):
+    fragment = escape(fragment)
+    return fragment.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+
+
+def _python_snippet(text, terms):
+    text = normalize_text(text)
+    lowered = text.lower()
+    words = [' '.join(term.words) for term in terms]
+
+    positions = [lowered.find(word) for word in words if word]
+    positions = [position for position in positions if position >= 0]
+    start = max(min(positions) - SNIPPET_CHARS // 2, 0) if positions else 0
+    fragment = text[start:start + SNIPPET_CHARS]
+
+    pattern = re.compile('|'.join(re.escape(word) for word in words if word), re.IGNORECASE)
+    fragment = pattern.sub(lambda m: HIGHLIGHT_START + m.group(0) + HIGHLIGHT_END, fragment)
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if start + SNIPPET_CHARS < len(text) else ''
+    return prefix + fragment + suffix
+
+
+def get_snippets(document_ids, query, fuzzy=False):
+    """
+    Build highlighted HTML snippets for the given search hits.
+    Only the requested documents are processed, so the cost is bounded by the page size
+    """
+    terms = parse_query(query)
+    if fuzzy:
+        expand_fuzzy_terms(terms)
+    document_ids = list(document_ids)
+    if not terms or not document_ids:
+        return {}
+
+    backend = fulltext_backend()
+    placeholders = ', '.join(['%s'] * len(document_ids))
+    if backend == 'sqlite':
+        sql = (
+            f"SELECT rowid, snippet({FTS_TABLE}, -1, %s, %s, '…', {SNIPPET_TOKENS}) "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders})"
+        )
+        params = [HIGHLIGHT_START, HIGHLIGHT_END, build_fts5_query(terms)] + document_ids
+    elif backend == 'postgresql':
+        # Сжатые тексты недоступны в SQL, для них фрагмент строится в Python
+        sql = (
+            "SELECT document_id, ts_headline('russian', translate(text, 'ёЁ', 'еЕ'), to_tsquery('russian', %s), "
+            "'StartSel=\"[[[\", StopSel=\"]]]\", MaxWords=35, MinWords=15, MaxFragments=2') "
+            f"FROM documents_documentcontent WHERE compressed_text IS NULL AND document_id IN ({placeholders})"
+        )
+        params = [build_tsquery(terms)] + document_ids
+    else:
+        return _python_snippets(document_ids, terms)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    snippets = {}
+    for pk, fragment in rows:
+        if backend == 'postgresql':
+            fragment = fragment.replace('[[[', HIGHLIGHT_START).replace(']]]', HIGHLIGHT_END)
+        snippets[pk] = _highlight_to_html(fragment or '')
+    if backend == 'postgresql':
+        snippets.update(_python_snippets([pk for pk in document_ids if pk not in snippets], terms))
+    return snippets
+
+
+def _python_snippets(document_ids, terms):
+    from .models import DocumentContent
+
+    if not document_ids:
+        return {}
+    contents = DocumentContent.objects.filter(document_id__in=document_ids)
+    return {
+        content.document_id: _highlight_to_html(_python_snippet(content.get_text(), terms))
+        for content in contents
+    }
+
+
+def get_page_hits(document_ids, query, fuzzy=False):
+    """
+    Pages of the given search hits that match the query, as
+    {document_id: [{'number', 'label', 'snippet'}, ...]} in page order.
+    At most PAGE_HITS_PER_DOCUMENT pages are returned for a document and
+    snippets are built only for them
+    """
+    terms = parse_query(query)
+    if fuzzy:
+        expand_fuzzy_terms(terms)
+    document_ids = list(document_ids)
+    if not terms or not document_ids:
+        return {}
+
+    backend = fulltext_backend()
+    placeholders = ', '.join(['%s'] * len(document_ids))
+    if backend == 'sqlite':
+        expression = build_fts5_query(terms)
+        sql = (
+            f"SELECT p.document_id, p.number, p.label, snippet({PAGE_FTS_TABLE}, 0, %s, %s, '…', {SNIPPET_TOKENS}) "
+            f"FROM {PAGE_FTS_TABLE} JOIN documents_documentpage p ON p.id = {PAGE_FTS_TABLE}.rowid "
+            f"WHERE {PAGE_FTS_TABLE} MATCH %s AND p.id IN ("
+            "SELECT id FROM ("
+            "SELECT hit.id, ROW_NUMBER() OVER (PARTITION BY hit.document_id ORDER BY hit.number) AS position "
+            f"FROM {PAGE_FTS_TABLE} JOIN documents_documentpage hit ON hit.id = {PAGE_FTS_TABLE}.rowid "
+            f"WHERE {PAGE_FTS_TABLE} MATCH %s AND hit.document_id IN ({placeholders})"
+            ") WHERE position <= %s"
+            ") ORDER BY p.document_id, p.number"
+        )
+        params = [HIGHLIGHT_START, HIGHLIGHT_END, expression, expression] + document_ids + [PAGE_HITS_PER_DOCUMENT]
+    elif backend == 'postgresql':
+        # ts_headline считается во внешнем запросе - только для отобранных страниц
+        sql = (
+            "SELECT document_id, number, label, ts_headline('russian', translate(text, 'ёЁ', 'еЕ'), "
+            "to_tsquery('russian', %s), 'StartSel=\"[[[\", StopSel=\"]]]\", MaxWords=35, MinWords=15') "
+            "FROM (SELECT document_id, number, label, text, "
+            "ROW_NUMBER() OVER (PARTITION BY document_id ORDER BY number) AS position "
+            "FROM documents_documentpage "
+            f"WHERE document_id IN ({placeholders}) AND search_vector @@ to_tsquery('russian', %s)) hits "
+            "WHERE position <= %s ORDER BY document_id, number"
+        )
+        expression = build_tsquery(terms)
+        params = [expression] + document_ids + [expression, PAGE_HITS_PER_DOCUMENT]
+    else:
+        return _python_page_hits(document_ids, terms)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    hits = {}
+    for pk, number, label, fragment in rows:
+        if backend == 'postgresql':
+            fragment = fragment.replace('[[[', HIGHLIGHT_START).replace(']]]', HIGHLIGHT_END)
+        hits.setdefault(pk, []).append({
+            'number': number,
+            'label': label,
+            'snippet': _highlight_to_html(fragment or ''),
+        })
+    return hits
+
+
+def _python_page_hits(document_ids, terms):
+    from .models import DocumentPage
+
+    condition = Q()
+    for term in terms:
+        condition &= Q(text__icontains=' '.join(term.words))
+    pages = DocumentPage.objects.filter(condition, document_id__in=document_ids).order_by('document_id', 'number')
+
+    hits = {}
+    for page in pages:
+        document_hits = hits.setdefault(page.document_id, [])
+        if len(document_hits) < PAGE_HITS_PER_DOCUMENT:
+            document_hits.append({
+                'number': page.number,
+                'label': page.label,
+                'snippet': _highlight_to_html(_python_snippet(page.text, terms)),
+            })
+    return hits
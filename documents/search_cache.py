@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .search import normalize_text
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'search'
+# Параметры запроса, от которых зависит ответ поиска (кроме самого запроса)
+KEY_PARAMS = ('cursor', 'page_size', 'highlight', 'pages', 'fuzzy', 'fields')
+STATS_KEYS = {'hits': 'search:stats:hits', 'misses': 'search:stats:misses'}
+
+
+def get_search_cache():
+    return caches[CACHE_ALIAS]
+
+
+def normalize_query(query):
+    """
+    Query text as it affects the results: case, ё/е and extra spaces do not matter
+    """
+    return ' '.join(normalize_text(query).lower().split())
+
+
+def _generation_key(user_id):
+    return f'search:generation:{user_id}'
+
+
+def get_generation(user_id):
+    """
+    Current generation of a user's cached results.
+    A missing counter (new user, evicted entry) starts from the current time,
+    so it never repeats a generation that cached results were stored under
+    """
+    cache = get_search_cache()
+    key = _generation_key(user_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def _bump(user_id):
+    cache = get_search_cache()
+    key = _generation_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_generation(user_id):
+    """
+    Invalidate all cached search results of a user
+    """
+    if not settings.SEARCH_CACHE_ENABLED or user_id is None:
+        return
+    _bump(user_id)
+    # Поиск, выполненный до фиксации транзакции, мог сохранить старые результаты
+    # под новым поколением - после фиксации поколение увеличивается еще раз
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(user_id))
+    logger.debug(f"Search cache of user {user_id} invalidated")
+
+
+def _param_value(params, name):
+    value = params.get(name, '')
+    if name == 'fields':
+        # Набор полей не зависит от порядка и повторов: ?fields=title,id == ?fields=id,title
+        value = ','.join(sorted({field.strip() for field in value.split(',') if field.strip()}))
+    return value
+
+
+def search_cache_key(user_id, query, params):
+    """
+    Cache key of a search response: user, generation, normalized query and page
+    """
+    parts = [normalize_query(query)] + [_param_value(params, name) for name in KEY_PARAMS]
+    digest = hashlib.sha256('\x00'.join(parts).encode('utf-8')).hexdigest()
+    return f'search:results:{user_id}:{get_generation(user_id)}:{digest}'
+
+
+def _count(name):
+    cache = get_search_cache()
+    key = STATS_KEYS[name]
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_cached_results(key):
+    """
+    Cached response data or None on a miss
+    """
+    data = get_search_cache().get(key)
+    _count('hits' if data is not None else 'misses')
+    return data
+
+
+def cache_results(key, data):
+    get_search_cache().set(key, data, settings.SEARCH_CACHE_TIMEOUT)
+
+
+def stats():
+    """
+    Hit/miss counters of the search cache (of this process for the local-memory backend)
+    """
+    cache = get_search_cache()
+    hits = cache.get(STATS_KEYS['hits'], 0)
+    misses = cache.get(STATS_KEYS['misses'], 0)
+    lookups = hits + misses
+    return {
+        'backend': settings.CACHES[CACHE_ALIAS]['BACKEND'].rsplit('.', 1)[-1],
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / lookups if lookups else 0.0,
+        'timeout': settings.SEARCH_CACHE_TIMEOUT,
+    }
+
+
+def reset_stats():
+    get_search_cache().delete_many(list(STATS_KEYS.values()))
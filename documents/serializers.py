@@ -1,23 +1,102 @@
 from rest_framework import serializers
-from .models import Document
+from .models import Blob, Document, UploadSession, blob_atomic
 import os
 import logging
-from .utils import extract_text_from_file
+from .tasks import enqueue_extraction, reuse_extraction
+from .previews import supports_preview
+from django.conf import settings
+from django.urls import reverse
 from django.contrib.auth.models import User
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
-class DocumentSerializer(serializers.ModelSerializer):
+# Максимальный размер загружаемого файла
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+
+ALLOWED_FORMATS = [
+    Document.PDF, Document.JPG, Document.JPEG, Document.PNG, Document.GIF, 
+    Document.HEIC, Document.SVG, Document.DOC, Document.DOCX, Document.PPT, 
+    Document.PPTX, Document.TXT, Document.XLS, Document.XLSX, Document.MD
+]
+
+def validate_upload(file_name, file_size, max_size=MAX_UPLOAD_SIZE):
+    """
+    Check the extension and size of an uploaded file, return the file format
+    """
+    ext = os.path.splitext(file_name)[1].lower().replace('.', '')
+    
+    # Check if the extension is in allowed formats
+    if ext not in ALLOWED_FORMATS:
+        error_msg = f"Неподдерживаемый формат файла. Разрешенные форматы: {', '.join(ALLOWED_FORMATS)}"
+        logger.error(error_msg)
+        raise serializers.ValidationError(error_msg)
+    
+    # Check file size (10MB by default, UPLOAD_SESSION_MAX_SIZE for resumable uploads)
+    if file_size > max_size:
+        error_msg = f"Размер файла превышает максимально допустимый ({max_size // (1024 * 1024)}MB)"
+        logger.error(error_msg)
+        raise serializers.ValidationError(error_msg)
+    
+    return ext
+
+def store_document(file, **fields):
+    """
+    Store a file by content hash and create a document for it.
+    Text is reused from a document with the same content or queued for extraction
+    """
+    with blob_atomic():
+        # Store the file by content hash (identical files are stored once)
+        blob = Blob.objects.acquire(file)
+        
+        document = Document.objects.create(
+            blob=blob,
+            file=blob.file.name,
+            original_filename=os.path.basename(file.name),
+            **fields
+        )
+        
+        # Text is extracted by the background worker, unless the same
+        # file has already been processed
+        if not reuse_extraction(document):
+            enqueue_extraction(document)
+    return document
+
+class DynamicFieldsMixin:
+    """
+    Allows restricting the serialized fields with a ``fields`` argument
+    (taken from the ``?fields=`` query parameter by the view)
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+class PreviewUrlMixin:
+    """
+    Adds ``preview_url``: URL of the document preview (without the size parameter)
+    or null if the format has no preview. The URL changes with the file content,
+    so browsers can cache previews indefinitely
+    """
+    def get_preview_url(self, obj):
+        if not settings.PREVIEW_ENABLED or not supports_preview(obj):
+            return None
+        return f"{reverse('document-preview', args=[obj.pk])}?v={obj.blob_id or 0}"
+
+class DocumentSerializer(DynamicFieldsMixin, PreviewUrlMixin, serializers.ModelSerializer):
     """
     Serializer for Document model
     """
     owner_username = serializers.ReadOnlyField(source='owner.username')
+    preview_url = serializers.SerializerMethodField()
     
     class Meta:
         model = Document
-        fields = ['id', 'title', 'file', 'file_format', 'upload_date', 'size', 'text_content', 'owner', 'owner_username']
-        read_only_fields = ['id', 'upload_date', 'size', 'text_content', 'owner_username']
+        fields = ['id', 'title', 'file', 'file_format', 'upload_date', 'size', 'text_content', 'text_truncated', 'extraction_status', 'owner', 'owner_username', 'preview_url']
+        read_only_fields = ['id', 'upload_date', 'size', 'text_content', 'text_truncated', 'extraction_status', 'owner_username']
 
     def validate_file(self, file):
         """
@@ -27,30 +106,8 @@ class DocumentSerializer(serializers.ModelSerializer):
         if not file:
             raise serializers.ValidationError("Файл не предоставлен")
             
-        # Get the file extension
-        file_name = file.name
-        logger.debug(f"Validating file: {file_name}, size: {file.size}")
-        
-        ext = os.path.splitext(file_name)[1].lower().replace('.', '')
-        
-        # Check if the extension is in allowed formats
-        allowed_formats = [
-            Document.PDF, Document.JPG, Document.JPEG, Document.PNG, Document.GIF, 
-            Document.HEIC, Document.SVG, Document.DOC, Document.DOCX, Document.PPT, 
-            Document.PPTX, Document.TXT, Document.XLS, Document.XLSX, Document.MD
-        ]
-        
-        if ext not in allowed_formats:
-            error_msg = f"Неподдерживаемый формат файла. Разрешенные форматы: {', '.join(allowed_formats)}"
-            logger.error(error_msg)
-            raise serializers.ValidationError(error_msg)
-        
-        # Check file size (max 10MB)
-        if file.size > 10 * 1024 * 1024:  # 10MB
-            error_msg = "Размер файла превышает максимально допустимый (10MB)"
-            logger.error(error_msg)
-            raise serializers.ValidationError(error_msg)
-            
+        logger.debug(f"Validating file: {file.name}, size: {file.size}")
+        validate_upload(file.name, file.size)
         return file
     
     def validate(self, attrs):
@@ -65,11 +122,11 @@ class DocumentSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         """
-        Create document instance and extract text from file
+        Create document instance and queue text extraction
         """
         try:
             # Set file_format based on file extension
-            file = validated_data['file']
+            file = validated_data.pop('file')
             ext = os.path.splitext(file.name)[1].lower().replace('.', '')
             validated_data['file_format'] = ext
             
@@ -78,16 +135,61 @@ class DocumentSerializer(serializers.ModelSerializer):
             if request and request.user.is_authenticated:
                 validated_data['owner'] = request.user
             
-            # Create the document instance
-            document = Document.objects.create(**validated_data)
-            
-            # Extract text from file
-            logger.info(f"Extracting text from file: {document.file.path}")
-            text_content = extract_text_from_file(document.file.path)
-            document.text_content = text_content
-            document.save(update_fields=['text_content'])
-            
-            return document
+            return store_document(file, **validated_data)
         except Exception as e:
             logger.error(f"Error creating document: {str(e)}")
-            raise serializers.ValidationError(f"Ошибка при создании документа: {str(e)}") 
\ No newline at end of file
+            raise serializers.ValidationError(f"Ошибка при создании документа: {str(e)}")
+
+class DocumentListSerializer(DynamicFieldsMixin, PreviewUrlMixin, serializers.ModelSerializer):
+    """
+    Lightweight serializer for document lists and search results.
+    Does not include text_content; search hits may carry a highlighted snippet
+    and the pages that matched
+    """
+    owner_username = serializers.ReadOnlyField(source='owner.username')
+    preview_url = serializers.SerializerMethodField()
+    snippet = serializers.SerializerMethodField()
+    pages = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Document
+        fields = ['id', 'title', 'file', 'file_format', 'upload_date', 'size', 'extraction_status', 'owner', 'owner_username', 'preview_url', 'snippet', 'pages']
+        read_only_fields = fields
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        
+        # Фрагменты текста есть только в результатах поиска с подсветкой
+        if 'snippets' not in self.context:
+            self.fields.pop('snippet', None)
+        if 'page_hits' not in self.context:
+            self.fields.pop('pages', None)
+    
+    def get_snippet(self, obj):
+        return self.context['snippets'].get(obj.pk, '')
+    
+    def get_pages(self, obj):
+        return self.context['page_hits'].get(obj.pk, [])
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for resumable upload sessions
+    """
+    chunk_size = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'title', 'filename', 'size', 'offset', 'status', 'document', 'chunk_size', 'created_at']
+        read_only_fields = ['id', 'offset', 'status', 'document', 'chunk_size', 'created_at']
+    
+    def get_chunk_size(self, obj):
+        return settings.UPLOAD_CHUNK_SIZE
+    
+    def validate(self, attrs):
+        if not attrs.get('title'):
+            raise serializers.ValidationError({"title": "Укажите название документа"})
+        try:
+            validate_upload(attrs['filename'], attrs['size'], max_size=settings.UPLOAD_SESSION_MAX_SIZE)
+        except serializers.ValidationError as e:
+            raise serializers.ValidationError({"file": e.detail})
+        return attrs
@@ -0,0 +1,86 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Blob, Document, DocumentContent
+from .search import remove_from_index, update_index
+from .search_cache import bump_generation
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+INDEXED_FIELDS = {'title'}
+
+
+@receiver(post_save, sender=Document)
+def index_document(sender, instance, update_fields=None, **kwargs):
+    """
+    Keep the full-text index in sync with the document title and extracted text
+    """
+    if update_fields is not None and not INDEXED_FIELDS.intersection(update_fields):
+        return
+    # При загрузке фикстур (loaddata) индекс перестраивается командой rebuild_search_index
+    if kwargs.get('raw'):
+        return
+    update_index(instance)
+
+
+@receiver(post_save, sender=DocumentContent)
+def index_document_content(sender, instance, **kwargs):
+    """
+    Reindex a document when its extracted text is saved
+    """
+    if kwargs.get('raw'):
+        return
+    update_index(instance.document)
+
+
+@receiver(post_delete, sender=Document)
+def unindex_document(sender, instance, **kwargs):
+    remove_from_index(instance.pk)
+
+
+@receiver(post_delete, sender=Document)
+def release_document_file(sender, instance, **kwargs):
+    """
+    Release the stored file of a deleted document. A signal, unlike Document.delete(),
+    also runs for queryset deletes and for documents deleted with their owner
+    """
+    if instance.blob_id:
+        # Файлы в хранилище по хешу общие: удаляется только последняя ссылка
+        Blob(pk=instance.blob_id).release()
+    elif instance.file:
+        # Документ, загруженный до хранения по хешу, владеет своим файлом
+        storage, name = instance.file.storage, instance.file.name
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def invalidate_search_cache(sender, instance, **kwargs):
+    """
+    Drop cached search results of the owner when a document changes
+    """
+    bump_generation(instance.owner_id)
+
+
+@receiver(post_save, sender=DocumentContent)
+def invalidate_search_cache_on_text(sender, instance, **kwargs):
+    bump_generation(instance.document.owner_id)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Apply SQLITE_PRAGMAS to every new SQLite connection
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    logger.debug(f"Applied SQLite pragmas: {settings.SQLITE_PRAGMAS}")
@@ -0,0 +1,56 @@
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def compute_sha256(file):
+    """
+    Compute the SHA-256 of a file-like object in chunks, without loading it into memory
+    """
+    hasher = hashlib.sha256()
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    if hasattr(file, 'chunks'):
+        for chunk in file.chunks(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+    else:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return hasher.hexdigest()
+
+
+class HashingUploadHandlerMixin:
+    """
+    Computes the SHA-256 of an uploaded file while it is being received
+    and stores it in the ``sha256`` attribute of the resulting file
+    """
+    def new_file(self, *args, **kwargs):
+        # Обработчик в памяти прерывает new_file() исключением StopFutureHandlers,
+        # поэтому хеш создается до вызова родительского метода
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        result = super().receive_data_chunk(raw_data, start)
+        # None означает, что этот обработчик принял данные себе
+        if result is None:
+            self.hasher.update(raw_data)
+        return result
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
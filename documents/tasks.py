@@ -0,0 +1,264 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .extraction_cache import cached_extract_text
+from .extractors import extract_in_sandbox
+from .models import Document, ExtractionJob
+from .previews import generate_previews
+from .search_cache import bump_generation
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+def enqueue_extraction(document):
+    """
+    Put a document into the extraction queue and mark it as pending
+    """
+    job = ExtractionJob.objects.create(
+        document=document,
+        max_attempts=settings.EXTRACTION_MAX_ATTEMPTS,
+    )
+    if document.extraction_status != Document.EXTRACTION_PENDING:
+        document.extraction_status = Document.EXTRACTION_PENDING
+        document.save(update_fields=['extraction_status'])
+    logger.info(f"Queued extraction job {job.pk} for document {document.pk}")
+
+    if not settings.EXTRACTION_ASYNC:
+        # Без фонового воркера (например, при разработке) выполняем задачу сразу
+        job = claim_job(job.pk)
+        if job is not None:
+            run_job(job)
+    return job
+
+
+def enqueue_extraction_bulk(documents):
+    """
+    Queue extraction for several new (pending) documents with a single INSERT
+    """
+    jobs = ExtractionJob.objects.bulk_create([
+        ExtractionJob(document=document, max_attempts=settings.EXTRACTION_MAX_ATTEMPTS)
+        for document in documents
+    ])
+    logger.info(f"Queued {len(jobs)} extraction jobs")
+
+    if not settings.EXTRACTION_ASYNC:
+        for job in jobs:
+            claimed = claim_job(job.pk)
+            if claimed is not None:
+                run_job(claimed)
+                job.document.extraction_status = claimed.document.extraction_status
+    return jobs
+
+
+def enqueue_preview(document):
+    """
+    Queue rendering of the document previews unless it is already queued: by a
+    preview job or by the extraction job, which renders them too. A failed
+    preview job is returned as is, so a broken file is not rendered on every request
+    """
+    job = ExtractionJob.objects.filter(
+        Q(kind=ExtractionJob.PREVIEW) | Q(status__in=[ExtractionJob.QUEUED, ExtractionJob.RUNNING]),
+        document=document,
+    ).exclude(status=ExtractionJob.DONE).order_by('-id').first()
+    if job is not None:
+        return job
+
+    # Отрисовка детерминирована: повторять ее после ошибки бессмысленно
+    job = ExtractionJob.objects.create(document=document, kind=ExtractionJob.PREVIEW, max_attempts=1)
+    logger.info(f"Queued preview job {job.pk} for document {document.pk}")
+
+    if not settings.EXTRACTION_ASYNC:
+        claimed = claim_job(job.pk)
+        if claimed is not None:
+            run_job(claimed)
+            job.status = claimed.status
+    return job
+
+
+def extracted_texts_by_blob(blob_ids):
+    """
+    Already extracted text for the given blobs as {blob_id: (text, truncated, document_id)},
+    where document_id is the document the text (and its pages) can be copied from
+    """
+    texts = {}
+    documents = Document.objects.filter(
+        blob_id__in=blob_ids,
+        extraction_status=Document.EXTRACTION_DONE,
+    ).select_related('content').only('blob_id', 'text_truncated', 'content__text', 'content__compressed_text')
+    for document in documents:
+        if document.blob_id not in texts:
+            texts[document.blob_id] = (document.text_content, document.text_truncated, document.pk)
+    return texts
+
+
+def reuse_extraction(document):
+    """
+    Copy the extracted text and pages from another document with the same file content.
+    Returns True if the text was reused and no extraction is needed
+    """
+    if not document.blob_id:
+        return False
+
+    source = Document.objects.filter(
+        blob_id=document.blob_id,
+        extraction_status=Document.EXTRACTION_DONE,
+    ).exclude(pk=document.pk).select_related('content').only(
+        'text_truncated', 'content__text', 'content__compressed_text',
+    ).first()
+    if source is None:
+        return False
+
+    document.text_content = source.text_content
+    document.text_truncated = source.text_truncated
+    document.extraction_status = Document.EXTRACTION_DONE
+    with transaction.atomic():
+        document.save(update_fields=['text_truncated', 'extraction_status'])
+        document.save_text()
+        document.copy_pages(source)
+    logger.info(f"Reused extracted text of document {source.pk} for document {document.pk}")
+    return True
+
+
+def claim_job(job_pk):
+    """
+    Try to claim a queued job. Returns the job or None if another worker got it first
+    """
+    claimed = ExtractionJob.objects.filter(pk=job_pk, status=ExtractionJob.QUEUED).update(
+        status=ExtractionJob.RUNNING,
+        locked_at=timezone.now(),
+        attempts=F('attempts') + 1,
+        updated_at=timezone.now(),
+    )
+    if not claimed:
+        return None
+    return ExtractionJob.objects.select_related('document__blob').get(pk=job_pk)
+
+
+def claim_next_job():
+    """
+    Claim the oldest job that is ready to run. Returns None when the queue is empty
+    """
+    candidates = ExtractionJob.objects.filter(
+        status=ExtractionJob.QUEUED,
+        available_at__lte=timezone.now(),
+    ).order_by('available_at', 'id').values_list('pk', flat=True)[:10]
+
+    for job_pk in candidates:
+        job = claim_job(job_pk)
+        if job is not None:
+            return job
+    return None
+
+
+def requeue_stale_jobs(older_than):
+    """
+    Return jobs stuck in the running state (e.g. after a worker crash) to the queue
+    """
+    threshold = timezone.now() - timedelta(seconds=older_than)
+    count = ExtractionJob.objects.filter(
+        status=ExtractionJob.RUNNING,
+        locked_at__lt=threshold,
+    ).update(status=ExtractionJob.QUEUED, locked_at=None, updated_at=timezone.now())
+    if count:
+        logger.warning(f"Requeued {count} stale extraction jobs")
+    return count
+
+
+def run_job(job, timeout=None):
+    """
+    Extract text for the job's document and record the outcome.
+    Failed jobs are retried with a growing delay until max_attempts is reached
+    """
+    if job.kind == ExtractionJob.PREVIEW:
+        return run_preview_job(job)
+    if timeout is None:
+        timeout = settings.EXTRACTION_TIMEOUT
+
+    document = job.document
+
+    # Тот же файл мог быть обработан, пока задача ждала в очереди
+    if reuse_extraction(document):
+        job.status = ExtractionJob.DONE
+        job.save(update_fields=['status', 'updated_at'])
+        return True
+
+    Document.objects.filter(pk=document.pk).update(extraction_status=Document.EXTRACTION_RUNNING)
+    # update() не отправляет сигналы, а статус документа виден в результатах поиска
+    bump_generation(document.owner_id)
+
+    if settings.PREVIEW_ENABLED:
+        try:
+            generate_previews(document)
+        except Exception as e:
+            # Без превью документ остается доступным, ошибка не влияет на извлечение текста
+            logger.error(f"Preview generation failed for document {document.pk}: {str(e)}")
+
+    try:
+        logger.info(f"Extracting text from file: {document.file.path} (job {job.pk}, attempt {job.attempts})")
+        sha256 = document.blob.sha256 if document.blob_id else None
+        result = cached_extract_text(
+            document.file.path,
+            lambda file_path: extract_in_sandbox(file_path, timeout),
+            sha256=sha256,
+        )
+    except Exception as e:
+        logger.error(f"Extraction job {job.pk} failed: {str(e)}")
+        _handle_failure(job, e)
+        return False
+
+    with transaction.atomic():
+        document.text_content = result.text
+        document.text_truncated = result.truncated
+        document.extraction_status = Document.EXTRACTION_DONE
+        document.save(update_fields=['text_truncated', 'extraction_status'])
+        document.save_text()
+        document.save_pages(result.pages)
+
+        job.status = ExtractionJob.DONE
+        job.last_error = ''
+        job.save(update_fields=['status', 'last_error', 'updated_at'])
+    return True
+
+
+def run_preview_job(job):
+    """
+    Render the missing previews of the job's document (in a sandbox process)
+    """
+    document = job.document
+    try:
+        rendered = bool(generate_previews(document))
+        error = '' if rendered else 'Нет изображения для превью'
+    except Exception as e:
+        logger.error(f"Preview job {job.pk} failed: {str(e)}")
+        rendered, error = False, str(e)
+
+    job.status = ExtractionJob.DONE if rendered else ExtractionJob.FAILED
+    job.last_error = error
+    job.save(update_fields=['status', 'last_error', 'updated_at'])
+    return rendered
+
+
+def _handle_failure(job, error):
+    job.last_error = str(error)
+
+    if job.attempts < job.max_attempts:
+        delay = settings.EXTRACTION_RETRY_DELAY * job.attempts
+        job.status = ExtractionJob.QUEUED
+        job.available_at = timezone.now() + timedelta(seconds=delay)
+        job.locked_at = None
+        document_status = Document.EXTRACTION_PENDING
+    else:
+        job.status = ExtractionJob.FAILED
+        document_status = Document.EXTRACTION_FAILED
+
+    with transaction.atomic():
+        job.save(update_fields=['status', 'available_at', 'locked_at', 'last_error', 'updated_at'])
+        Document.objects.filter(pk=job.document_id).update(extraction_status=document_status)
+    # update() не отправляет сигналы, а статус документа виден в результатах поиска
+    bump_generation(job.document.owner_id)
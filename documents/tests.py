@@ -1,3 +1,1576 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import random
+import runpy
+import signal
+import struct
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.styles import Font
+from PIL import Image
+
+from . import extraction_cache, extractors, utils
+from .benchmark import write_pdf
+from .extraction_cache import ExtractionCache
+from .extractors import ExtractionError, ExtractionResult, ExtractionTimeout, Extractor, XlsxExtractor, extract_in_sandbox
+from .models import Blob, Document, DocumentContent, DocumentPage, ExtractionJob, blob_atomic
+from .ole import OLE_SIGNATURE
+from .previews import generate_previews
+from .serializers import store_document
+from .search import PAGE_FTS_TABLE, PAGE_HITS_PER_DOCUMENT, expand_fuzzy_terms, parse_query, search_documents
+from .tasks import claim_job, claim_next_job, enqueue_extraction, requeue_stale_jobs, run_job
+
+TEST_MEDIA_ROOT = tempfile.mkdtemp()
+TEST_EXTRACTION_CACHE_DIR = os.path.join(TEST_MEDIA_ROOT, 'extraction-cache')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, EXTRACTION_CACHE_DIR=TEST_EXTRACTION_CACHE_DIR)
+class DocumentTestCase(TestCase):
+    """
+    Base test case with a logged in user, a temporary MEDIA_ROOT and extraction cache
+    """
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password123')
+        self.client.force_login(self.user)
+
+    def create_document(self, title='Договор', content=b'%PDF-1.4 test', name='contract.pdf', owner=None):
+        document = Document(title=title, owner=owner or self.user, file=ContentFile(content, name=name))
+        document.save()
+        return document
+
+
+class FileOffloadTests(DocumentTestCase):
+    """
+    Offload mode: Django checks ownership and the front proxy sends the file
+    """
+    def setUp(self):
+        super().setUp()
+        self.document = self.create_document()
+        self.urls = [
+            f'/api/documents/{self.document.pk}/download/',
+            f'/documents/{self.document.pk}/file/',
+        ]
+
+    @override_settings(FILE_OFFLOAD_MODE='nginx', FILE_OFFLOAD_NGINX_PREFIX='/protected-media/')
+    def test_nginx_accel_redirect(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.document.file.name}')
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertEqual(response.content, b'')
+
+    @override_settings(FILE_OFFLOAD_MODE='sendfile')
+    def test_x_sendfile(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Sendfile'], self.document.file.path)
+            self.assertEqual(response.content, b'')
+
+    @override_settings(FILE_OFFLOAD_MODE='nginx')
+    def test_non_ascii_path_is_quoted(self):
+        document = self.create_document(name='счёт.pdf')
+        response = self.client.get(f'/api/documents/{document.pk}/download/')
+        self.assertTrue(response['X-Accel-Redirect'].isascii())
+        self.assertIn('%D1%81', response['X-Accel-Redirect'])
+
+    @override_settings(FILE_OFFLOAD_MODE='nginx')
+    def test_other_users_cannot_get_offload_headers(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password123')
+        self.client.force_login(other)
+
+        response = self.client.get(self.urls[0])
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+        response = self.client.get(self.urls[1])
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    @override_settings(FILE_OFFLOAD_MODE=None)
+    def test_without_offload_file_is_streamed(self):
+        response = self.client.get(self.urls[0])
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 test')
+
+
+class FileRangeTests(DocumentTestCase):
+    """
+    Sync file responses: byte ranges, multipart ranges and conditional requests
+    """
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 40
+        self.document = self.create_document(content=self.content)
+        self.url = f'/api/documents/{self.document.pk}/download/'
+
+    def download(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.status_code in (200, 206) else b''
+        return response, body
+
+    def test_single_range(self):
+        response, body = self.download(range='bytes=-100')
+        self.assertEqual(response.status_code, 206)
+        size = len(self.content)
+        self.assertEqual(response['Content-Range'], f'bytes {size - 100}-{size - 1}/{size}')
+        self.assertEqual(body, self.content[-100:])
+
+    def test_multipart_ranges(self):
+        response, body = self.download(range='bytes=0-9,20-29,25-39')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        self.assertEqual(response['Content-Length'], str(len(body)))
+        # Пересекающиеся диапазоны объединяются
+        self.assertIn(b'Content-Range: bytes 0-9/10240\r\n\r\n' + self.content[0:10], body)
+        self.assertIn(b'Content-Range: bytes 20-39/10240\r\n\r\n' + self.content[20:40], body)
+        self.assertEqual(body.count(b'Content-Range:'), 2)
+
+    def test_unsatisfiable_range(self):
+        response, body = self.download(range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_range_with_changed_file_returns_whole_file(self):
+        response, body = self.download(range='bytes=0-9', if_range='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+        etag = self.download()[0]['ETag']
+        response, body = self.download(range='bytes=0-9', if_range=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[:10])
+
+    def test_not_modified(self):
+        response, body = self.download()
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, headers={'if_none_match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.url, headers={'if_modified_since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+
+class BlobTests(DocumentTestCase):
+    """
+    Reference counting of content-addressed files
+    """
+    def store(self, content=b'%PDF-1.4 shared', owner=None):
+        return store_document(
+            SimpleUploadedFile('contract.pdf', content), title='Договор', owner=owner or self.user,
+        )
+
+    def test_identical_files_share_a_blob(self):
+        first, second = self.store(), self.store()
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_queryset_delete_releases_blob(self):
+        first, second = self.store(), self.store()
+        path = first.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            Document.objects.filter(pk=first.pk).delete()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Document.objects.filter(pk=second.pk).delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_owner_cascade_releases_blob(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password123')
+        path = self.store(owner=other).file.path
+        self.store()
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_rolled_back_upload_removes_file(self):
+        with self.assertRaises(RuntimeError):
+            with blob_atomic():
+                path = self.store(b'%PDF-1.4 rolled back').file.path
+                self.assertTrue(os.path.exists(path))
+                raise RuntimeError('rollback')
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_migration_creates_blobs_for_existing_files(self):
+        migration = importlib.import_module('documents.migrations.0015_blobs_for_existing_files')
+        first = self.create_document(content=b'%PDF-1.4 legacy')
+        second = self.create_document(content=b'%PDF-1.4 legacy')
+        missing = self.create_document(content=b'%PDF-1.4 missing')
+        duplicate_path = second.file.path
+        os.remove(missing.file.path)
+        # Превью документов без Blob хранились по номеру документа
+        key = f'doc{first.pk:08d}'
+        preview_dir = os.path.join(TEST_MEDIA_ROOT, 'previews', key[:2], key[2:4])
+        os.makedirs(preview_dir)
+        preview_path = os.path.join(preview_dir, f'{key}-thumb.png')
+        open(preview_path, 'wb').close()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            migration.create_blobs(apps, None)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        missing.refresh_from_db()
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.blob.ref_count, 2)
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertTrue(os.path.exists(first.file.path))
+        self.assertFalse(os.path.exists(duplicate_path))
+        self.assertIsNone(missing.blob_id)
+        self.assertFalse(os.path.exists(preview_path))
+
+
+class BulkUploadTests(DocumentTestCase):
+    """
+    Bulk upload of files and ZIP archives with per-file results
+    """
+    url = '/api/documents/bulk/'
+
+    def make_zip(self, entries):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, content in entries.items():
+                archive.writestr(name, content)
+        return buffer.getvalue()
+
+    def upload(self, files=(), archives=()):
+        return self.client.post(self.url, {'files': list(files), 'archive': list(archives)})
+
+    def test_zip_with_cp866_names(self):
+        # Архив из проводника Windows: имя в cp866 без флага UTF-8
+        name = 'Договор.pdf'
+        placeholder = 'x' * len(name.encode('cp866'))
+        data = self.make_zip({placeholder: b'%PDF-1.4 contract', 'notes.txt': b'text'})
+        data = data.replace(placeholder.encode('ascii'), name.encode('cp866'))
+
+        response = self.upload(archives=[SimpleUploadedFile('docs.zip', data)])
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([result['filename'] for result in results], [name, 'notes.txt'])
+        document = Document.objects.get(pk=results[0]['id'])
+        self.assertEqual(document.title, 'Договор')
+        self.assertEqual(document.original_filename, name)
+
+    def test_zip_entries_are_spooled_intact(self):
+        content = os.urandom(256 * 1024)
+        archive = SimpleUploadedFile('scans.zip', self.make_zip({'scan.png': content}))
+        response = self.upload(archives=[archive])
+        self.assertEqual(response.status_code, 201)
+
+        document = Document.objects.get(pk=response.json()['results'][0]['id'])
+        with document.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(document.size, len(content))
+
+    def test_mixed_batch(self):
+        response = self.upload(files=[
+            SimpleUploadedFile('contract.pdf', b'%PDF-1.4 contract'),
+            SimpleUploadedFile('setup.exe', b'MZ'),
+        ], archives=[SimpleUploadedFile('broken.zip', b'not a zip')])
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['created'], data['failed']), (1, 2))
+        self.assertEqual([result['status'] for result in data['results']], ['created', 'error', 'error'])
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_storage_error_fails_only_its_file(self):
+        acquire = Blob.objects.acquire
+
+        def failing_acquire(file):
+            if file.name == 'broken.pdf':
+                raise OSError('No space left on device')
+            return acquire(file)
+
+        with mock.patch.object(Blob.objects, 'acquire', side_effect=failing_acquire):
+            response = self.upload(files=[
+                SimpleUploadedFile('contract.pdf', b'%PDF-1.4 contract'),
+                SimpleUploadedFile('broken.pdf', b'%PDF-1.4 broken'),
+            ])
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual(results[0]['status'], 'created')
+        self.assertEqual(results[1]['status'], 'error')
+        self.assertIn('No space left on device', results[1]['error'])
+        self.assertEqual(Blob.objects.count(), 1)
+
+
+class UploadSessionTests(DocumentTestCase):
+    """
+    Resumable chunked upload: offsets, resuming and finalizing
+    """
+    def setUp(self):
+        super().setUp()
+        session_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, session_dir, ignore_errors=True)
+        patcher = override_settings(UPLOAD_SESSION_DIR=session_dir)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.content = b'%PDF-1.4 ' + os.urandom(64 * 1024)
+
+    def start(self, size=None):
+        response = self.client.post('/api/uploads/', {
+            'title': 'Отчет', 'filename': 'report.pdf', 'size': len(self.content) if size is None else size,
+        }, content_type='application/json')
+        return response
+
+    def put(self, session_id, offset, data):
+        return self.client.put(
+            f'/api/uploads/{session_id}/chunk/', data,
+            content_type='application/octet-stream', headers={'Upload-Offset': str(offset)},
+        )
+
+    def test_offset_mismatch(self):
+        session_id = self.start().json()['id']
+        response = self.put(session_id, 100, self.content[100:200])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 0)
+
+    def test_resume_and_finalize(self):
+        session_id = self.start().json()['id']
+        half = len(self.content) // 2
+        self.assertEqual(self.put(session_id, 0, self.content[:half]).json()['offset'], half)
+        # Повтор уже принятой части после потерянного ответа
+        self.assertEqual(self.put(session_id, 0, self.content[:half]).status_code, 409)
+
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 400)
+
+        # Клиент узнает смещение и продолжает с него
+        offset = self.client.get(f'/api/uploads/{session_id}/').json()['offset']
+        self.assertEqual(offset, half)
+        self.put(session_id, offset, self.content[offset:])
+
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        document = Document.objects.get(pk=response.json()['id'])
+        with document.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(document.blob.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/finalize/').json()['id'], document.pk)
+
+    @override_settings(UPLOAD_SESSION_MAX_SIZE=64 * 1024 * 1024)
+    def test_session_size_limit(self):
+        self.assertEqual(self.start(size=50 * 1024 * 1024).status_code, 201)
+        response = self.start(size=65 * 1024 * 1024)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('64MB', json.dumps(response.json(), ensure_ascii=False))
+
+
+class QueryCountTests(DocumentTestCase):
+    """
+    Every endpoint runs a fixed number of queries: the session, the user and the
+    documents (owner is joined, not loaded per document)
+    """
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            self.create_document(title=f'Договор {i}')
+        self.document = self.create_document(title='Договор поставки')
+
+    def add_documents(self, count=10):
+        for i in range(count):
+            self.create_document(title=f'Договор аренды {i}')
+
+    def assert_queries(self, url, count, status_code=200):
+        with self.assertNumQueries(count):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status_code)
+        return response
+
+    def test_list(self):
+        response = self.assert_queries('/api/documents/', 3)
+        self.assertEqual(response.json()['results'][0]['owner_username'], 'owner')
+        self.add_documents()
+        self.assert_queries('/api/documents/', 3)
+
+    def test_list_with_text(self):
+        self.add_documents()
+        self.assert_queries('/api/documents/?fields=id,owner_username,text_content', 3)
+
+    def test_detail(self):
+        response = self.assert_queries(f'/api/documents/{self.document.pk}/', 3)
+        self.assertEqual(response.json()['owner_username'], 'owner')
+
+    def test_search(self):
+        self.add_documents()
+        response = self.assert_queries('/api/documents/search/?q=Договор', 3)
+        self.assertEqual(len(response.json()['results']), 16)
+
+    def test_search_with_highlight(self):
+        self.add_documents()
+        self.assert_queries('/api/documents/search/?q=Договор&highlight=1', 4)
+
+    def test_search_with_pages(self):
+        self.add_documents()
+        self.assert_queries('/api/documents/search/?q=Договор&pages=1', 4)
+
+    def test_download(self):
+        self.assert_queries(f'/api/documents/{self.document.pk}/download/', 3)
+
+    def test_preview(self):
+        image = BytesIO()
+        Image.new('RGB', (400, 300), 'white').save(image, 'PNG')
+        document = self.create_document(content=image.getvalue(), name='scan.png')
+        generate_previews(document)
+        self.assert_queries(f'/api/documents/{document.pk}/preview/', 3)
+
+    def test_view_page(self):
+        self.assert_queries(f'/documents/{self.document.pk}/', 3)
+
+    def test_file_view(self):
+        self.assert_queries(f'/documents/{self.document.pk}/file/', 3)
+
+    def test_admin_job_changelist(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        url = '/admin/documents/extractionjob/'
+        ExtractionJob.objects.bulk_create([ExtractionJob(document=document) for document in Document.objects.all()])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.add_documents()
+        ExtractionJob.objects.bulk_create([
+            ExtractionJob(document=document) for document in Document.objects.filter(extraction_jobs__isnull=True)
+        ])
+        self.assertNumQueries(len(queries), self.client.get, url)
+
+    def test_list_query_uses_owner_date_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN is SQLite-specific')
+        queryset = Document.objects.filter(owner=self.user).order_by('-upload_date', '-id')
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('document_owner_date_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class FullTextSearchTests(DocumentTestCase):
+    """
+    Ranked full-text search: phrases, prefixes and Russian word forms
+    """
+    def setUp(self):
+        super().setUp()
+        self.in_title = self.create_document(title='Договор поставки оборудования')
+        self.in_text = self.create_document(title='Акт сверки')
+        self.in_text.text_content = 'Приложение к договору: счёт на оплату (invoice), оборудование поставки'
+        self.in_text.save_text()
+        self.other = self.create_document(title='Отчет за квартал')
+
+    def search(self, query):
+        return list(search_documents(Document.objects.all(), query).values_list('pk', flat=True))
+
+    def test_title_matches_rank_higher(self):
+        self.assertEqual(self.search('оборудования поставки'), [self.in_title.pk, self.in_text.pk])
+
+    def test_russian_word_forms(self):
+        self.assertEqual(set(self.search('договоры')), {self.in_title.pk, self.in_text.pk})
+        self.assertEqual(self.search('квартала'), [self.other.pk])
+
+    def test_phrase(self):
+        self.assertEqual(self.search('"поставки оборудования"'), [self.in_title.pk])
+        self.assertEqual(self.search('"оборудования поставки"'), [])
+
+    def test_prefix(self):
+        self.assertEqual(self.search('свер*'), [self.in_text.pk])
+        # Русские слова ищутся по основе, остальные - целиком, если не указан префикс
+        self.assertEqual(self.search('invo*'), [self.in_text.pk])
+        self.assertEqual(self.search('invo'), [])
+
+    def test_yo_is_e(self):
+        self.assertEqual(self.search('счет'), [self.in_text.pk])
+        self.assertEqual(self.search('отчёт'), [self.other.pk])
+
+    def test_other_users_documents_are_not_found(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password123')
+        self.create_document(title='Договор аренды', owner=other)
+        response = self.client.get('/api/documents/search/', {'q': 'договор'})
+        self.assertEqual(
+            {result['id'] for result in response.json()['results']},
+            {self.in_title.pk, self.in_text.pk},
+        )
+
+
+class CursorPaginationTests(DocumentTestCase):
+    """
+    Keyset pagination of the document list and search results
+    """
+    def setUp(self):
+        super().setUp()
+        # Одинаковая дата загрузки: порядок задает id
+        self.documents = [self.create_document(title=f'Договор {index}') for index in range(5)]
+        Document.objects.update(upload_date=timezone.now())
+
+    def walk(self, url, params):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [item['id'] for item in data['results']]
+            if not data['next']:
+                return ids
+            response = self.client.get(data['next'])
+
+    def test_pages_cover_the_list_once(self):
+        ids = self.walk('/api/documents/', {'page_size': 2})
+        self.assertEqual(ids, sorted((document.pk for document in self.documents), reverse=True))
+
+    def test_new_documents_do_not_shift_pages(self):
+        response = self.client.get('/api/documents/', {'page_size': 2})
+        first = [item['id'] for item in response.json()['results']]
+        self.create_document(title='Новый договор')
+        ids = first + self.walk(response.json()['next'], {})
+        self.assertEqual(ids, sorted((document.pk for document in self.documents), reverse=True))
+
+    def test_search_pages(self):
+        with self.settings(SEARCH_CACHE_ENABLED=False):
+            ids = self.walk('/api/documents/search/', {'q': 'договор', 'page_size': 2})
+        self.assertEqual(sorted(ids), sorted(document.pk for document in self.documents))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/documents/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class PageSearchTests(DocumentTestCase):
+    """
+    Text of PDF pages and spreadsheet sheets is indexed page by page
+    """
+    def setUp(self):
+        super().setUp()
+        self.document = self.create_document(title='Отчет')
+        self.document.text_content = 'Введение. Смета работ. Итоговый счёт на оплату'
+        self.document.save_text()
+        self.document.save_pages([('', 'Введение'), ('', 'Смета работ'), ('', 'Итоговый счёт на оплату')])
+
+    def search(self, query):
+        response = self.client.get('/api/documents/search/', {'q': query, 'pages': '1'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_search_returns_matching_pages(self):
+        results = self.search('счет')
+        self.assertEqual(len(results), 1)
+        pages = results[0]['pages']
+        self.assertEqual([page['number'] for page in pages], [3])
+        self.assertIn('<mark>', pages[0]['snippet'])
+
+    def test_pages_are_limited_per_document(self):
+        self.document.save_pages([('', f'Страница {i} сметы') for i in range(PAGE_HITS_PER_DOCUMENT + 3)])
+        pages = self.search('смета')[0]['pages']
+        self.assertEqual([page['number'] for page in pages], list(range(1, PAGE_HITS_PER_DOCUMENT + 1)))
+
+    def test_pages_are_not_returned_without_parameter(self):
+        response = self.client.get('/api/documents/search/', {'q': 'счет'})
+        self.assertNotIn('pages', response.json()['results'][0])
+
+    def test_deleted_document_is_removed_from_page_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('The page index table is SQLite-specific')
+        self.document.delete()
+        self.assertFalse(DocumentPage.objects.exists())
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {PAGE_FTS_TABLE} WHERE {PAGE_FTS_TABLE} MATCH 'смета'")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_xlsx_sheets_become_pages(self):
+        workbook = Workbook()
+        workbook.active.title = 'Итоги'
+        workbook.active.append(['Всего', 100])
+        workbook.create_sheet('Расходы').append(['Аренда', 40])
+        path = f'{TEST_MEDIA_ROOT}/report.xlsx'
+        workbook.save(path)
+
+        result = XlsxExtractor().run(path)
+        self.assertEqual(result.pages, [('Итоги', 'Всего 100\n'), ('Расходы', 'Аренда 40\n')])
+        self.assertEqual(result.text, 'Всего 100\nАренда 40\n')
+
+
+@override_settings(EXTRACTION_CACHE_ENABLED=False, PREVIEW_ENABLED=False, EXTRACTION_RETRY_DELAY=60)
+class ExtractionQueueTests(DocumentTestCase):
+    """
+    Claiming, retries and recovery of extraction jobs
+    """
+    def setUp(self):
+        super().setUp()
+        self.document = self.create_document()
+        self.job = enqueue_extraction(self.document)
+
+    def run_failing_job(self, job):
+        with mock.patch('documents.tasks.extract_in_sandbox', side_effect=ExtractionError('broken file')):
+            self.assertFalse(run_job(job))
+        job.refresh_from_db()
+        self.document.refresh_from_db()
+        return job
+
+    def test_job_is_claimed_once(self):
+        self.assertIsNotNone(claim_job(self.job.pk))
+        self.assertIsNone(claim_job(self.job.pk))
+        self.assertIsNone(claim_next_job())
+
+    def test_failed_job_is_retried_later(self):
+        job = self.run_failing_job(claim_next_job())
+        self.assertEqual(job.status, ExtractionJob.QUEUED)
+        self.assertEqual(job.last_error, 'broken file')
+        self.assertGreater(job.available_at, timezone.now() + timedelta(seconds=50))
+        self.assertEqual(self.document.extraction_status, Document.EXTRACTION_PENDING)
+        # До истечения задержки задача не выдается
+        self.assertIsNone(claim_next_job())
+
+    @override_settings(SEARCH_CACHE_ENABLED=True)
+    def test_running_status_is_not_served_from_search_cache(self):
+        def search_status():
+            return self.client.get('/api/documents/search/', {'q': 'договор'}).json()['results'][0]['extraction_status']
+
+        statuses = []
+
+        def extract(file_path, timeout):
+            statuses.append(search_status())
+            return ExtractionResult('Договор поставки')
+
+        self.assertEqual(search_status(), Document.EXTRACTION_PENDING)
+        with mock.patch('documents.tasks.extract_in_sandbox', side_effect=extract):
+            self.assertTrue(run_job(claim_next_job()))
+        self.assertEqual(statuses, [Document.EXTRACTION_RUNNING])
+        self.assertEqual(search_status(), Document.EXTRACTION_DONE)
+
+    def test_job_fails_after_max_attempts(self):
+        for attempt in range(self.job.max_attempts):
+            ExtractionJob.objects.filter(pk=self.job.pk).update(available_at=timezone.now())
+            job = self.run_failing_job(claim_next_job())
+        self.assertEqual(job.attempts, job.max_attempts)
+        self.assertEqual(job.status, ExtractionJob.FAILED)
+        self.assertEqual(self.document.extraction_status, Document.EXTRACTION_FAILED)
+        self.assertIsNone(claim_next_job())
+
+    def test_stale_jobs_are_requeued(self):
+        claim_job(self.job.pk)
+        self.assertEqual(requeue_stale_jobs(older_than=60), 0)
+        ExtractionJob.objects.filter(pk=self.job.pk).update(locked_at=timezone.now() - timedelta(seconds=120))
+        self.assertEqual(requeue_stale_jobs(older_than=60), 1)
+        self.assertEqual(claim_next_job().pk, self.job.pk)
+
+
+@override_settings(
+    MEDIA_ROOT=TEST_MEDIA_ROOT, EXTRACTION_CACHE_DIR=TEST_EXTRACTION_CACHE_DIR,
+    EXTRACTION_CACHE_ENABLED=False, PREVIEW_ENABLED=False,
+)
+class ExtractionWorkerTests(TransactionTestCase):
+    """
+    The process_extraction_jobs command (the worker closes its connections, so no
+    TestCase transaction is used)
+    """
+    def test_worker_requeues_stale_jobs_and_processes_queue(self):
+        user = User.objects.create_user('owner', 'owner@example.com', 'password123')
+        documents = [
+            Document.objects.create(title=f'Договор {i}', owner=user, file=ContentFile(b'%PDF-1.4', name='a.pdf'))
+            for i in range(2)
+        ]
+        for document in documents:
+            enqueue_extraction(document)
+        # Задача воркера, который упал во время обработки
+        stale = claim_next_job()
+        ExtractionJob.objects.filter(pk=stale.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+
+        result = ExtractionResult('Текст договора')
+        with mock.patch('documents.tasks.extract_in_sandbox', return_value=result), \
+                mock.patch.object(signal, 'signal'):
+            call_command('process_extraction_jobs', '--once', '--concurrency', '1', '--timeout', '60', stdout=StringIO())
+
+        self.assertEqual(ExtractionJob.objects.filter(status=ExtractionJob.DONE).count(), 2)
+        for document in documents:
+            document = Document.objects.get(pk=document.pk)
+            self.assertEqual(document.extraction_status, Document.EXTRACTION_DONE)
+            self.assertEqual(document.text_content, 'Текст договора')
+
+
+class PreviewTests(DocumentTestCase):
+    """
+    Missing previews are queued and rendered by the worker, never in the request
+    """
+    def create_image(self, content=None):
+        if content is None:
+            image = BytesIO()
+            Image.new('RGB', (400, 300), 'white').save(image, 'PNG')
+            content = image.getvalue()
+        return self.create_document(content=content, name='scan.png')
+
+    def preview(self, document):
+        return self.client.get(f'/api/documents/{document.pk}/preview/')
+
+    def test_missing_preview_is_queued(self):
+        document = self.create_image()
+        for _ in range(2):
+            response = self.preview(document)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json(), {'status': ExtractionJob.QUEUED})
+        self.assertEqual(ExtractionJob.objects.filter(document=document, kind=ExtractionJob.PREVIEW).count(), 1)
+
+        self.assertTrue(run_job(claim_next_job()))
+        response = self.preview(document)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('image/'))
+
+    @override_settings(EXTRACTION_ASYNC=False)
+    def test_preview_is_rendered_at_once_without_worker(self):
+        self.assertEqual(self.preview(self.create_image()).status_code, 200)
+
+    def test_unsupported_format(self):
+        document = self.create_document(content=b'text', name='notes.txt')
+        self.assertEqual(self.preview(document).status_code, 404)
+        self.assertFalse(ExtractionJob.objects.filter(document=document).exists())
+
+    @override_settings(EXTRACTION_ASYNC=False)
+    def test_corrupt_image_does_not_break_extraction(self):
+        document = self.create_image(content=b'\x89PNG\r\n\x1a\n' + b'broken' * 100)
+        job = enqueue_extraction(document)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExtractionJob.DONE)
+
+        # Ошибка отрисовки запоминается: файл не отрисовывается заново на каждый запрос
+        for _ in range(2):
+            self.assertEqual(self.preview(document).status_code, 404)
+        preview_jobs = ExtractionJob.objects.filter(document=document, kind=ExtractionJob.PREVIEW)
+        self.assertEqual([job.status for job in preview_jobs], [ExtractionJob.FAILED])
+
+
+class FuzzySearchTests(DocumentTestCase):
+    """
+    ?fuzzy=1 finds words garbled by OCR through the trigram index
+    """
+    def setUp(self):
+        super().setUp()
+        self.document = self.create_document(title='Скан')
+        self.document.text_content = 'Договор поставки обарудования между сторонами'
+        self.document.save_text()
+        other = self.create_document(title='Другой документ')
+        other.text_content = 'Справка о доходах'
+        other.save_text()
+
+    def search(self, query, fuzzy=True):
+        params = {'q': query, 'highlight': '1'}
+        if fuzzy:
+            params['fuzzy'] = '1'
+        response = self.client.get('/api/documents/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_fuzzy_search_finds_misrecognized_words(self):
+        self.assertEqual(self.search('поставка оборудования', fuzzy=False), [])
+        results = self.search('поставка оборудования')
+        self.assertEqual([result['id'] for result in results], [self.document.pk])
+        self.assertIn('<mark>', results[0]['snippet'])
+
+    def test_dissimilar_words_do_not_match(self):
+        self.assertEqual(self.search('накладная'), [])
+
+    @override_settings(TEXT_COMPRESSION_MIN_CHARS=10)
+    def test_compressed_text_is_searched(self):
+        document = self.create_document(title='Длинный скан')
+        document.text_content = 'Акт приемки выпалненных работ'
+        document.save_text()
+        self.assertIsNotNone(document.content.compressed_text)
+        self.assertEqual([result['id'] for result in self.search('выполненных')], [document.pk])
+
+    def test_async_view_matches_sync_view(self):
+        sync_results = self.search('поставка оборудования')
+        with self.settings(ROOT_URLCONF='documents.async_urls'):
+            async_results = self.search('поставка оборудования')
+        self.assertEqual(async_results, sync_results)
+
+    def test_expansion_uses_indexed_words(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query expansion is used with SQLite only')
+        terms = expand_fuzzy_terms(parse_query('оборудования'))
+        self.assertEqual(terms[0].variants, ['обарудования'])
+
+
+class SearchCacheTests(DocumentTestCase):
+    """
+    Repeated searches are served from the cache until the user's documents change
+    """
+    url = '/api/documents/search/?q=Договор&highlight=1'
+
+    def setUp(self):
+        super().setUp()
+        self.create_document(title='Договор аренды')
+
+    def test_repeated_search_is_cached(self):
+        first = self.client.get(self.url).json()
+        # Только сессия и пользователь, сам поиск не выполняется
+        with self.assertNumQueries(2):
+            second = self.client.get('/api/documents/search/?q=%20ДОГОВОР&highlight=1').json()
+        self.assertEqual(first, second)
+
+    def test_document_changes_invalidate_cache(self):
+        self.client.get(self.url)
+        document = self.create_document(title='Договор поставки')
+        self.assertEqual(len(self.client.get(self.url).json()['results']), 2)
+        document.delete()
+        self.assertEqual(len(self.client.get(self.url).json()['results']), 1)
+
+    def test_results_are_per_user(self):
+        self.client.get(self.url)
+        other = User.objects.create_user('other', 'other@example.com', 'password123')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).json()['results'], [])
+
+    def test_requested_fields_are_part_of_the_key(self):
+        self.client.get('/api/documents/search/?q=Договор')
+        results = self.client.get('/api/documents/search/?q=Договор&fields=id,text_content').json()['results']
+        self.assertEqual(set(results[0]), {'id', 'text_content'})
+        # Тот же набор полей в другом порядке берется из кэша
+        with self.assertNumQueries(2):
+            same = self.client.get('/api/documents/search/?q=Договор&fields=text_content,id').json()['results']
+        self.assertEqual(same, results)
+
+    def test_stats_are_for_staff_only(self):
+        self.assertEqual(self.client.get('/api/documents/search/cache-stats/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(self.url)
+        self.client.get(self.url)
+        stats = self.client.get('/api/documents/search/cache-stats/').json()
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertGreater(stats['hit_ratio'], 0)
+
+
+@override_settings(ROOT_URLCONF='documents.async_urls', FILE_STREAM_CHUNK_SIZE=16 * 1024)
+class AsyncViewTests(DocumentTestCase):
+    """
+    Async download and search views (ASYNC_VIEWS) called through the ASGI handler
+    """
+    def setUp(self):
+        super().setUp()
+        self.content = os.urandom(100 * 1024)
+        self.document = self.create_document(content=self.content)
+
+    async def download(self, url, **headers):
+        response = await self.async_client.get(url, headers=headers)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        return response, body
+
+    async def test_concurrent_downloads(self):
+        await self.async_client.aforce_login(self.user)
+        urls = [f'/api/documents/{self.document.pk}/download/', f'/documents/{self.document.pk}/file/'] * 100
+        results = await asyncio.gather(*(self.download(url) for url in urls))
+
+        for response, body in results:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Length'], str(len(self.content)))
+            self.assertEqual(body, self.content)
+        # Файлы читает пул фиксированного размера, а не поток на каждую загрузку
+        readers = [t for t in threading.enumerate() if t.name.startswith('docflow-file-reader')]
+        self.assertLessEqual(len(readers), 4)
+
+    async def test_range_request(self):
+        await self.async_client.aforce_login(self.user)
+        response, body = await self.download(f'/api/documents/{self.document.pk}/download/', range='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(body, self.content[100:200])
+
+    async def test_other_users_cannot_download(self):
+        other = await User.objects.acreate_user('other', 'other@example.com', 'password123')
+        await self.async_client.aforce_login(other)
+        response = await self.async_client.get(f'/api/documents/{self.document.pk}/download/')
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(f'/documents/{self.document.pk}/file/')
+        self.assertEqual(response.status_code, 302)
+
+        await self.async_client.alogout()
+        response = await self.async_client.get(f'/api/documents/{self.document.pk}/download/')
+        self.assertEqual(response.status_code, 403)
+
+    async def test_search_matches_sync_view(self):
+        await sync_to_async(self.create_document)(title='Договор поставки')
+        self.document.text_content = 'Договор аренды помещения'
+        await sync_to_async(self.document.save_text)()
+        url = '/api/documents/search/?' + urlencode({'q': 'договор', 'highlight': 1, 'page_size': 1})
+
+        @sync_to_async
+        def sync_search(url):
+            with self.settings(ROOT_URLCONF='documents.urls'):
+                return self.client.get(url).json()
+
+        with self.settings(SEARCH_CACHE_ENABLED=False):
+            expected = await sync_search(url)
+            expected_next = await sync_search(expected['next'])
+            await self.async_client.aforce_login(self.user)
+            first = (await self.async_client.get(url)).json()
+            second = (await self.async_client.get(first['next'])).json()
+        self.assertEqual(first, expected)
+        self.assertEqual(second, expected_next)
+        self.assertEqual(len(first['results'] + second['results']), 2)
+
+    async def test_basic_authentication(self):
+        await sync_to_async(self.client.logout)()
+        await self.async_client.alogout()
+        credentials = base64.b64encode(b'owner:password123').decode('ascii')
+        url = f'/api/documents/{self.document.pk}/download/'
+        response, body = await self.download(url, authorization=f'Basic {credentials}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        response = await self.async_client.get('/api/documents/search/?q=test', headers={'authorization': f'Basic {credentials}'})
+        self.assertEqual(response.status_code, 200)
+
+        # Неверный пароль отклоняется так же, как синхронным API
+        credentials = base64.b64encode(b'owner:wrong').decode('ascii')
+        response = await self.async_client.get(url, headers={'authorization': f'Basic {credentials}'})
+        with self.settings(ROOT_URLCONF='documents.urls'):
+            expected = await sync_to_async(self.client.get)(url, headers={'authorization': f'Basic {credentials}'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), expected.json())
+
+
+class BenchmarkCommandTests(TestCase):
+    """
+    benchmark_extractors writes a JSON report and fails on regressions against a baseline
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def run_benchmark(self, name, **options):
+        output = os.path.join(self.directory, name)
+        call_command(
+            'benchmark_extractors', case=['pdf', 'txt-cp1251'], files=1, repeat=2,
+            output=output, stderr=StringIO(), **options,
+        )
+        with open(output, encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_report(self):
+        report = self.run_benchmark('report.json', corpus_dir=os.path.join(self.directory, 'corpus'))
+        self.assertEqual(set(report['results']), {'pdf', 'txt-cp1251'})
+        pdf = report['results']['pdf']
+        self.assertEqual(pdf['function'], 'extract_text_from_pdf')
+        self.assertEqual(pdf['runs'], 2)
+        self.assertGreaterEqual(pdf['pages'], 5)
+        self.assertGreater(pdf['chars'], 0)
+        for metric in ('p50_ms', 'p95_ms', 'pages_per_s', 'mb_per_s', 'peak_rss_mb'):
+            self.assertGreater(pdf[metric], 0)
+        # Тот же seed дает тот же корпус
+        with open(os.path.join(self.directory, 'corpus', 'pdf', 'pdf-000.pdf'), 'rb') as f:
+            first = f.read()
+        self.run_benchmark('again.json', corpus_dir=os.path.join(self.directory, 'corpus'))
+        with open(os.path.join(self.directory, 'corpus', 'pdf', 'pdf-000.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), first)
+
+    def test_regression_threshold(self):
+        baseline = self.run_benchmark('baseline.json')
+        baseline['results']['pdf']['p50_ms'] /= 100
+        path = os.path.join(self.directory, 'fast-baseline.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f)
+        with self.assertRaisesMessage(CommandError, 'pdf p50_ms'):
+            self.run_benchmark('current.json', baseline=path)
+
+
+def _process_running(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            state = f.read().rsplit(')', 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state != 'Z'
+
+
+class HangingExtractor(Extractor):
+    """
+    Starts a worker process, like the PDF and OCR pools, and never finishes
+    """
+    name = 'hanging'
+    extensions = ('hang',)
+    timeout = 1
+
+    def extract(self, file_path):
+        worker = multiprocessing.Process(target=time.sleep, args=(60,))
+        worker.start()
+        with open(f'{file_path}.pid', 'w') as f:
+            f.write(str(worker.pid))
+        time.sleep(60)
+
+
+@skipUnless(os.path.isdir('/proc') and hasattr(os, 'setsid'), 'Needs Linux process groups')
+class SandboxTests(SimpleTestCase):
+    """
+    A timed-out extraction leaves no processes behind
+    """
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'file.hang')
+        with open(self.path, 'w') as f:
+            f.write('data')
+
+    @mock.patch.dict(extractors.EXTENSION_EXTRACTORS, {'hang': 'hanging'})
+    @mock.patch.dict(extractors.EXTRACTORS, {'hanging': HangingExtractor()})
+    def test_timeout_kills_descendants(self):
+        with self.assertRaises(ExtractionTimeout):
+            extract_in_sandbox(self.path)
+        with open(f'{self.path}.pid') as f:
+            pid = int(f.read())
+
+        deadline = time.monotonic() + 5
+        while _process_running(pid) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.assertFalse(_process_running(pid))
+
+
+@override_settings(PDF_PAGES_PER_SHARD=2, PDF_OCR_ENABLED=False)
+class PdfShardingTests(SimpleTestCase):
+    """
+    PDF pages are extracted in shards, weak pages are re-read by pdfminer one by one
+    """
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'report.pdf')
+        self.page_count = write_pdf(self.path, random.Random(0), 1)
+
+    def assert_pages_in_order(self, pages):
+        self.assertEqual(len(pages), self.page_count)
+        for number, text in enumerate(pages, start=1):
+            self.assertTrue(text.startswith(f'Page {number}\n'), text[:20])
+
+    @override_settings(PDF_EXTRACTION_WORKERS=3)
+    def test_shards_are_joined_in_page_order(self):
+        self.assert_pages_in_order(utils.extract_pdf_pages(self.path))
+
+    @override_settings(PDF_EXTRACTION_WORKERS=1)
+    def test_failed_shard_is_read_by_pdfminer(self):
+        reader_class = utils.PyPDF2.PdfReader
+        calls = []
+
+        def reader(*args, **kwargs):
+            calls.append(args)
+            # Первый вызов считает страницы, второй открывает первый шард
+            if len(calls) == 2:
+                raise utils.PyPDF2.errors.PdfReadError('broken shard')
+            return reader_class(*args, **kwargs)
+
+        with mock.patch.object(utils.PyPDF2, 'PdfReader', side_effect=reader), \
+                mock.patch.object(utils, '_extract_pdf_pages_pdfminer', wraps=utils._extract_pdf_pages_pdfminer) as pdfminer:
+            pages = utils.extract_pdf_pages(self.path)
+        self.assert_pages_in_order(pages)
+        pdfminer.assert_called_once_with(self.path, [0, 1])
+
+    @override_settings(PDF_EXTRACTION_WORKERS=3)
+    def test_serial_extraction_when_pool_cannot_start(self):
+        with mock.patch.object(utils, 'ProcessPoolExecutor', side_effect=OSError('no processes')) as executor:
+            pages = utils.extract_pdf_pages(self.path)
+        self.assertTrue(executor.called)
+        self.assert_pages_in_order(pages)
+
+
+def _slow_ocr_page(file_path, page_num, timeout):
+    # Вместо tesseract: страница распознается за полсекунды
+    time.sleep(min(0.5, timeout))
+    return page_num, f'Распознанная страница {page_num + 1}'
+
+
+@override_settings(PDF_OCR_WORKERS=1, PDF_OCR_PAGE_TIMEOUT=60)
+class OcrDeadlineTests(SimpleTestCase):
+    """
+    OCR of a long scan stops at PDF_OCR_TOTAL_TIMEOUT and keeps the recognized pages
+    """
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'scan.pdf')
+        pages = [Image.new('L', (200, 280), 255) for _ in range(3)]
+        pages[0].save(self.path, save_all=True, append_images=pages[1:])
+
+        patches = [
+            mock.patch.object(utils, 'tesseract_available', return_value=True),
+            mock.patch.object(utils, '_ocr_pdf_page', _slow_ocr_page),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    @override_settings(PDF_OCR_TOTAL_TIMEOUT=2)
+    def test_pages_after_deadline_are_skipped(self):
+        skipped = []
+        start = time.monotonic()
+        texts = utils.ocr_pdf_pages(self.path, list(range(10)), skipped)
+        self.assertLess(time.monotonic() - start, 3)
+        self.assertGreaterEqual(len(texts), 2)
+        self.assertTrue(skipped)
+        self.assertEqual(sorted(texts) + skipped, list(range(10)))
+
+    def test_partial_ocr_marks_text_truncated(self):
+        with self.settings(PDF_OCR_TOTAL_TIMEOUT=60):
+            result = extractors.PdfExtractor().extract(self.path)
+        self.assertFalse(result.truncated)
+        self.assertIn('Распознанная страница 3', result.text)
+
+        with self.settings(PDF_OCR_TOTAL_TIMEOUT=0):
+            result = extractors.PdfExtractor().extract(self.path)
+        self.assertTrue(result.truncated)
+        self.assertEqual(len(result.pages), 3)
+
+
+class ExtractionCacheTests(SimpleTestCase):
+    """
+    LRU eviction of the extraction cache down to the low-water mark
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.cache = ExtractionCache(self.root, max_bytes=300, low_water=0.75)
+
+    def put(self, name, size=100):
+        self.cache.set(name * 64, 'text', 2, 'x' * size)
+        return self.cache.entry_path(name * 64, 'text', 2)
+
+    def test_least_recently_used_entries_are_evicted_to_low_water(self):
+        paths = {name: self.put(name) for name in 'abc'}
+        self.assertIsNotNone(self.cache.get('a' * 64, 'text', 2))
+        paths['d'] = self.put('d')
+
+        # 400 байт > 300: удаляются b и c, пока размер не станет не больше 225
+        remaining = {name for name, path in paths.items() if os.path.exists(path)}
+        self.assertEqual(remaining, {'a', 'd'})
+        self.assertEqual(self.cache.stats()['bytes'], 200)
+
+    def test_sizes_are_accounted_without_rescanning(self):
+        with mock.patch.object(self.cache, '_entries', wraps=self.cache._entries) as entries:
+            self.put('a')
+            self.put('a', size=50)
+            self.put('b', size=20)
+            self.assertEqual(entries.call_count, 1)
+        self.assertEqual(self.cache._total_bytes, 70)
+        stats = self.cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes']), (2, 70))
+
+    def test_entries_used_by_other_processes_are_kept(self):
+        a, b = self.put('a'), self.put('b')
+        # Другой процесс прочитал запись a - ее время изменения новее, чем в индексе
+        os.utime(a, (time.time() + 100, time.time() + 100))
+        self.put('c')
+        self.put('d')
+        self.assertTrue(os.path.exists(a))
+        self.assertFalse(os.path.exists(b))
+
+    def test_stats_are_flushed_without_fcntl(self):
+        self.put('a')
+        self.cache.get('a' * 64, 'text', 2)
+        self.cache.get('b' * 64, 'text', 2)
+        with mock.patch.object(extraction_cache, 'fcntl', None):
+            self.cache.flush_stats()
+        stats = ExtractionCache(self.root, max_bytes=300).stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_outdated_versions_are_removed(self):
+        self.cache.set('a' * 64, 'text', 1, 'old')
+        old_path = self.cache.entry_path('a' * 64, 'text', 1)
+        current = self.put('b')
+        self.cache.evict(rescan=True)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(current))
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+
+RUSSIAN_TEXT = (
+    'Настоящий договор поставки заключен между поставщиком и покупателем. '
+    'Поставщик обязуется передать в собственность покупателя оборудование, '
+    'а покупатель обязуется принять его и оплатить в течение десяти дней.\n'
+) * 20
+
+
+@override_settings(TEXT_EXTRACTION_CHUNK_CHARS=100)
+class TextFileExtractionTests(SimpleTestCase):
+    """
+    TXT/MD files are decoded in one streaming pass with the encoding detected from a prefix
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, data, name='text.txt'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_encodings(self):
+        for encoding in ('utf-8', 'cp1251', 'koi8-r', 'utf-16'):
+            with self.subTest(encoding=encoding):
+                path = self.write(RUSSIAN_TEXT.encode(encoding))
+                self.assertEqual(utils.read_text_file(path), (RUSSIAN_TEXT, False))
+
+    @override_settings(TEXT_ENCODING_SAMPLE_BYTES=64)
+    def test_ascii_prefix_is_read_as_utf8(self):
+        path = self.write(b'Report 2024\n' * 10 + RUSSIAN_TEXT.encode('utf-8'))
+        self.assertEqual(utils.detect_encoding(path), 'utf-8')
+        text, truncated = utils.read_text_file(path)
+        self.assertTrue(text.endswith(RUSSIAN_TEXT))
+
+    def test_text_is_truncated(self):
+        path = self.write(RUSSIAN_TEXT.encode('cp1251'))
+        self.assertEqual(utils.read_text_file(path, max_chars=250), (RUSSIAN_TEXT[:250], True))
+        self.assertEqual(utils.read_text_file(path, max_chars=len(RUSSIAN_TEXT)), (RUSSIAN_TEXT, False))
+
+    @override_settings(TEXT_EXTRACTION_MAX_CHARS=100)
+    def test_extractor_marks_truncated_text(self):
+        result = extractors.TextExtractor().extract(self.write(RUSSIAN_TEXT.encode('koi8-r'), 'notes.md'))
+        self.assertEqual(result.text, RUSSIAN_TEXT[:100])
+        self.assertTrue(result.truncated)
+
+
+@override_settings(XLSX_ROW_BATCH=2, XLSX_MAX_ROWS_PER_SHEET=5)
+class XlsxExtractionTests(SimpleTestCase):
+    """
+    XLSX sheets are read in row batches with per-sheet limits
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.title = 'Большой'
+        for row in range(10):
+            sheet.append([f'Строка {row}', row, None])
+        sheet = workbook.create_sheet('Малый')
+        sheet.append(['Итого', 45])
+        sheet.append([])
+        sheet.append(['Подпись'])
+        self.path = os.path.join(self.directory, 'book.xlsx')
+        workbook.save(self.path)
+
+    def test_rows_are_read_in_batches(self):
+        truncated_sheets = []
+        chunks = list(utils.iter_xlsx_sheet_text(self.path, truncated_sheets))
+        self.assertEqual(chunks, [
+            ('Большой', 'Строка 0 0\nСтрока 1 1\n'),
+            ('Большой', 'Строка 2 2\nСтрока 3 3\n'),
+            ('Большой', 'Строка 4 4\n'),
+            ('Малый', 'Итого 45\nПодпись\n'),
+        ])
+        self.assertEqual(truncated_sheets, ['Большой'])
+
+    @override_settings(XLSX_MAX_ROWS_PER_SHEET=100, XLSX_MAX_CHARS_PER_SHEET=25)
+    def test_characters_are_limited_per_sheet(self):
+        result = XlsxExtractor().extract(self.path)
+        self.assertTrue(result.truncated)
+        self.assertEqual(result.pages, [
+            ('Большой', 'Строка 0 0\nСтрока 1 1\nСтр\n'),
+            ('Малый', 'Итого 45\nПодпись\n'),
+        ])
+
+    @override_settings(XLSX_MAX_ROWS_PER_SHEET=3)
+    def test_empty_rows_after_the_limit_do_not_truncate(self):
+        workbook = Workbook()
+        sheet = workbook.active
+        for row in range(3):
+            sheet.append([f'Строка {row}'])
+        # Отформатированные пустые ячейки: строки есть в файле, но значений в них нет
+        for row in range(4, 10):
+            sheet.cell(row=row, column=1).font = Font(bold=True)
+        workbook.save(self.path)
+
+        truncated_sheets = []
+        text = ''.join(text for _, text in utils.iter_xlsx_sheet_text(self.path, truncated_sheets))
+        self.assertEqual(text, 'Строка 0\nСтрока 1\nСтрока 2\n')
+        self.assertEqual(truncated_sheets, [])
+
+    def test_workbook_is_closed_when_consumer_stops_early(self):
+        with mock.patch.object(Workbook, 'close', autospec=True, side_effect=Workbook.close) as close:
+            chunks = utils.iter_xlsx_sheet_text(self.path)
+            self.assertEqual(next(chunks), ('Большой', 'Строка 0 0\nСтрока 1 1\n'))
+            chunks.close()
+        close.assert_called_once()
+
+
+def _ole_file(streams):
+    """
+    OLE2 compound file with 512-byte sectors: one FAT sector, one directory sector
+    (up to three streams) and the streams in regular sectors (no mini stream)
+    """
+    fat = [0xFFFFFFFD, 0xFFFFFFFE]
+    entries = [('Root Entry', 5, 0xFFFFFFFE, 0)]
+    data = b''
+    for name, content in streams.items():
+        count = max(1, -(-len(content) // 512))
+        start = len(fat)
+        fat += list(range(start + 1, start + count)) + [0xFFFFFFFE]
+        entries.append((name, 2, start, len(content)))
+        data += content.ljust(count * 512, b'\x00')
+
+    directory = b''
+    for name, entry_type, start, size in entries:
+        encoded = (name + '\x00').encode('utf-16-le')
+        entry = bytearray(128)
+        entry[:len(encoded)] = encoded
+        struct.pack_into('<H', entry, 0x40, len(encoded))
+        entry[0x42] = entry_type
+        struct.pack_into('<II', entry, 0x74, start, size)
+        directory += entry
+
+    header = bytearray(512)
+    header[:8] = OLE_SIGNATURE
+    struct.pack_into('<HH', header, 0x1E, 9, 6)
+    struct.pack_into('<II', header, 0x2C, 1, 1)
+    # Нулевой порог mini stream: все потоки лежат в обычных секторах
+    struct.pack_into('<III', header, 0x38, 0, 0xFFFFFFFE, 0)
+    struct.pack_into('<II', header, 0x44, 0xFFFFFFFE, 0)
+    struct.pack_into('<109I', header, 0x4C, 0, *[0xFFFFFFFF] * 108)
+    fat_sector = struct.pack(f'<{len(fat)}I', *fat).ljust(512, b'\xff')
+    return bytes(header) + fat_sector + directory.ljust(512, b'\x00') + data
+
+
+def _word_document(text):
+    # FIB с таблицей в потоке 1Table и одним фрагментом текста в UTF-16
+    word = bytearray(1024)
+    struct.pack_into('<HxxxxxxxxH', word, 0, 0xA5EC, 0x0200)
+    struct.pack_into('<H', word, 32, 14)
+    struct.pack_into('<H', word, 62, 22)
+    clx = b'\x02' + struct.pack('<III', 16, 0, len(text)) + struct.pack('<HIH', 0, len(word), 0)
+    struct.pack_into('<II', word, 154 + 33 * 8, 0, len(clx))
+    return _ole_file({'WordDocument': bytes(word) + text.encode('utf-16-le'), '1Table': clx})
+
+
+def _biff_record(record_type, body):
+    return struct.pack('<HH', record_type, len(body)) + body
+
+
+def _xls_workbook(sheet_name, label, number):
+    stream = b''.join([
+        _biff_record(0x0809, struct.pack('<HH', 0x0600, 0x0005)),
+        _biff_record(0x0085, struct.pack('<IBBBB', 0, 0, 0, len(sheet_name), 1) + sheet_name.encode('utf-16-le')),
+        _biff_record(0x00FC, struct.pack('<IIHB', 1, 1, len(label), 1) + label.encode('utf-16-le')),
+        _biff_record(0x000A, b''),
+        _biff_record(0x0809, struct.pack('<HH', 0x0600, 0x0010)),
+        _biff_record(0x00FD, struct.pack('<HHHI', 0, 0, 0, 0)),
+        _biff_record(0x0203, struct.pack('<HHHd', 0, 1, 0, number)),
+        _biff_record(0x000A, b''),
+    ])
+    return _ole_file({'Workbook': stream})
+
+
+def _ppt_presentation(*texts):
+    atoms = b''.join(
+        struct.pack('<HHI', 0, 0x0FA0, len(text.encode('utf-16-le'))) + text.encode('utf-16-le')
+        for text in texts
+    )
+    return _ole_file({'PowerPoint Document': struct.pack('<HHI', 0x000F, 0x03E8, len(atoms)) + atoms})
+
+
+class FormatDetectionTests(SimpleTestCase):
+    """
+    Files are routed to extractors by magic bytes; legacy Office files are read by documents/ole.py
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def write_zip(self, name, members):
+        path = os.path.join(self.directory, name)
+        with zipfile.ZipFile(path, 'w') as archive:
+            for member, data in members.items():
+                archive.writestr(member, data)
+        return path
+
+    def test_sniff_format(self):
+        image = BytesIO()
+        Image.new('RGB', (4, 4)).save(image, 'PNG')
+        cases = [
+            ('scan.txt', b'%PDF-1.4 test', 'pdf'),
+            ('photo.jpg', image.getvalue(), 'png'),
+            ('photo.heic', b'\x00\x00\x00\x18ftypheic' + b'\x00' * 16, 'heic'),
+            ('notes.txt', 'Обычный текст'.encode('utf-8'), None),
+            ('letter.doc', _word_document('Письмо'), 'doc'),
+            ('table.xls', _xls_workbook('Лист1', 'Смета', 1), 'xls'),
+            ('slides.ppt', _ppt_presentation('Слайд'), 'ppt'),
+        ]
+        for name, data, expected in cases:
+            with self.subTest(name=name):
+                self.assertEqual(utils.sniff_format(self.write(name, data)), expected)
+        path = self.write_zip('report.doc', {'[Content_Types].xml': '<Types/>', 'word/document.xml': '<w:document/>'})
+        self.assertEqual(utils.sniff_format(path), 'docx')
+        self.assertIsNone(utils.sniff_format(self.write_zip('archive.zip', {'readme.txt': 'text'})))
+
+    def test_extractor_is_chosen_by_content(self):
+        path = self.write_zip('report.doc', {'word/document.xml': '<w:document/>'})
+        self.assertEqual(extractors.get_extractor(path).name, 'docx')
+        self.assertEqual(extractors.get_extractor(self.write('scan.txt', b'%PDF-1.4 test')).name, 'pdf')
+        # Текстовый файл с расширением двоичного формата не передается его экстрактору
+        self.assertIsNone(extractors.get_extractor(self.write('fake.pdf', b'plain text')))
+        self.assertEqual(extractors.get_extractor(self.write('notes.md', b'# Notes')).name, 'text')
+
+    def test_utils_extract_text_from_file(self):
+        path = self.write('notes.txt', 'Заметки'.encode('utf-8'))
+        self.assertEqual(utils.extract_text_from_file(path), 'Заметки')
+        self.assertEqual(utils.extract_text_from_file(os.path.join(self.directory, 'missing.pdf')), '')
+
+    def test_doc(self):
+        path = self.write('letter.doc', _word_document('Уважаемый партнер!\rДоговор прилагается.'))
+        self.assertEqual(extractors.extract_text_from_file(path).text, 'Уважаемый партнер!\nДоговор прилагается.')
+
+    def test_xls(self):
+        path = self.write('table.xls', _xls_workbook('Смета', 'Итого', 1250.0))
+        result = extractors.extract_text_from_file(path)
+        self.assertEqual(result.pages, [('Смета', 'Итого 1250\n')])
+
+    def test_ppt(self):
+        path = self.write('slides.ppt', _ppt_presentation('Квартальный отчет', 'Выручка\rРасходы'))
+        self.assertEqual(extractors.extract_text_from_file(path).text, 'Квартальный отчет\nВыручка\nРасходы')
+
+    def test_pptx(self):
+        namespace = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+        slide = f'<p:sld xmlns:a="{namespace}" xmlns:p="p"><a:p><a:r><a:t>План </a:t></a:r><a:r><a:t>продаж</a:t></a:r></a:p></p:sld>'
+        notes = f'<p:notes xmlns:a="{namespace}" xmlns:p="p"><a:p><a:r><a:t>Заметки</a:t></a:r></a:p></p:notes>'
+        path = self.write_zip('deck.pptx', {
+            'ppt/presentation.xml': '<p:presentation/>',
+            'ppt/slides/slide2.xml': slide.replace('План', 'Итоги'),
+            'ppt/slides/slide1.xml': slide,
+            'ppt/notesSlides/notesSlide1.xml': notes,
+        })
+        self.assertEqual(extractors.extract_text_from_file(path).text, 'План продаж\nЗаметки\nИтоги продаж\n')
+
+
+class DatabaseConfigTests(TestCase):
+    """
+    Database settings from the environment and SQLite connection tuning
+    """
+    settings_path = str(settings.BASE_DIR / 'docflow' / 'settings.py')
+
+    def load_settings(self, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return runpy.run_path(self.settings_path)
+
+    def test_sqlite_is_the_default(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop('DOCFLOW_DB_ENGINE', None)
+            database = runpy.run_path(self.settings_path)['DATABASES']['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+
+    def test_postgresql_from_environment(self):
+        database = self.load_settings(
+            DOCFLOW_DB_ENGINE='postgresql', DOCFLOW_DB_NAME='docs', DOCFLOW_DB_HOST='db',
+            DOCFLOW_DB_CONN_MAX_AGE='30', DOCFLOW_DB_POOL='',
+        )['DATABASES']['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((database['NAME'], database['HOST'], database['CONN_MAX_AGE']), ('docs', 'db', 30))
+        self.assertNotIn('pool', database['OPTIONS'])
+
+    def test_connection_pool_replaces_persistent_connections(self):
+        database = self.load_settings(
+            DOCFLOW_DB_ENGINE='postgresql', DOCFLOW_DB_POOL='1', DOCFLOW_DB_POOL_MAX_SIZE='20',
+        )['DATABASES']['default']
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['pool']['max_size'], 20)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+
+
+@override_settings(TEXT_COMPRESSION_MIN_CHARS=1000)
+class DocumentContentTests(DocumentTestCase):
+    """
+    Extracted text is stored apart from the document row, long texts compressed
+    """
+    def test_long_text_is_compressed(self):
+        document = self.create_document()
+        document.text_content = RUSSIAN_TEXT
+        document.save_text()
+
+        content = DocumentContent.objects.get(document=document)
+        self.assertTrue(content.is_compressed)
+        self.assertEqual(content.text, '')
+        self.assertLess(len(bytes(content.compressed_text)), len(RUSSIAN_TEXT.encode('utf-8')))
+        self.assertEqual(Document.objects.get(pk=document.pk).text_content, RUSSIAN_TEXT)
+
+    def test_short_text_is_stored_as_is(self):
+        document = self.create_document()
+        document.text_content = 'Короткий текст'
+        document.save_text()
+        content = DocumentContent.objects.get(document=document)
+        self.assertFalse(content.is_compressed)
+        self.assertEqual(content.text, 'Короткий текст')
+
+    def test_text_changes_update_the_search_index(self):
+        document = self.create_document(title='Акт')
+        document.text_content = RUSSIAN_TEXT
+        document.save_text()
+        self.assertEqual(list(search_documents(Document.objects.all(), 'покупатель')), [document])
+
+        document.text_content = 'Смета на ремонт помещения'
+        document.save_text()
+        self.assertEqual(list(search_documents(Document.objects.all(), 'покупатель')), [])
+        self.assertEqual(list(search_documents(Document.objects.all(), 'ремонт')), [document])
+
+        document.title = 'Протокол'
+        document.save(update_fields=['title'])
+        self.assertEqual(list(search_documents(Document.objects.all(), 'протокол')), [document])
+
+        document.delete()
+        self.assertEqual(list(search_documents(Document.objects.all(), 'ремонт')), [])
+
+    def test_document_list_does_not_read_texts(self):
+        document = self.create_document()
+        document.text_content = RUSSIAN_TEXT
+        document.save_text()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/documents/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('documents_documentcontent' in query['sql'] for query in queries))
@@ -0,0 +1,169 @@
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import UploadSession, blob_atomic
+from .serializers import store_document
+from .storage import HASH_CHUNK_SIZE, compute_sha256
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class UploadConflict(Exception):
+    """
+    Raised when a chunk does not start at the current offset of the session
+    """
+    def __init__(self, offset):
+        super().__init__(f"Expected offset {offset}")
+        self.offset = offset
+
+
+class UploadedPartFile(File):
+    """
+    The assembled file of an upload session.
+    ``temporary_file_path`` lets FileSystemStorage move it into place instead of copying
+    """
+    def __init__(self, path, name, sha256):
+        super().__init__(open(path, 'rb'), name=name)
+        self.path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def start_upload(owner, title, filename, size):
+    """
+    Create an upload session and its empty temporary file
+    """
+    os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+    session = UploadSession.objects.create(owner=owner, title=title, filename=filename, size=size)
+    open(session.temp_path, 'wb').close()
+    logger.info(f"Started upload {session.pk} of {filename} ({size} bytes)")
+    return session
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Write ``length`` bytes from ``stream`` at ``offset`` and advance the session.
+    Data is written at the offset rather than appended, so repeating a chunk after
+    a lost response is harmless. If the client disconnects mid-chunk, the bytes
+    already received are kept and the upload resumes from there.
+    Returns the new offset
+    """
+    if session.status != UploadSession.ACTIVE:
+        raise serializers.ValidationError("Загрузка уже завершена")
+    if offset != session.offset:
+        raise UploadConflict(session.offset)
+    if offset + length > session.size:
+        raise serializers.ValidationError("Размер данных превышает объявленный размер файла")
+
+    written = 0
+    try:
+        with open(session.temp_path, 'r+b') as part:
+            part.seek(offset)
+            while written < length:
+                chunk = stream.read(min(HASH_CHUNK_SIZE, length - written))
+                if not chunk:
+                    break
+                part.write(chunk)
+                written += len(chunk)
+    except OSError as e:
+        # Клиент оборвал соединение: сохраняем то, что успели получить
+        logger.warning(f"Upload {session.pk}: chunk interrupted after {written} of {length} bytes: {e}")
+
+    new_offset = offset + written
+    updated = UploadSession.objects.filter(
+        pk=session.pk,
+        offset=offset,
+        status=UploadSession.ACTIVE,
+    ).update(offset=new_offset, updated_at=timezone.now())
+    if not updated:
+        # Ту же часть параллельно записал другой запрос
+        session.refresh_from_db(fields=['offset', 'status'])
+        raise UploadConflict(session.offset)
+
+    session.offset = new_offset
+    return new_offset
+
+
+def finalize_upload(session):
+    """
+    Turn a fully received upload into a Document (atomically, only once).
+    Returns the document
+    """
+    if session.status == UploadSession.COMPLETE:
+        return session.document
+    if session.offset != session.size:
+        raise serializers.ValidationError(
+            f"Файл загружен не полностью: получено {session.offset} из {session.size} байт"
+        )
+
+    path = session.temp_path
+    # Прерванная запись могла оставить данные за пределами принятого размера
+    with open(path, 'r+b') as part:
+        part.truncate(session.size)
+
+    # Хеш считается по собранному файлу: части могли прийти в разные процессы
+    # и записываться повторно после обрыва соединения
+    with open(path, 'rb') as part:
+        sha256 = compute_sha256(part)
+
+    upload = UploadedPartFile(path, session.filename, sha256)
+    try:
+        with blob_atomic():
+            locked = UploadSession.objects.select_for_update().get(pk=session.pk)
+            if locked.status == UploadSession.COMPLETE:
+                return locked.document
+
+            document = store_document(
+                upload,
+                title=locked.title,
+                owner=locked.owner,
+                file_format=os.path.splitext(locked.filename)[1].lower().replace('.', ''),
+            )
+            locked.status = UploadSession.COMPLETE
+            locked.document = document
+            locked.save(update_fields=['status', 'document', 'updated_at'])
+    finally:
+        upload.close()
+
+    # Если такой файл уже хранился, временный файл не был перемещен в хранилище
+    if os.path.exists(path):
+        os.remove(path)
+
+    session.status = UploadSession.COMPLETE
+    session.document = document
+    logger.info(f"Finished upload {session.pk}: document {document.pk}")
+    return document
+
+
+def abort_upload(session):
+    """
+    Delete an upload session and its temporary file
+    """
+    if os.path.exists(session.temp_path):
+        os.remove(session.temp_path)
+    session.delete()
+
+
+def purge_stale_uploads(older_than=None):
+    """
+    Remove sessions not updated for ``older_than`` seconds (UPLOAD_SESSION_TTL by default)
+    """
+    if older_than is None:
+        older_than = settings.UPLOAD_SESSION_TTL
+    threshold = timezone.now() - timedelta(seconds=older_than)
+    count = 0
+    for session in UploadSession.objects.filter(updated_at__lt=threshold):
+        abort_upload(session)
+        count += 1
+    if count:
+        logger.info(f"Purged {count} stale upload sessions")
+    return count
@@ -5,6 +5,7 @@ from . import views
 # Create a router and register our viewsets with it
 router = DefaultRouter()
 router.register(r'documents', views.DocumentViewSet, basename='document')
+router.register(r'uploads', views.UploadSessionViewSet, basename='upload')
 
 # URL patterns for the Documents app
 urlpatterns = [
@@ -16,6 +17,7 @@ urlpatterns = [
     path('documents/', views.document_list_page, name='document-list'),
     path('documents/upload/', views.document_upload_page, name='document-upload'),
     path('documents/<int:pk>/', views.document_view_page, name='document-view'),
+    path('documents/<int:pk>/file/', views.document_file_view, name='document-file'),
     path('documents/search/', views.search_page, name='document-search'),
     
     # Authentication URLs
@@ -3,59 +3,338 @@ import PyPDF2
 from PIL import Image
 import pytesseract
 from pdfminer.high_level import extract_text
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
 import io
 import logging
-import chardet
+import shutil
+import subprocess
+import tempfile
+import time
+import codecs
+import re
+import zipfile
+from chardet.universaldetector import UniversalDetector
 import docx
 import openpyxl
 from xml.etree import ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.conf import settings
+
+from . import ole
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:
+    # Без pillow-heif изображения HEIC не открываются
+    HEIF_SUPPORTED = False
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+# Сигнатуры форматов: формат определяется по содержимому, а не по расширению
+MAGIC_SIGNATURES = (
+    (b'%PDF-', 'pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+HEIF_BRANDS = (b'heic', b'heix', b'hevc', b'hevx', b'mif1', b'msf1')
+OOXML_MARKERS = (
+    ('word/document.xml', 'docx'),
+    ('xl/workbook.xml', 'xlsx'),
+    ('ppt/presentation.xml', 'pptx'),
+)
+
+def sniff_format(file_path):
+    """
+    Detect the format of a file from its magic bytes. Returns None for formats
+    without a signature (text, SVG) and for unknown containers
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(16)
+        for signature, file_format in MAGIC_SIGNATURES:
+            if head.startswith(signature):
+                return file_format
+        if head[4:8] == b'ftyp' and head[8:12] in HEIF_BRANDS:
+            return 'heic'
+        if head.startswith(ole.OLE_SIGNATURE):
+            return ole.detect_ole_format(f)
+    if head.startswith(b'PK\x03\x04'):
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                names = set(archive.namelist())
+        except zipfile.BadZipFile:
+            return None
+        for marker, file_format in OOXML_MARKERS:
+            if marker in names:
+                return file_format
+    return None
+
+def _extract_pdf_pages_pypdf2(file_path, start, end):
+    """
+    Extract text of pages [start, end) with PyPDF2. Runs in a pool worker
+    """
+    texts = []
+    with open(file_path, "rb") as pdf_file:
+        try:
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+        except Exception as e:
+            # Страницы шарда остаются пустыми и читаются pdfminer по одной
+            logger.error(f"PyPDF2 extraction failed on pages {start + 1}-{end}: {e}")
+            return [""] * (end - start)
+        for page_num in range(start, end):
+            try:
+                texts.append(pdf_reader.pages[page_num].extract_text() or "")
+            except Exception as e:
+                logger.error(f"PyPDF2 extraction failed on page {page_num + 1}: {e}")
+                texts.append("")
+    return texts
+
+def _extract_pdf_pages_pdfminer(file_path, page_numbers):
+    """
+    Extract text of the given pages with pdfminer.six. Runs in a pool worker
+    """
+    page_numbers = sorted(page_numbers)
+    texts = {}
+    manager = PDFResourceManager()
+    with open(file_path, "rb") as pdf_file:
+        # get_pages отдает страницы в порядке документа, поэтому zip с отсортированными номерами корректен
+        pages = PDFPage.get_pages(pdf_file, pagenos=set(page_numbers))
+        for page_num, page in zip(page_numbers, pages):
+            output = io.StringIO()
+            device = TextConverter(manager, output, laparams=LAParams())
+            try:
+                PDFPageInterpreter(manager, device).process_page(page)
+                texts[page_num] = output.getvalue()
+            except Exception as e:
+                logger.error(f"pdfminer extraction failed on page {page_num + 1}: {e}")
+            finally:
+                device.close()
+    return texts
+
+def _run_sharded(func, shards):
+    """
+    Call func(*shard) for every shard, in a process pool when there is more than one shard
+    """
+    workers = min(settings.PDF_EXTRACTION_WORKERS, len(shards))
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(func, *zip(*shards)))
+        except Exception as e:
+            logger.error(f"PDF process pool failed, extracting in the current process: {e}")
+    return [func(*shard) for shard in shards]
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
 def extract_text_from_pdf(file_path):
     """
     Extract text from a PDF file using a combination of PyPDF2 and pdfminer.six
     """
+    return "\n".join(extract_pdf_pages(file_path))
+
+def extract_pdf_pages(file_path, skipped_pages=None):
+    """
+    Extract the text of every page of a PDF file (a list of page texts).
+
+    Pages are split into shards of PDF_PAGES_PER_SHARD pages that are processed in
+    parallel. Pages where PyPDF2 found almost no text are re-extracted with pdfminer
+    one by one instead of re-parsing the whole document. Numbers of text-free pages
+    left without OCR because of its limits are appended to ``skipped_pages``.
+    """
     if not os.path.exists(file_path):
         logger.error(f"PDF file not found: {file_path}")
-        return ""
-        
-    # First try with PyPDF2
-    text = ""
+        return []
+
     try:
         with open(file_path, "rb") as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-        logger.info(f"PyPDF2 extracted {len(text)} characters from {file_path}")
+            page_count = len(PyPDF2.PdfReader(pdf_file).pages)
     except Exception as e:
         logger.error(f"PyPDF2 extraction failed: {e}")
-    
-    # If PyPDF2 didn't get much text, try with pdfminer
-    if len(text.strip()) < 50:
+        # PyPDF2 не смог разобрать файл - пробуем pdfminer целиком
         try:
             text = extract_text(file_path)
             logger.info(f"pdfminer extracted {len(text)} characters from {file_path}")
+            # pdfminer завершает каждую страницу символом перевода страницы
+            pages = text.split('\x0c')
+            if len(pages) > 1 and not pages[-1].strip():
+                pages.pop()
+            return [page.strip() for page in pages]
         except Exception as e:
             logger.error(f"pdfminer extraction failed: {e}")
-    
-    return text
+            return []
+
+    shard_size = max(1, settings.PDF_PAGES_PER_SHARD)
+    shards = [
+        (file_path, start, min(start + shard_size, page_count))
+        for start in range(0, page_count, shard_size)
+    ]
+    pages = []
+    for shard_texts in _run_sharded(_extract_pdf_pages_pypdf2, shards):
+        pages.extend(shard_texts)
+    logger.info(f"PyPDF2 extracted {sum(len(page) for page in pages)} characters from {file_path}")
+
+    # Решение о переходе на pdfminer принимается для каждой страницы отдельно
+    weak_pages = [
+        page_num for page_num, page_text in enumerate(pages)
+        if len(page_text.strip()) < settings.PDF_PAGE_MIN_CHARS
+    ]
+    if weak_pages:
+        shards = [(file_path, chunk) for chunk in _chunks(weak_pages, shard_size)]
+        for shard_texts in _run_sharded(_extract_pdf_pages_pdfminer, shards):
+            for page_num, page_text in shard_texts.items():
+                if len(page_text.strip()) > len(pages[page_num].strip()):
+                    pages[page_num] = page_text
+        logger.info(f"pdfminer re-extracted {len(weak_pages)} of {page_count} pages from {file_path}")
+
+    # Страницы без текстового слоя (сканы) распознаются через OCR
+    if settings.PDF_OCR_ENABLED:
+        blank_pages = [
+            page_num for page_num, page_text in enumerate(pages)
+            if len(page_text.strip()) < settings.PDF_PAGE_MIN_CHARS
+        ]
+        if blank_pages:
+            for page_num, page_text in ocr_pdf_pages(file_path, blank_pages, skipped_pages).items():
+                if len(page_text.strip()) > len(pages[page_num].strip()):
+                    pages[page_num] = page_text
+
+    return [page.strip() for page in pages]
+
+def _ocr_image(image, timeout=0):
+    """
+    Recognize text on a PIL image with tesseract (timeout in seconds, 0 - no limit)
+    """
+    return pytesseract.image_to_string(image, timeout=timeout)
+
+def tesseract_available():
+    """
+    Check whether the tesseract binary used by pytesseract is installed
+    """
+    return shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+
+def _init_ocr_worker():
+    # Каждый процесс пула распознает одну страницу, поэтому tesseract
+    # не должен запускать собственные потоки OpenMP
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+def rasterize_pdf_page(file_path, page_num, timeout, dpi=None):
+    """
+    Render a PDF page to images. Uses pdftoppm when it is installed, otherwise
+    takes the images embedded in the page (a scanned page is usually one image)
+    """
+    if dpi is None:
+        dpi = settings.PDF_OCR_DPI
+    if shutil.which('pdftoppm'):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            subprocess.run(
+                [
+                    'pdftoppm', '-f', str(page_num + 1), '-l', str(page_num + 1),
+                    '-r', str(dpi), '-png',
+                    file_path, os.path.join(tmp_dir, 'page'),
+                ],
+                check=True, capture_output=True, timeout=timeout,
+            )
+            images = []
+            for name in sorted(os.listdir(tmp_dir)):
+                with Image.open(os.path.join(tmp_dir, name)) as image:
+                    image.load()
+                    images.append(image.copy())
+            return images
+
+    with open(file_path, "rb") as pdf_file:
+        page = PyPDF2.PdfReader(pdf_file).pages[page_num]
+        try:
+            embedded = page.images
+        except KeyError:
+            # Страница без ресурсов
+            embedded = []
+        return [Image.open(io.BytesIO(image_file.data)) for image_file in embedded]
+
+def _ocr_pdf_page(file_path, page_num, timeout):
+    """
+    Rasterize and OCR one PDF page. Runs in an OCR pool worker
+    """
+    try:
+        images = rasterize_pdf_page(file_path, page_num, timeout)
+        return page_num, "\n".join(_ocr_image(image, timeout=timeout) for image in images)
+    except Exception as e:
+        logger.error(f"OCR failed on page {page_num + 1} of {file_path}: {e}")
+        return page_num, ""
+
+def ocr_pdf_pages(file_path, page_numbers, skipped_pages=None):
+    """
+    OCR the given pages of a PDF in a pool of PDF_OCR_WORKERS processes.
+    Each page is limited to PDF_OCR_PAGE_TIMEOUT seconds for rendering and for
+    recognition and the whole document to PDF_OCR_TOTAL_TIMEOUT seconds. Pages
+    not recognized because of these limits (or PDF_OCR_MAX_PAGES) are appended
+    to ``skipped_pages``. Returns a dict page number -> text
+    """
+    if not tesseract_available():
+        logger.warning(f"tesseract is not installed, skipping OCR of {len(page_numbers)} pages of {file_path}")
+        return {}
+
+    max_pages = settings.PDF_OCR_MAX_PAGES
+    pending = list(page_numbers)
+    if len(pending) > max_pages:
+        logger.warning(f"OCR limited to {max_pages} of {len(pending)} text-free pages of {file_path}")
+        if skipped_pages is not None:
+            skipped_pages.extend(pending[max_pages:])
+        pending = pending[:max_pages]
+
+    page_timeout = settings.PDF_OCR_PAGE_TIMEOUT
+    deadline = time.monotonic() + settings.PDF_OCR_TOTAL_TIMEOUT
+    texts = {}
+    workers = max(1, min(settings.PDF_OCR_WORKERS, len(pending)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker) as executor:
+        running = set()
+        while pending or running:
+            # Страницы запускаются, пока остается время, и таймаут страницы не выходит
+            # за общий срок: распознанное успевает вернуться до принудительного завершения
+            while pending and len(running) < workers:
+                remaining = deadline - time.monotonic()
+                if remaining < 1:
+                    break
+                page_num = pending.pop(0)
+                running.add(executor.submit(_ocr_pdf_page, file_path, page_num, min(page_timeout, remaining)))
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_num, text = future.result()
+                texts[page_num] = text
+
+    if pending:
+        logger.warning(f"OCR time limit reached, {len(pending)} pages of {file_path} are not recognized")
+        if skipped_pages is not None:
+            skipped_pages.extend(pending)
+    logger.info(
+        f"OCR recognized {sum(len(text) for text in texts.values())} characters "
+        f"on {len(texts)} pages of {file_path}"
+    )
+    return texts
 
 def extract_text_from_image(file_path):
     """
-    Extract text from image files (JPG, JPEG, PNG, GIF) using pytesseract
+    Extract text from image files (JPG, JPEG, PNG, GIF, HEIC) using pytesseract
     """
     if not os.path.exists(file_path):
         logger.error(f"Image file not found: {file_path}")
         return ""
         
+    if not HEIF_SUPPORTED and sniff_format(file_path) == 'heic':
+        logger.warning(f"pillow-heif is not installed, cannot extract text from HEIC image {file_path}")
+        return ""
+
     try:
         image = Image.open(file_path)
-        text = pytesseract.image_to_string(image)
+        text = _ocr_image(image)
         logger.info(f"pytesseract extracted {len(text)} characters from {file_path}")
         return text
     except Exception as e:
@@ -79,6 +358,126 @@ def extract_text_from_docx(file_path):
         logger.error(f"DOCX text extraction failed: {e}")
         return ""
 
+def extract_text_from_doc(file_path):
+    """
+    Extract text from legacy Word 97-2003 DOC files
+    """
+    if not os.path.exists(file_path):
+        logger.error(f"DOC file not found: {file_path}")
+        return ""
+
+    try:
+        with open(file_path, 'rb') as doc_file:
+            text = ole.doc_text(doc_file)
+        logger.info(f"doc extracted {len(text)} characters from {file_path}")
+        return text
+    except Exception as e:
+        logger.error(f"DOC text extraction failed: {e}")
+        return ""
+
+PPTX_TEXT_TAG = '{http://schemas.openxmlformats.org/drawingml/2006/main}t'
+PPTX_PARAGRAPH_TAG = '{http://schemas.openxmlformats.org/drawingml/2006/main}p'
+PPTX_PART_RE = re.compile(r'^ppt/(slides/slide|notesSlides/notesSlide)(\d+)\.xml$')
+
+def iter_pptx_text(file_path):
+    """
+    Yield the text of a PPTX presentation slide by slide (each slide followed by
+    its notes). Slide XML is parsed incrementally and paragraphs are released as
+    soon as their text is collected
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        parts = []
+        for name in archive.namelist():
+            match = PPTX_PART_RE.match(name)
+            if match:
+                parts.append((int(match.group(2)), match.group(1) != 'slides/slide', name))
+
+        for _, _, name in sorted(parts):
+            lines = []
+            runs = []
+            with archive.open(name) as xml_file:
+                for _, elem in ET.iterparse(xml_file):
+                    if elem.tag == PPTX_TEXT_TAG:
+                        if elem.text:
+                            runs.append(elem.text)
+                    elif elem.tag == PPTX_PARAGRAPH_TAG:
+                        if runs:
+                            lines.append("".join(runs))
+                            runs = []
+                        elem.clear()
+            if lines:
+                yield "\n".join(lines) + "\n"
+
+def extract_text_from_ppt(file_path):
+    """
+    Extract text from legacy PowerPoint 97-2003 PPT files
+    """
+    if not os.path.exists(file_path):
+        logger.error(f"PPT file not found: {file_path}")
+        return ""
+
+    try:
+        with open(file_path, 'rb') as ppt_file:
+            text = ole.ppt_text(ppt_file)
+        logger.info(f"ppt extracted {len(text)} characters from {file_path}")
+        return text
+    except Exception as e:
+        logger.error(f"PPT text extraction failed: {e}")
+        return ""
+
+def iter_xlsx_text(file_path, truncated_sheets=None):
+    """
+    Yield the text of an XLSX workbook in batches of XLSX_ROW_BATCH rows
+    """
+    for _, chunk in iter_xlsx_sheet_text(file_path, truncated_sheets):
+        yield chunk
+
+def iter_xlsx_sheet_text(file_path, truncated_sheets=None):
+    """
+    Yield (sheet title, text) pairs of an XLSX workbook in batches of XLSX_ROW_BATCH rows.
+
+    Empty cells and rows are skipped, every sheet is limited by
+    XLSX_MAX_ROWS_PER_SHEET, XLSX_MAX_CELLS_PER_SHEET (non-empty cells) and
+    XLSX_MAX_CHARS_PER_SHEET, and the workbook is closed even if the
+    consumer stops early. Titles of truncated sheets are appended to
+    truncated_sheets if it is given
+    """
+    max_rows = settings.XLSX_MAX_ROWS_PER_SHEET
+    max_cells = settings.XLSX_MAX_CELLS_PER_SHEET
+    max_chars = settings.XLSX_MAX_CHARS_PER_SHEET
+    batch_size = settings.XLSX_ROW_BATCH
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            batch = []
+            cells = 0
+            chars = 0
+            for row_num, row in enumerate(sheet.iter_rows(values_only=True)):
+                values = [str(value) for value in row if value is not None and value != ""]
+                if not values:
+                    continue
+                # Лист считается обрезанным, только если после предела есть непустые строки
+                if row_num >= max_rows or cells >= max_cells or chars >= max_chars:
+                    logger.warning(f"XLSX sheet '{sheet.title}' of {file_path} truncated at row {row_num}")
+                    if truncated_sheets is not None:
+                        truncated_sheets.append(sheet.title)
+                    break
+
+                values = values[:max_cells - cells]
+                line = " ".join(values)[:max_chars - chars]
+                cells += len(values)
+                chars += len(line) + 1
+
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    yield sheet.title, "\n".join(batch) + "\n"
+                    batch = []
+            if batch:
+                yield sheet.title, "\n".join(batch) + "\n"
+    finally:
+        workbook.close()
+
 def extract_text_from_xlsx(file_path):
     """
     Extract text from XLSX files
@@ -86,42 +485,134 @@ def extract_text_from_xlsx(file_path):
     if not os.path.exists(file_path):
         logger.error(f"XLSX file not found: {file_path}")
         return ""
-    
+
+    output = io.StringIO()
     try:
-        workbook = openpyxl.load_workbook(file_path, read_only=True)
-        text = []
-        for sheet in workbook.worksheets:
-            for row in sheet.rows:
-                row_text = [str(cell.value) if cell.value is not None else "" for cell in row]
-                text.append(" ".join(row_text))
-        
-        result = "\n".join(text)
-        logger.info(f"xlsx extracted {len(result)} characters from {file_path}")
-        return result
+        for chunk in iter_xlsx_text(file_path):
+            output.write(chunk)
     except Exception as e:
         logger.error(f"XLSX text extraction failed: {e}")
         return ""
 
+    result = output.getvalue()
+    logger.info(f"xlsx extracted {len(result)} characters from {file_path}")
+    return result
+
+def iter_xls_sheet_text(file_path, truncated_sheets=None):
+    """
+    Yield (sheet name, text) pairs of a legacy XLS (BIFF8) workbook with the same
+    per-sheet limits as XLSX
+    """
+    max_rows = settings.XLSX_MAX_ROWS_PER_SHEET
+    max_cells = settings.XLSX_MAX_CELLS_PER_SHEET
+    max_chars = settings.XLSX_MAX_CHARS_PER_SHEET
+
+    with open(file_path, 'rb') as xls_file:
+        for sheet_name, cells in ole.iter_xls_sheets(xls_file):
+            cells = [cell for cell in cells if cell[2]]
+            cells.sort(key=lambda cell: (cell[0], cell[1]))
+            lines = []
+            chars = 0
+            truncated = len(cells) > max_cells
+            current_row = None
+            values = []
+            for row, col, value in cells[:max_cells]:
+                if row != current_row:
+                    if values:
+                        lines.append(" ".join(values))
+                        chars += len(lines[-1]) + 1
+                    if len(lines) >= max_rows or chars >= max_chars:
+                        truncated = True
+                        values = []
+                        break
+                    current_row = row
+                    values = []
+                values.append(value)
+            if values:
+                lines.append(" ".join(values))
+
+            text = "\n".join(lines)
+            if len(text) > max_chars:
+                text = text[:max_chars]
+                truncated = True
+            if truncated:
+                logger.warning(f"XLS sheet '{sheet_name}' of {file_path} truncated")
+                if truncated_sheets is not None:
+                    truncated_sheets.append(sheet_name)
+            if text:
+                yield sheet_name, text + "\n"
+
+def detect_encoding(file_path, sample_size=None):
+    """
+    Detect the encoding of a text file from a prefix of at most sample_size bytes
+    """
+    if sample_size is None:
+        sample_size = settings.TEXT_ENCODING_SAMPLE_BYTES
+
+    detector = UniversalDetector()
+    read = 0
+    with open(file_path, 'rb') as file:
+        while read < sample_size and not detector.done:
+            chunk = file.read(min(8192, sample_size - read))
+            if not chunk:
+                break
+            detector.feed(chunk)
+            read += len(chunk)
+    detector.close()
+
+    encoding = detector.result['encoding'] or 'utf-8'
+    # Если в начале файла только ASCII, дальше вероятнее всего UTF-8
+    if encoding.lower() == 'ascii':
+        encoding = 'utf-8'
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = 'utf-8'
+    return encoding
+
+def read_text_file(file_path, max_chars=None):
+    """
+    Decode a text file in a single streaming pass with the encoding detected from
+    a bounded prefix. Returns (text, truncated); at most max_chars characters are read
+    """
+    encoding = detect_encoding(file_path)
+    chunk_size = settings.TEXT_EXTRACTION_CHUNK_CHARS
+
+    output = io.StringIO()
+    written = 0
+    truncated = False
+    # Некорректные байты после проверенного начала файла заменяются, а не прерывают извлечение
+    with open(file_path, 'r', encoding=encoding, errors='replace') as file:
+        while True:
+            size = chunk_size if max_chars is None else min(chunk_size, max_chars - written)
+            if size <= 0:
+                truncated = bool(file.read(1))
+                break
+            chunk = file.read(size)
+            if not chunk:
+                break
+            output.write(chunk)
+            written += len(chunk)
+
+    text = output.getvalue()
+    if truncated:
+        logger.warning(f"Text file {file_path} truncated to {max_chars} characters")
+    logger.info(f"Text file extracted {len(text)} characters from {file_path} ({encoding})")
+    return text, truncated
+
 def extract_text_from_text_file(file_path):
     """
-    Extract text from TXT, MD files
+    Extract text from TXT, MD files.
+
+    The encoding is detected from a bounded prefix, then the file is decoded in a
+    single streaming pass. Text beyond TEXT_EXTRACTION_MAX_CHARS is not read
     """
     if not os.path.exists(file_path):
         logger.error(f"Text file not found: {file_path}")
         return ""
-    
+
     try:
-        # Detect encoding
-        with open(file_path, 'rb') as file:
-            raw_data = file.read()
-            result = chardet.detect(raw_data)
-            encoding = result['encoding']
-        
-        # Read the file with detected encoding
-        with open(file_path, 'r', encoding=encoding) as file:
-            text = file.read()
-        
-        logger.info(f"Text file extracted {len(text)} characters from {file_path}")
+        text, truncated = read_text_file(file_path, settings.TEXT_EXTRACTION_MAX_CHARS)
         return text
     except Exception as e:
         logger.error(f"Text file extraction failed: {e}")
@@ -148,29 +639,9 @@ def extract_text_from_svg(file_path):
 
 def extract_text_from_file(file_path):
     """
-    Extract text from a file based on its extension
+    Extract text from a file in the current process (kept for existing callers:
+    the format is chosen by the extractor registry in documents/extractors.py)
     """
-    if not file_path or not os.path.exists(file_path):
-        logger.error(f"File not found or invalid path: {file_path}")
-        return ""
-        
-    _, file_extension = os.path.splitext(file_path)
-    file_extension = file_extension.lower().replace('.', '')
-    
-    logger.info(f"Extracting text from file: {file_path} with extension: {file_extension}")
-    
-    if file_extension == 'pdf':
-        return extract_text_from_pdf(file_path)
-    elif file_extension in ['jpg', 'jpeg', 'png', 'gif', 'heic']:
-        return extract_text_from_image(file_path)
-    elif file_extension in ['docx', 'doc']:
-        return extract_text_from_docx(file_path)
-    elif file_extension in ['xlsx', 'xls']:
-        return extract_text_from_xlsx(file_path)
-    elif file_extension in ['txt', 'md']:
-        return extract_text_from_text_file(file_path)
-    elif file_extension == 'svg':
-        return extract_text_from_svg(file_path)
-    else:
-        logger.warning(f"Unsupported file extension for text extraction: {file_extension}")
-        return "" 
\ No newline at end of file
+    # Импорт внутри функции: extractors сам импортирует этот модуль
+    from .extractors import extract_text_from_file as extract
+    return extract(file_path).text
@@ -1,14 +1,19 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from rest_framework import viewsets, filters, status, permissions
+from rest_framework import viewsets, filters, status, permissions, mixins, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Q
-from .models import Document
-from .serializers import DocumentSerializer
+from .models import Document, ExtractionJob, UploadSession
+from .serializers import DocumentSerializer, DocumentListSerializer, UploadSessionSerializer
+from .search import search_documents, search_transaction, get_page_hits, get_snippets
+from . import search_cache
+from .file_serving import serve_document_file, serve_preview
+from .previews import CONTENT_TYPES as PREVIEW_CONTENT_TYPES, get_preview, preview_format, supports_preview
+from .tasks import enqueue_preview
+from .bulk_upload import TooManyFiles, collect_upload_items, create_documents
+from .uploads import UploadConflict, abort_upload, finalize_upload, start_upload, write_chunk
 import logging
-from django.http import FileResponse, HttpResponse
-import os
-import mimetypes
+from django.conf import settings
+from django.http import HttpResponse
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
@@ -28,7 +33,47 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
             return True
 
         # Write permissions are only allowed to the owner
-        return obj.owner == request.user
+        return obj.owner_id == request.user.id
+
+def search_response_data(request, queryset, query, serializer_class, fields, context, paginator):
+    """
+    Response data of a document search: a page of hits (or all hits without
+    pagination) with the snippets and matching pages requested in the query string.
+    Shared by DocumentViewSet.search and the async search view
+    """
+    # Одинаковые запросы пользователя отдаются из кэша до изменения его документов
+    cache_key = None
+    if settings.SEARCH_CACHE_ENABLED:
+        cache_key = search_cache.search_cache_key(request.user.pk, query, request.query_params)
+        data = search_cache.get_cached_results(cache_key)
+        if data is not None:
+            return data
+    
+    fuzzy = request.query_params.get('fuzzy') in ('1', 'true')
+    highlight = request.query_params.get('highlight') in ('1', 'true')
+    with_pages = request.query_params.get('pages') in ('1', 'true')
+    
+    with search_transaction(fuzzy):
+        documents = search_documents(queryset, query, fuzzy=fuzzy)
+        page = paginator.paginate_queryset(documents, request) if paginator is not None else None
+        paginated = page is not None
+        if not paginated:
+            page = list(documents)
+        
+        context = dict(context)
+        document_ids = [doc.pk for doc in page]
+        if highlight:
+            context['snippets'] = get_snippets(document_ids, query, fuzzy=fuzzy)
+        if with_pages:
+            context['page_hits'] = get_page_hits(document_ids, query, fuzzy=fuzzy)
+        kwargs = {'fields': fields} if fields else {}
+        data = serializer_class(page, many=True, context=context, **kwargs).data
+        if paginated:
+            data = paginator.get_paginated_response(data).data
+    
+    if cache_key is not None:
+        search_cache.cache_results(cache_key, data)
+    return data
 
 class DocumentViewSet(viewsets.ModelViewSet):
     """
@@ -43,7 +88,41 @@ class DocumentViewSet(viewsets.ModelViewSet):
         for the currently authenticated user.
         """
         user = self.request.user
-        return Document.objects.filter(owner=user).order_by('-upload_date')
+        # owner загружается тем же запросом: сериализаторы выводят owner_username
+        queryset = Document.objects.filter(owner=user).select_related('owner').order_by('-upload_date', '-id')
+        if self.action == 'preview':
+            queryset = queryset.select_related('blob')
+        
+        # Извлеченный текст хранится отдельно и загружается только для ответов, которые его содержат
+        if self.action not in ('download', 'preview', 'destroy') and self.get_serializer_class() is DocumentSerializer:
+            queryset = queryset.select_related('content')
+        return queryset
+    
+    def get_requested_fields(self):
+        """
+        Fields requested with ?fields=a,b,c or None if all fields are needed
+        """
+        value = self.request.query_params.get('fields') if self.request else None
+        if not value:
+            return None
+        return [name.strip() for name in value.split(',') if name.strip()]
+    
+    def get_serializer_class(self):
+        """
+        Use the slim serializer for list and search unless text_content is requested
+        """
+        if self.action in ('list', 'search'):
+            fields = self.get_requested_fields()
+            if not fields or 'text_content' not in fields:
+                return DocumentListSerializer
+        return DocumentSerializer
+    
+    def get_serializer(self, *args, **kwargs):
+        if self.request and self.request.method == 'GET':
+            fields = self.get_requested_fields()
+            if fields:
+                kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
     
     def create(self, request, *args, **kwargs):
         """
@@ -64,80 +143,96 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Upload many documents in one request: multipart ``files`` and/or ZIP
+        ``archive`` fields. Titles are taken from the file names.
+        Returns per-file results in the order of the files
+        """
+        files = request.FILES.getlist('files')
+        archives = request.FILES.getlist('archive')
+        if not files and not archives:
+            return Response(
+                {"error": "Файлы не предоставлены"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            items = collect_upload_items(files, archives)
+        except TooManyFiles as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        documents = create_documents(items, request.user)
+        results = [item.as_dict() for item in items]
+        return Response(
+            {
+                "created": len(documents),
+                "failed": len(items) - len(documents),
+                "results": results,
+            },
+            status=status.HTTP_201_CREATED if documents else status.HTTP_400_BAD_REQUEST
+        )
+    
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         """
-        Download document with proper content type
+        Download document with proper content type.
+        Supports Range requests and conditional requests (ETag/Last-Modified)
         """
         document = self.get_object()
-        file_path = document.file.path
         
-        if not os.path.exists(file_path):
+        try:
+            return serve_document_file(request, document)
+        except FileNotFoundError:
             return Response(
                 {"error": "Файл не найден"},
                 status=status.HTTP_404_NOT_FOUND
             )
-            
-        # Определяем MIME-тип файла
-        content_type, encoding = mimetypes.guess_type(file_path)
-        if content_type is None:
-            # Явное определение MIME-типов для известных форматов
-            if document.file_format == 'pdf':
-                content_type = 'application/pdf'
-            elif document.file_format in ['jpg', 'jpeg']:
-                content_type = 'image/jpeg'
-            elif document.file_format == 'png':
-                content_type = 'image/png'
-            elif document.file_format == 'gif':
-                content_type = 'image/gif'
-            elif document.file_format == 'svg':
-                content_type = 'image/svg+xml'
-            elif document.file_format == 'heic':
-                content_type = 'image/heic'
-            elif document.file_format == 'doc':
-                content_type = 'application/msword'
-            elif document.file_format == 'docx':
-                content_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            elif document.file_format == 'xls':
-                content_type = 'application/vnd.ms-excel'
-            elif document.file_format == 'xlsx':
-                content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            elif document.file_format == 'ppt':
-                content_type = 'application/vnd.ms-powerpoint'
-            elif document.file_format == 'pptx':
-                content_type = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
-            elif document.file_format == 'txt':
-                content_type = 'text/plain'
-            elif document.file_format == 'md':
-                content_type = 'text/markdown'
-            else:
-                content_type = 'application/octet-stream'
-        
-        # Имя файла для загрузки
-        filename = os.path.basename(document.file.name)
-        
-        # Создаем FileResponse с правильными заголовками
-        response = FileResponse(
-            open(file_path, 'rb'),
-            content_type=content_type,
-            as_attachment=False,  # Просмотр в браузере вместо загрузки
-            filename=filename
-        )
-        
-        # Добавляем заголовки безопасности
-        response['X-Content-Type-Options'] = 'nosniff'
-        response['Content-Disposition'] = f'inline; filename="{filename}"'
+    
+    @action(detail=True, methods=['get'])
+    def preview(self, request, pk=None):
+        """
+        Small preview of an image or of the first page of a PDF:
+        ?size=thumb (for lists, default) or ?size=page (for the document page).
+        A preview that does not exist yet is queued and 202 is returned
+        """
+        document = self.get_object()
+        size_name = request.query_params.get('size', 'thumb')
+        if size_name not in settings.PREVIEW_SIZES:
+            return Response(
+                {"error": f"Неизвестный размер превью: {size_name}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Специальные заголовки для PDF
-        if document.file_format == 'pdf':
-            response['Accept-Ranges'] = 'bytes'
+        if not settings.PREVIEW_ENABLED or not supports_preview(document):
+            return Response(
+                {"error": "Предпросмотр недоступен"},
+                status=status.HTTP_404_NOT_FOUND
+            )
         
-        return response
+        path = get_preview(document, size_name)
+        if path is None:
+            # Превью еще нет: отрисовка ставится в очередь, а не выполняется в запросе
+            job = enqueue_preview(document)
+            path = get_preview(document, size_name)
+            if path is None:
+                if job.status == ExtractionJob.FAILED:
+                    return Response(
+                        {"error": "Предпросмотр недоступен"},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                return Response({"status": job.status}, status=status.HTTP_202_ACCEPTED)
+        return serve_preview(request, path, PREVIEW_CONTENT_TYPES[preview_format()])
     
     @action(detail=False, methods=['get'])
     def search(self, request):
         """
-        Search documents by title or content
+        Search documents by title or content.
+        Results are ranked; "quoted phrases" and prefix* queries are supported.
+        Pass ?highlight=1 to get a highlighted snippet for every hit and
+        ?pages=1 to get the matching pages (PDF pages, spreadsheet sheets).
+        ?fuzzy=1 also matches similar words, e.g. misrecognized by OCR
         """
         query = request.query_params.get('q', '')
         if not query:
@@ -146,19 +241,98 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Search in both title and text_content, only for user's documents
-        documents = Document.objects.filter(
-            Q(title__icontains=query) | Q(text_content__icontains=query),
-            owner=request.user
-        ).order_by('-upload_date')
+        # Full-text search in title and text_content, only for user's documents
+        data = search_response_data(
+            request, self.get_queryset(), query, self.get_serializer_class(),
+            self.get_requested_fields(), self.get_serializer_context(), self.paginator,
+        )
+        return Response(data)
+    
+    @action(detail=False, methods=['get'], url_path='search/cache-stats', permission_classes=[permissions.IsAdminUser])
+    def search_cache_stats(self, request):
+        """
+        Hit ratio of the search result cache (for staff users)
+        """
+        return Response(search_cache.stats())
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Resumable chunked upload of large documents:
+    POST /api/uploads/ starts a session, PUT /api/uploads/<id>/chunk/ sends the
+    bytes starting at the ``Upload-Offset`` header and POST /api/uploads/<id>/finalize/
+    creates the document. GET returns the offset to resume an interrupted upload from
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
+    
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        serializer.instance = start_upload(self.request.user, data['title'], data['filename'], data['size'])
+    
+    def perform_destroy(self, instance):
+        abort_upload(instance)
+    
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        """
+        Write the request body at the given offset.
+        The body is read from the request stream directly, so it is never buffered in memory
+        """
+        session = self.get_object()
         
-        page = self.paginate_queryset(documents)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-            
-        serializer = self.get_serializer(documents, many=True)
-        return Response(serializer.data)
+        offset = request.headers.get('Upload-Offset', request.query_params.get('offset'))
+        try:
+            offset = int(offset)
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "Укажите смещение части в заголовке Upload-Offset"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response(
+                {"error": f"Размер части превышает {settings.UPLOAD_CHUNK_MAX_SIZE} байт"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        
+        try:
+            new_offset = write_chunk(session, offset, request.stream, length)
+        except UploadConflict as e:
+            return Response(
+                {"error": "Неверное смещение части", "offset": e.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+        except serializers.ValidationError as e:
+            return Response({"error": str(e.detail[0])}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if new_offset < offset + length:
+            # Соединение оборвалось: клиент продолжит с сохраненного смещения
+            return Response(
+                {"error": "Часть получена не полностью", "offset": new_offset},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({"offset": new_offset}, headers={'Upload-Offset': str(new_offset)})
+    
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """
+        Create the document from a fully received upload
+        """
+        session = self.get_object()
+        try:
+            document = finalize_upload(session)
+        except serializers.ValidationError as e:
+            return Response({"error": str(e.detail[0])}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = DocumentSerializer(document, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 def home_page(request):
     """
@@ -189,7 +363,9 @@ def document_upload_page(request):
         'login_username': request.session.get('login_username', ''),
         'register_username': request.session.get('register_username', ''),
         'register_email': request.session.get('register_email', ''),
-        'reset_email': request.session.get('reset_email', '')
+        'reset_email': request.session.get('reset_email', ''),
+        # Страница загружает файлы по частям
+        'max_upload_mb': settings.UPLOAD_SESSION_MAX_SIZE // (1024 * 1024),
     }
     return render(request, 'documents/upload.html', context)
 
@@ -212,10 +388,11 @@ def document_view_page(request, pk):
     """
     Render the document view page
     """
-    document = get_object_or_404(Document, pk=pk)
+    # Странице нужен только владелец: данные документа загружаются через API
+    document = get_object_or_404(Document.objects.only('id', 'owner_id'), pk=pk)
     
     # Check if the user is the owner of the document
-    if not request.user.is_authenticated or document.owner != request.user:
+    if not request.user.is_authenticated or document.owner_id != request.user.id:
         return redirect(f"{reverse('document-list')}?show_login_modal=1")
         
     context = {
@@ -251,60 +428,18 @@ def search_page(request):
 def document_file_view(request, pk):
     """
     Serve document file directly with proper content type
+    (streamed, with Range and conditional request support)
     """
     document = get_object_or_404(Document, pk=pk)
     
     # Check if the user is the owner of the document
-    if not request.user.is_authenticated or document.owner != request.user:
+    if not request.user.is_authenticated or document.owner_id != request.user.id:
         return redirect(f"{reverse('document-list')}?show_login_modal=1")
         
-    file_path = document.file.path
-    
-    # Определяем MIME-тип файла
-    content_type, encoding = mimetypes.guess_type(file_path)
-    if content_type is None:
-        # Явное определение MIME-типов для известных форматов
-        if document.file_format == 'pdf':
-            content_type = 'application/pdf'
-        elif document.file_format in ['jpg', 'jpeg']:
-            content_type = 'image/jpeg'
-        elif document.file_format == 'png':
-            content_type = 'image/png'
-        elif document.file_format == 'gif':
-            content_type = 'image/gif'
-        elif document.file_format == 'svg':
-            content_type = 'image/svg+xml'
-        elif document.file_format == 'heic':
-            content_type = 'image/heic'
-        elif document.file_format == 'doc':
-            content_type = 'application/msword'
-        elif document.file_format == 'docx':
-            content_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        elif document.file_format == 'xls':
-            content_type = 'application/vnd.ms-excel'
-        elif document.file_format == 'xlsx':
-            content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        elif document.file_format == 'ppt':
-            content_type = 'application/vnd.ms-powerpoint'
-        elif document.file_format == 'pptx':
-            content_type = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
-        elif document.file_format == 'txt':
-            content_type = 'text/plain'
-        elif document.file_format == 'md':
-            content_type = 'text/markdown'
-        else:
-            content_type = 'application/octet-stream'
-    
-    # Открываем файл и создаем HTTP-ответ
     try:
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
-            
-        response = HttpResponse(file_data, content_type=content_type)
-        response['Content-Disposition'] = f'inline; filename="{os.path.basename(document.file.name)}"'
-        return response
+        return serve_document_file(request, document)
     except IOError:
-        logger.error(f"Error opening document file: {file_path}")
+        logger.error(f"Error opening document file: {document.file.name}")
         return HttpResponse("Ошибка при чтении файла", status=404)
 
 def user_login(request):
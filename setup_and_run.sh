@@ -23,6 +23,12 @@ else
     python manage.py createsuperuser
 fi
 
+# Запуск фонового обработчика очереди извлечения текста (останавливается вместе с сервером)
+echo "Запуск обработчика извлечения текста..."
+python manage.py process_extraction_jobs &
+WORKER_PID=$!
+trap 'kill -TERM $WORKER_PID 2>/dev/null; wait $WORKER_PID' EXIT
+
 # Запуск сервера
 echo "Запуск сервера Django..."
 python manage.py runserver 
\ No newline at end of file